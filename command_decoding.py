@@ -0,0 +1,48 @@
+import whisper
+import numpy as np
+import torch
+
+# Command-aware Whisper decoding, shared by incrediplotter-ai.py (when it loads the
+# model itself) and whisper-server.py, so the two always decode the same way.
+
+
+def decode_command(model, audio, prompt, check_tokens, max_tokens):
+    """
+    Decodes a short "draw ..." command instead of doing a full model.transcribe().
+
+    The audio is encoded once, then decoded greedily (no temperature fallback) with
+    example commands as the prompt. Only check_tokens tokens are decoded at first;
+    if they don't start with "draw" we stop there, otherwise decoding carries on
+    from those tokens up to max_tokens in all. Commands are short, so anything past
+    30 seconds is dropped.
+
+    Returns:
+        str: The transcribed command, or None if it doesn't start with "draw".
+    """
+    audio = whisper.pad_or_trim(np.asarray(audio, dtype=np.float32).reshape(-1))
+    fp16 = model.device.type == "cuda"
+    mel = whisper.log_mel_spectrogram(audio, n_mels=model.dims.n_mels).to(model.device)
+    if fp16:
+        mel = mel.half()
+    with torch.no_grad():
+        # decode() skips the encoder when it's given audio features instead of a mel
+        audio_features = model.embed_audio(mel.unsqueeze(0))[0]
+
+    def greedy_decode(sample_len, prefix=None):
+        options = whisper.DecodingOptions(language="en", temperature=0.0, sample_len=sample_len,
+                                          prompt=prompt, prefix=prefix, without_timestamps=True, fp16=fp16)
+        return whisper.decode(model, audio_features, options)
+
+    first = greedy_decode(check_tokens)
+    first_words = first.text.strip()
+    if not first_words.lower().lstrip("\"' ").startswith("draw"):
+        print(f'Stopped decoding early, heard: "{first_words}..."')
+        return None
+    if len(first.tokens) < check_tokens or len(first.tokens) >= max_tokens:
+        return first_words  # Already ended, or that's all we're decoding
+    # Carry on after the tokens we have rather than decoding them again. The result's
+    # text is stripped, so the whole command is decoded from the tokens
+    rest = greedy_decode(max_tokens - len(first.tokens), prefix=first.tokens)
+    tokenizer = whisper.tokenizer.get_tokenizer(model.is_multilingual, num_languages=model.num_languages,
+                                                language="en", task="transcribe")
+    return tokenizer.decode(first.tokens + rest.tokens).strip()
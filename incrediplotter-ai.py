@@ -1,4 +1,3 @@
-import whisper
 import sounddevice as sd
 from scipy.io.wavfile import write
 import numpy as np
@@ -14,19 +13,103 @@ import subprocess
 import requests
 import random
 import string
-from tiktok_voice import tts, Voice
+from tiktok_voice import tts_stream, Voice, AudioCache, set_cache, cached_audio, presynthesize
+from plotter import vectorize_image, write_svg, load_gwrite_profile, preprocess_image
+from plotter import prepare_lines, iter_gwrite, home_position, gcode_lines
+from plotter import load_machine_settings, estimate_gcode_time, estimate_lines_time, fit_time_budget, format_duration
+from plotter import postprocess_gcode, estimate_postprocessed_lines
+from plotter.gcode import SIMPLIFY_TOLERANCE_MM, ARC_TOLERANCE_MM
+from plotter.postprocess import JOIN_TRAVEL_MM, HOP_TRAVEL_MM
 import threading
+import queue
+import collections
+import concurrent.futures
 from playsound import playsound
 import pyttsx3
 import traceback
 import serial
+import socket
+import json
+import hashlib
+import shutil
 
 # --- Configuration ---
 MODEL_TYPE = "base.en"  # Options: "tiny", "base", "small", "medium", "large"
 SAMPLE_RATE = 16000  # Whisper internal sample rate is 16kHz
 FILENAME = "temp_recording.wav"
+IN_MEMORY_AUDIO = True  # Hand the recording straight to Whisper instead of going through FILENAME
+SAVE_DEBUG_WAV = False  # Also dump each recording to FILENAME (in the background) for debugging
+# Command-aware decoding: prime Whisper with example commands, decode greedily with a
+# token cap, and give up after the first few tokens if they aren't "draw"
+COMMAND_DECODING = True
+COMMAND_PROMPT = "Draw a cat. Draw a house. Draw a robot riding a bicycle."
+COMMAND_CHECK_TOKENS = 3  # Tokens decoded before checking for "draw"
+COMMAND_MAX_TOKENS = 32  # Plenty for "draw a ..." commands
+CAPTURE_MODE = "enter"  # "enter" to start/stop recording with ENTER (or KEYPAD_RECORD_KEY), "vad" to record hands-free
+# Hands-free (voice activity detection) settings
+VAD_BLOCK_SECONDS = 0.03  # Size of the blocks the microphone callback gets
+VAD_SPEECH_RATIO = 3.0  # A block is speech if it's this many times louder than the background noise
+VAD_MIN_RMS = 0.01  # ...and at least this loud
+VAD_ONSET_SECONDS = 0.09  # How much speech in a row starts an utterance
+VAD_PRE_ROLL_SECONDS = 0.3  # Audio kept from before the onset so the first word isn't clipped
+VAD_HANGOVER_SECONDS = 0.8  # How much silence ends an utterance
+VAD_TAIL_SECONDS = 0.2  # Silence kept after the last speech
+VAD_MIN_SPEECH_SECONDS = 0.3  # Shorter bursts (clicks, coughs) are thrown away
+VAD_MAX_SECONDS = 10  # Cut off anyone who just keeps talking
+# Wake word settings. None skips the wake word, "whisper" runs a tiny Whisper model over
+# overlapping windows (only when it's loud enough), "porcupine" needs a PICOVOICE_KEY.
+# Pairs best with CAPTURE_MODE = "vad".
+WAKE_WORD_DETECTOR = None
+WAKE_WORD = "computer"
+WAKE_WHISPER_MODEL = "tiny.en"
+WAKE_WINDOW_SECONDS = 2.0  # Each window is this long...
+WAKE_HOP_SECONDS = 0.5  # ...and starts this long after the previous one, so words on a boundary aren't missed
+PREPROCESS_IMAGE = True  # Otsu threshold, despeckle and downscale to pen resolution (plotter/preprocess.py) instead of a fixed threshold
+VECTORIZER = "native"  # "native" (plotter/vectorize.py, no external program) or "autotrace" (Windows only)
+GCODE_WRITER = "builtin"  # "builtin" (plotter/gcode.py, in this process) or "vpype" (runs the vpype command). Needs the native vectorizer
+OPTIMIZE_TRAVEL = True  # Reorder/join strokes for less pen-up travel (plotter/travel.py). Builtin G-code writer only
+# Pen lifts: "always" lifts for every travel move, like vpype writes it. "join" keeps the pen down over gaps
+# too small to see (plotter/postprocess.py). "hop" also lifts only partway for short travel, which needs the
+# PEN_UP_FAST/PEN_DOWN_FAST macros from printer.cfg in Klipper
+PEN_LIFTS = "join"
+ARC_FITTING = False  # Write curves as G2/G3 arcs, much smaller G-code. Needs the [gcode_arcs] section from printer.cfg in Klipper
+PLOT_TIME_BUDGET_SECONDS = 10 * 60  # Longer drawings lose their shortest strokes until they fit
+DRAWING_CANDIDATES = 1  # Images generated at once per request; the quickest, cleanest one to plot is kept. Needs the native vectorizer
+CANDIDATE_DEADLINE_SECONDS = 20  # Candidates not back this long after asking are dropped (unless none are back yet)
+CANDIDATE_WEIGHTS = {"minutes": 1.0, "paths": 0.01, "ink": 20.0}  # Score = sum of weight * value, lowest wins
 MOONRAKER_URL = "http://localhost"
-VIRTUAL_COM_PORT = "COM4"
+UPLOAD_CHUNK_BYTES = 64 * 1024  # G-code is sent to Moonraker in pieces about this big
+MOONRAKER_TIMEOUT = (5, 60)  # Seconds to connect, and to wait for a reply
+MOONRAKER_RETRIES = 3  # Connection errors, timeouts and 5xx replies are retried this many times...
+MOONRAKER_BACKOFF_SECONDS = 0.5  # ...after waiting this long, doubling each time
+MOONRAKER_MAX_BACKOFF_SECONDS = 30  # Longest wait between websocket reconnects
+MOONRAKER_POLL_SECONDS = 5  # How often to ask over HTTP when the websocket is down
+PLOT_QUEUE = "local"  # "local" (start each drawing when the plotter goes idle) or "moonraker" (via Moonraker's [job_queue])
+VIRTUAL_COM_PORT = "COM4"  # The keypad. keypad-simulator.py prints a path to use instead
+KEYPAD_BAUD_RATE = 9600
+KEYPAD_RECONNECT_SECONDS = 2.0
+KEYPAD_WINDOW = 4  # Commands written to the keypad before waiting for its OKs
+KEYPAD_ACK_TIMEOUT_SECONDS = 1.0  # No OK in this long: the keypad is gone (or never sends them)
+KEYPAD_RECORD_KEY = "A"  # Starts and stops a recording, like ENTER
+KEYPAD_QUIT_KEY = "D"  # Like Q. None to not quit from the keypad
+WHISPER_SERVER_ADDRESS = ("127.0.0.1", 5005)  # See whisper-server.py. Set to None to always load the model here
+PIPELINE_QUEUE_SIZE = 2  # How many requests can wait between two pipeline stages
+DRAWING_CACHE_DIR = "drawing_cache"  # Set to None to always generate a fresh drawing
+DRAWING_CACHE_MAX_BYTES = 200 * 1000 * 1000
+TTS_VOICE = Voice.US_FEMALE_1
+TTS_CACHE_DIR = "tts_cache"  # Synthesized speech kept on disk. Set to None to always synthesize
+TTS_CACHE_MAX_BYTES = 50 * 1000 * 1000
+# What main() and the pipeline say most. Synthesized in the background at startup so
+# they play straight from the TTS cache; anything else is spoken with pyttsx3
+STOCK_PHRASES = [
+    "Quit requested",
+    "Whisper init fail",
+    "png_path is empty. skipping.",
+    "Nothing to draw. skipping.",
+    "gcode_path is empty. skipping.",
+    "Couldn't send that drawing to the plotter, skipping it",
+] + [f"{stage} failed" for stage in ("transcribe", "generate", "vectorize", "plot")]
+PROMPT_VERSION = 2  # Bump when the drawing prompt changes, so old drawings aren't reused (G-code settings are in the cache key)
 
 def remove_specific_words(text_string, words_to_remove):
     """
@@ -55,8 +138,246 @@ def remove_specific_words(text_string, words_to_remove):
     return modified_string
 
 
+class AudioBuffer:
+    """
+    Growable float32 buffer for mono audio coming from the microphone callback.
+
+    Samples are copied straight into a preallocated array that doubles in size when
+    it fills up, so there's no list of blocks to np.concatenate at the end. If
+    max_samples is given it acts as a ring buffer instead and only keeps the most
+    recent max_samples.
+    """
+    def __init__(self, initial_samples=SAMPLE_RATE * 10, max_samples=None):
+        self.max_samples = max_samples
+        size = max_samples if max_samples is not None else initial_samples
+        self._data = np.zeros(size, dtype=np.float32)
+        self._start = 0
+        self._length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._length
+
+    def clear(self):
+        with self._lock:
+            self._start = 0
+            self._length = 0
+
+    def append(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        n = len(samples)
+        with self._lock:
+            if self.max_samples is None:
+                needed = self._length + n
+                if needed > len(self._data):
+                    grown = np.zeros(max(needed, len(self._data) * 2), dtype=np.float32)
+                    grown[:self._length] = self._data[:self._length]
+                    self._data = grown
+                self._data[self._length:needed] = samples
+                self._length = needed
+                return
+            # Ring buffer mode
+            capacity = self.max_samples
+            if n >= capacity:
+                self._data[:] = samples[-capacity:]
+                self._start = 0
+                self._length = capacity
+                return
+            end = (self._start + self._length) % capacity
+            first = min(n, capacity - end)
+            self._data[end:end + first] = samples[:first]
+            self._data[:n - first] = samples[first:]
+            overflow = self._length + n - capacity
+            if overflow > 0:
+                self._start = (self._start + overflow) % capacity
+                self._length = capacity
+            else:
+                self._length += n
+
+    def get(self):
+        """Returns the buffered samples, oldest first. This is a view when the data doesn't wrap."""
+        with self._lock:
+            end = self._start + self._length
+            if end <= len(self._data):
+                return self._data[self._start:end]
+            return np.concatenate((self._data[self._start:], self._data[:end - len(self._data)]))
+
+
+class EnergyVAD:
+    """
+    Cheap energy-based voice activity detector, fed from the sd.InputStream callback.
+
+    It tracks the background noise level while nobody is talking, starts an
+    utterance once the audio stays well above it for VAD_ONSET_SECONDS, and ends it
+    after VAD_HANGOVER_SECONDS of quiet. Leading and trailing silence is trimmed so
+    Whisper only gets the speech (plus a little padding).
+    """
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.pre_roll = AudioBuffer(max_samples=int(VAD_PRE_ROLL_SECONDS * sample_rate))
+        self.utterance = AudioBuffer()
+        # Starts low instead of at the first block, which is speech when someone says the
+        # wake word and the command in one breath; the floor rises to the room's noise
+        # in the quiet blocks
+        self.noise_floor = VAD_MIN_RMS / VAD_SPEECH_RATIO
+        self.speaking = False
+        self.onset_samples = 0
+        self.voiced_samples = 0
+        self.silent_samples = 0
+        self.last_voiced_end = 0
+        self.finished = threading.Event()
+
+    def _seconds_to_samples(self, seconds):
+        return int(seconds * self.sample_rate)
+
+    def _reset_utterance(self):
+        self.speaking = False
+        self.utterance.clear()
+        self.pre_roll.clear()
+        self.onset_samples = 0
+        self.voiced_samples = 0
+        self.silent_samples = 0
+        self.last_voiced_end = 0
+
+    def process(self, block):
+        """Feeds one block of mono float32 audio through the detector."""
+        if self.finished.is_set():
+            return
+        rms = float(np.sqrt(np.mean(np.square(block))))
+        voiced = rms > max(VAD_MIN_RMS, self.noise_floor * VAD_SPEECH_RATIO)
+
+        if not self.speaking:
+            self.pre_roll.append(block)
+            if voiced:
+                self.onset_samples += len(block)
+            else:
+                self.onset_samples = 0
+                self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+            if self.onset_samples >= self._seconds_to_samples(VAD_ONSET_SECONDS):
+                self.speaking = True
+                self.utterance.append(self.pre_roll.get())
+                self.voiced_samples = self.onset_samples
+                self.last_voiced_end = len(self.utterance)
+            return
+
+        self.utterance.append(block)
+        if voiced:
+            self.voiced_samples += len(block)
+            self.silent_samples = 0
+            self.last_voiced_end = len(self.utterance)
+        else:
+            self.silent_samples += len(block)
+
+        too_long = len(self.utterance) >= self._seconds_to_samples(VAD_MAX_SECONDS)
+        if self.silent_samples >= self._seconds_to_samples(VAD_HANGOVER_SECONDS) or too_long:
+            if self.voiced_samples < self._seconds_to_samples(VAD_MIN_SPEECH_SECONDS):
+                # Just a click or a cough, go back to listening
+                self._reset_utterance()
+                return
+            self.finished.set()
+
+    def recording(self):
+        """The finished utterance, with trailing silence trimmed off."""
+        end = self.last_voiced_end + self._seconds_to_samples(VAD_TAIL_SECONDS)
+        return self.utterance.get()[:end]
+
+
+def save_debug_wav(recording):
+    """Writes the recording to FILENAME on a background thread so transcription doesn't wait on the disk."""
+    def _write():
+        write(FILENAME, SAMPLE_RATE, recording)
+        print(f"Recording saved to {FILENAME}")
+    threading.Thread(target=_write, daemon=True).start()
+
+
+class RemoteWhisperModel:
+    """
+    Stands in for a Whisper model, but sends the audio to whisper-server.py, which
+    already has the model loaded and warmed up. Only transcribe() is supported.
+    """
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address, timeout=self.timeout)
+        self._file = self._sock.makefile("rwb")
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def _request(self, header, payload=b""):
+        with self._lock:
+            # One retry, in case the server was restarted since our last request
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write((json.dumps(header) + "\n").encode("utf-8") + payload)
+                    self._file.flush()
+                    reply_line = self._file.readline()
+                    if not reply_line:
+                        raise ConnectionError("Whisper server closed the connection")
+                    return json.loads(reply_line)
+                except OSError:
+                    self._close()
+                    if attempt == 1:
+                        raise
+
+    def transcribe_command(self, audio):
+        """Server-side version of decode_command(). Returns None if the phrase didn't start with "draw"."""
+        audio = np.ascontiguousarray(audio, dtype="<f4").reshape(-1)
+        header = {"samples": len(audio), "command": {"prompt": COMMAND_PROMPT,
+                                                     "check_tokens": COMMAND_CHECK_TOKENS,
+                                                     "max_tokens": COMMAND_MAX_TOKENS}}
+        reply = self._request(header, audio.tobytes())
+        if "error" in reply:
+            raise RuntimeError(f"Whisper server error: {reply['error']}")
+        print(f"Whisper server took {reply['seconds']:.2f}s")
+        return reply["text"]
+
+    def ping(self):
+        return self._request({"ping": True}).get("ok", False)
+
+    def transcribe(self, audio, **options):
+        if isinstance(audio, str):
+            import whisper
+            audio = whisper.load_audio(audio)
+        audio = np.ascontiguousarray(audio, dtype="<f4").reshape(-1)
+        reply = self._request({"samples": len(audio), "options": options}, audio.tobytes())
+        if "error" in reply:
+            raise RuntimeError(f"Whisper server error: {reply['error']}")
+        print(f"Whisper server took {reply['seconds']:.2f}s")
+        return {"text": reply["text"]}
+
+
 def init_whisper():
+    if WHISPER_SERVER_ADDRESS is not None:
+        try:
+            remote_model = RemoteWhisperModel(WHISPER_SERVER_ADDRESS)
+            if remote_model.ping():
+                print(f"Using Whisper server at {WHISPER_SERVER_ADDRESS[0]}:{WHISPER_SERVER_ADDRESS[1]}")
+                return remote_model
+        except OSError:
+            print("Whisper server not running, loading the model here instead.")
+        except (ValueError, KeyError, AttributeError) as e:
+            # Something else is listening there, or it answered with garbage
+            print(f"Unexpected answer from {WHISPER_SERVER_ADDRESS[0]}:{WHISPER_SERVER_ADDRESS[1]} ({e!r}), "
+                  f"loading the model here instead.")
     try:
+        # Only imported here: whisper and torch take seconds to import, and with the
+        # Whisper server running they aren't needed at all
+        import whisper
         print(f"Loading Whisper model '{MODEL_TYPE}'...")
         # This will download the model on the first run
         model = whisper.load_model(MODEL_TYPE)
@@ -68,82 +389,299 @@ def init_whisper():
         return None
 
 
-def get_phrase_from_user(model):
-    # A list to store audio frames
-    recorded_frames = []
+def record_phrase_audio():
+    """
+    Capture stage: waits for the user to bracket a recording with ENTER presses
+    (or presses of KEYPAD_RECORD_KEY).
+
+    Returns:
+        The recorded audio as a float32 NumPy array, "QUIT" if the user asked to quit,
+        or None if nothing was recorded.
+    """
+    if CAPTURE_MODE == "vad":
+        return record_phrase_vad()
+    # A fresh buffer each time, since the transcribe stage may still be using the last one
+    audio_buffer = AudioBuffer()
     def audio_callback(indata, frames, time_info, status):
         """This function is called for each audio block from the microphone."""
         if status:
             print(f"Audio callback status: {status}")
-        recorded_frames.append(indata.copy())
-
-    # 2. Set up and start the audio stream
-    got_phrase = False
-    valid_drawing_phrase = False
-    transcribed_text = ""
-    while not valid_drawing_phrase:
-        recorded_frames = []
-        transcribed_text = ""
-        try:
-            print("\n" + "="*40)
-            keypad_show_bg_color("00A030")
-            user_input = input("Press Q to quit, or ENTER to start recording...")
-            if user_input.strip().lower() == 'q':
-                return "QUIT"
-            # The 'with' statement ensures the stream is properly closed
-            with sd.InputStream(samplerate=SAMPLE_RATE,
-                                channels=1,
-                                dtype='float32',
-                                callback=audio_callback):
-                keypad_show_bg_color("FFFFFF")
-                print("🔴 Recording... Press ENTER to stop.")
-
-                # The recording happens in the background via the callback
-                # The main thread waits here for the user to press Enter again
-                input() # This second input() call is what stops the recording
-
-            print("⏹️ Recording stopped.")
-            keypad_show_bg_color("000077")
-
-            # 3. Process the recorded audio
-            if not recorded_frames:
-                print("No audio recorded.")
-                continue
+        audio_buffer.append(indata[:, 0])
+
+    try:
+        print("\n" + "="*40)
+        keypad_show_bg_color("00A030")
+        if wait_for_control(f"Press Q to quit, or ENTER (or {KEYPAD_RECORD_KEY} on the keypad) to start recording...",
+                            fresh=True) == "QUIT":
+            return "QUIT"
+        # The 'with' statement ensures the stream is properly closed
+        with sd.InputStream(samplerate=SAMPLE_RATE,
+                            channels=1,
+                            dtype='float32',
+                            callback=audio_callback):
+            keypad_show_bg_color("FFFFFF")
+            print(f"🔴 Recording... Press ENTER (or {KEYPAD_RECORD_KEY}) to stop.")
+
+            # The recording happens in the background via the callback
+            # The main thread waits here for the user to press Enter (or the key) again
+            wait_for_control()
+
+        print("⏹️ Recording stopped.")
+        keypad_show_bg_color("000077")
+    except Exception as e:
+        traceback.print_exc()
+        print(f"\nAn error occurred: {e}")
+        print("Please ensure your microphone is connected and configured correctly.")
+        return None
+
+    if len(audio_buffer) == 0:
+        print("No audio recorded.")
+        return None
+    return audio_buffer.get()
+
+
+def record_phrase_vad():
+    """
+    Hands-free version of record_phrase_audio(): listens until someone talks and
+    stops by itself once they've finished. Ctrl+C quits.
+    """
+    vad = EnergyVAD()
+    def audio_callback(indata, frames, time_info, status):
+        if status:
+            print(f"Audio callback status: {status}")
+        vad.process(indata[:, 0])
+
+    try:
+        print("\n" + "="*40)
+        keypad_show_bg_color("00A030")
+        print("Listening... say \"draw ...\" (Ctrl+C to quit)")
+        with sd.InputStream(samplerate=SAMPLE_RATE,
+                            channels=1,
+                            dtype='float32',
+                            blocksize=int(SAMPLE_RATE * VAD_BLOCK_SECONDS),
+                            callback=audio_callback):
+            showing_recording = False
+            while not vad.finished.wait(0.05):
+                # The keypad can't be touched from the audio callback, so follow along from here
+                if vad.speaking != showing_recording:
+                    showing_recording = vad.speaking
+                    keypad_show_bg_color("FFFFFF" if showing_recording else "00A030")
+                    if showing_recording:
+                        print("🔴 Speech detected, recording...")
+        print("⏹️ Recording stopped.")
+        keypad_show_bg_color("000077")
+    except KeyboardInterrupt:
+        return "QUIT"
+    except Exception as e:
+        traceback.print_exc()
+        print(f"\nAn error occurred: {e}")
+        print("Please ensure your microphone is connected and configured correctly.")
+        return None
+
+    recording = vad.recording()
+    print(f"Got {len(recording) / SAMPLE_RATE:.1f}s of speech.")
+    return recording
+
+
+class WakeWordDetector:
+    """
+    Base class for the wake word detectors. feed() is given new microphone audio as
+    it comes in and returns True once the wake word has been heard.
+    """
+    name = "none"
+
+    def __init__(self):
+        self.inference_count = 0
+        self.inference_seconds = 0.0
+
+    def feed(self, samples):
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+
+class WhisperWakeWordDetector(WakeWordDetector):
+    """
+    Runs a tiny Whisper model over overlapping windows of the last WAKE_WINDOW_SECONDS
+    of audio, every WAKE_HOP_SECONDS. Quiet windows are skipped without running the
+    model at all, so it's close to free when nobody's around.
+    """
+    name = "whisper"
+
+    def __init__(self, model_type=WAKE_WHISPER_MODEL):
+        super().__init__()
+        import whisper
+        print(f"Loading wake word model '{model_type}'...")
+        self.model = whisper.load_model(model_type)
+        self.window = AudioBuffer(max_samples=int(WAKE_WINDOW_SECONDS * SAMPLE_RATE))
+        self.hop_samples = int(WAKE_HOP_SECONDS * SAMPLE_RATE)
+        self.samples_since_check = 0
+
+    def reset(self):
+        self.window.clear()
+        self.samples_since_check = 0
+
+    def feed(self, samples):
+        self.window.append(samples)
+        self.samples_since_check += len(samples)
+        if self.samples_since_check < self.hop_samples or len(self.window) < self.window.max_samples:
+            return False
+        self.samples_since_check = 0
+
+        audio = self.window.get()
+        # Energy gate: only bother Whisper if the window has anything loud in it
+        block = int(VAD_BLOCK_SECONDS * SAMPLE_RATE)
+        usable = len(audio) // block * block
+        block_rms = np.sqrt(np.mean(np.square(audio[:usable].reshape(-1, block)), axis=1))
+        if block_rms.max() < VAD_MIN_RMS:
+            return False
+
+        start_time = time.perf_counter()
+        result = self.model.transcribe(audio, fp16=False, temperature=0.0,
+                                       condition_on_previous_text=False, without_timestamps=True)
+        self.inference_seconds += time.perf_counter() - start_time
+        self.inference_count += 1
+        return WAKE_WORD in result["text"].lower()
+
+
+class PorcupineWakeWordDetector(WakeWordDetector):
+    """Picovoice Porcupine keyword spotter (see wakeword-practice.py). Needs the PICOVOICE_KEY environment variable."""
+    name = "porcupine"
+
+    def __init__(self):
+        super().__init__()
+        import pvporcupine
+        env_var_name = "PICOVOICE_KEY"
+        access_key = os.getenv(env_var_name)
+        if access_key is None:
+            raise ValueError(env_var_name + " environment variable not set")
+        self.porcupine = pvporcupine.create(access_key=access_key, keywords=[WAKE_WORD])
+        if self.porcupine.sample_rate != SAMPLE_RATE:
+            raise ValueError(f"Porcupine wants {self.porcupine.sample_rate} Hz audio, we record at {SAMPLE_RATE} Hz")
+        self.pending = np.zeros(0, dtype=np.int16)
+
+    def reset(self):
+        self.pending = np.zeros(0, dtype=np.int16)
 
-            print("Processing audio...")
-            # Concatenate all the recorded frames into a single NumPy array
-            recording = np.concatenate(recorded_frames, axis=0)
-
-            # Save the recording to a WAV file (optional, but good for debugging)
-            write(FILENAME, SAMPLE_RATE, recording)
-            print(f"Recording saved to {FILENAME}")
-
-            # 4. Transcribe the audio
-            print("Transcribing audio...")
-            result = model.transcribe(FILENAME)
-            transcribed_text = result["text"].strip()
-            got_phrase = True
-
-            # 5. Print the result
-            print("\n" + "="*40)
-            print("Whisper heard:")
-            print(f"-> {transcribed_text}")
-            print("="*40 + "\n")
-
-        except Exception as e:
-            traceback.print_exc()
-            print(f"\nAn error occurred: {e}")
-            print("Please ensure your microphone is connected and configured correctly.")
-            return ""
-        
-        if not got_phrase:
-            print("Didn't get a phrase.")
+    def feed(self, samples):
+        pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        self.pending = np.concatenate((self.pending, pcm))
+        frame_length = self.porcupine.frame_length
+        detected = False
+        start_time = time.perf_counter()
+        while len(self.pending) >= frame_length:
+            frame = self.pending[:frame_length]
+            self.pending = self.pending[frame_length:]
+            self.inference_count += 1
+            if self.porcupine.process(frame) >= 0:
+                detected = True
+        self.inference_seconds += time.perf_counter() - start_time
+        return detected
+
+
+def init_wake_word_detector():
+    if WAKE_WORD_DETECTOR is None:
+        return None
+    if WAKE_WORD_DETECTOR == "whisper":
+        return WhisperWakeWordDetector()
+    if WAKE_WORD_DETECTOR == "porcupine":
+        return PorcupineWakeWordDetector()
+    raise ValueError(f"Unknown wake word detector: {WAKE_WORD_DETECTOR}")
+
+
+def wait_for_wake_word(detector):
+    """
+    Blocks until the wake word is heard. The heavy lifting happens on this thread,
+    not in the audio callback, so a slow detector can't make the stream drop audio.
+
+    Returns:
+        True once the wake word is detected, or "QUIT" on Ctrl+C.
+    """
+    blocks = queue.Queue()
+    def audio_callback(indata, frames, time_info, status):
+        if status:
+            print(f"Audio callback status: {status}")
+        blocks.put((time.perf_counter(), indata[:, 0].copy()))
+
+    detector.reset()
+    keypad_show_bg_color("000040")
+    print(f"\nWaiting for the wake word '{WAKE_WORD}' ({detector.name})... (Ctrl+C to quit)")
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_inferences = detector.inference_count
+    start_inference_seconds = detector.inference_seconds
+    try:
+        with sd.InputStream(samplerate=SAMPLE_RATE,
+                            channels=1,
+                            dtype='float32',
+                            blocksize=int(SAMPLE_RATE * VAD_BLOCK_SECONDS),
+                            callback=audio_callback):
+            while True:
+                arrival_time, block = blocks.get()
+                if detector.feed(block):
+                    break
+    except KeyboardInterrupt:
+        return "QUIT"
+
+    # Latency is measured from when the block that completed the detection arrived
+    latency = time.perf_counter() - arrival_time
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    inferences = detector.inference_count - start_inferences
+    inference_seconds = detector.inference_seconds - start_inference_seconds
+    print(f"✅ Wake word detected by {detector.name} in {latency * 1000:.0f} ms. "
+          f"While listening: {wall:.1f}s, {100 * cpu / wall:.0f}% CPU (whole process), "
+          f"{inferences} inferences taking {inference_seconds:.2f}s")
+    return True
+
+
+def transcribe_phrase(model, recording):
+    """
+    Transcribe stage: turns a recording into the subject to draw.
+
+    Returns:
+        str: The subject with the "draw a" part stripped, or None if the phrase
+             wasn't a valid drawing request.
+    """
+    print("Transcribing audio...")
+    if COMMAND_DECODING:
+        if SAVE_DEBUG_WAV:
+            save_debug_wav(recording)
+        if isinstance(model, RemoteWhisperModel):
+            transcribed_text = model.transcribe_command(recording)
         else:
-            valid_drawing_phrase = transcribed_text.lower().startswith("draw ")
-            if not valid_drawing_phrase:
-                print(f'Not a valid drawing phrase: "{transcribed_text}"')
-                playsound("nicetry.mp3")    
+            from command_decoding import decode_command
+            transcribed_text = decode_command(model, recording, COMMAND_PROMPT, COMMAND_CHECK_TOKENS,
+                                              COMMAND_MAX_TOKENS)
+        if transcribed_text is None:
+            playsound("nicetry.mp3")
+            return None
+        result = {"text": transcribed_text}
+    elif IN_MEMORY_AUDIO:
+        # Whisper takes a 16 kHz float32 array directly, which skips the
+        # file write and the ffmpeg decode it does for file paths
+        if SAVE_DEBUG_WAV:
+            save_debug_wav(recording)
+        result = model.transcribe(recording)
+    else:
+        write(FILENAME, SAMPLE_RATE, recording)
+        print(f"Recording saved to {FILENAME}")
+        result = model.transcribe(FILENAME)
+    transcribed_text = result["text"].strip()
+
+    print("\n" + "="*40)
+    print("Whisper heard:")
+    print(f"-> {transcribed_text}")
+    print("="*40 + "\n")
+
+    if not transcribed_text.lower().startswith("draw "):
+        print(f'Not a valid drawing phrase: "{transcribed_text}"')
+        playsound("nicetry.mp3")
+        return None
     what_to_draw = remove_specific_words(transcribed_text, ["draw", "a", "an"]).replace('.', '')
+    if what_to_draw == '':
+        return None
     return what_to_draw
 
 
@@ -172,7 +710,7 @@ def ai_comment_on_subject(subject):
             text_response += part.text
     text_response = text_response.strip().replace("*", "").replace("...", "")
     if text_response:
-        tts(text_response, Voice.US_FEMALE_1, "output.mp3", play_sound=True)
+        tts_stream(text_response, TTS_VOICE, race=True)  # They're waiting for it, so start talking on the first chunk
 
 
 # see https://ai.google.dev/gemini-api/docs/image-generation#python
@@ -196,6 +734,7 @@ def generate_drawing_png(phrase_to_draw):
         response_modalities=['TEXT', 'IMAGE']
         )
     )
+    img_save_path = ''  # Stays empty if Gemini only answered with text
     for part in response.candidates[0].content.parts:
         if part.text is not None:
             print(part.text)
@@ -207,27 +746,218 @@ def generate_drawing_png(phrase_to_draw):
             image.save(img_save_path)
     return img_save_path
 
-# SEE C:\Users\jacob\.vpype.toml FOR GCODE CONFIGURATION!!!!
-def png_to_gcode(png_path):
+def png_to_bw(png_path):
+    """Loads Gemini's PNG as a flipped 1-bit image, ready for vectorizing."""
     img = Image.open(png_path)
-    # Convert to grayscale, apply threshold, then save as 1-bit (black and white) BMP without dithering
-    threshold = 128
-    gray = img.convert('L')
-    bw = gray.point(lambda x: 255 if x > threshold else 0, mode='1')
+    if PREPROCESS_IMAGE:
+        start_time = time.perf_counter()
+        ink = preprocess_image(img)
+        bw = Image.fromarray(~ink)  # 1-bit image, white background
+        print(f"Preprocessed {img.width}x{img.height} image down to {bw.width}x{bw.height} in {time.perf_counter() - start_time:.2f}s")
+    else:
+        # Convert to grayscale and apply threshold to get a 1-bit (black and white) image without dithering
+        threshold = 128
+        gray = img.convert('L')
+        bw = gray.point(lambda x: 255 if x > threshold else 0, mode='1')
     # Flip the image vertically
-    bw_flipped = bw.transpose(Image.FLIP_TOP_BOTTOM)
+    return bw.transpose(Image.FLIP_TOP_BOTTOM)
+
+
+def prepare_drawing(png_path):
+    """
+    Native vectorizer and the builtin G-code writer's preparation, in memory.
+
+    Returns:
+        A dict with the "png_path", the "lines" ready for iter_gwrite() and their
+        "arc_tolerance", the plot time "estimate", how many "paths" the vectorizer
+        found and the fraction of the image that's "ink". None if there's nothing to draw.
+    """
+    bw = png_to_bw(png_path)
+    polylines = native_vectorize(bw)
+    if not polylines:
+        return None
+    start_time = time.perf_counter()
+    profile = gwrite_profile()
+    lines, arc_tolerance = prepare_lines(polylines, profile, optimize=OPTIMIZE_TRAVEL,
+                                         time_budget=PLOT_TIME_BUDGET_SECONDS, arcs=ARC_FITTING)
+    if pen_lift_mode() == "always":
+        estimate = estimate_lines_time(lines, machine_settings(), home_position(profile))
+    else:
+        # Fewer and shorter lifts than the lines suggest. Worked out from the gaps between
+        # them, so the G-code only gets written once, while it uploads
+        stats = {}
+        estimate = estimate_postprocessed_lines(lines, machine_settings(), home_position(profile),
+                                                hop_mm=HOP_TRAVEL_MM if pen_lift_mode() == "hop" else 0.0,
+                                                stats=stats)
+        print(f"Pen lifts: {stats['lifts']} -> {stats['lifts'] - stats['joined'] - stats['dropped']} "
+              f"({stats['joined']} drawn over, {stats['hops']} partway)")
+    print(f"Prepared {len(lines)} strokes for G-code in {time.perf_counter() - start_time:.2f}s")
+    ink = 1 - np.count_nonzero(np.array(bw, dtype=bool)) / (bw.width * bw.height)  # mode '1' is True for white
+    return {"png_path": png_path, "lines": lines, "arc_tolerance": arc_tolerance, "estimate": estimate,
+            "paths": len(polylines), "ink": ink}
+
+
+def png_to_gcode_stream(png_path, drawing=None):
+    """
+    Native vectorizer and builtin G-code writer, without touching the disk. Returns
+    (chunks, estimate): a generator that formats the G-code as the upload reads it,
+    and the plot time estimate for it. None if there's nothing to draw. `drawing`
+    is prepare_drawing()'s result for png_path, if that's already been done.
+    """
+    if drawing is None:
+        drawing = prepare_drawing(png_path)
+        if drawing is None:
+            return None
+    chunks = iter_gwrite(drawing["lines"], gwrite_profile(), arc_tolerance=drawing["arc_tolerance"])
+    return postprocess_pen_lifts(chunks), drawing["estimate"]
+
+
+def postprocess_pen_lifts(chunks, stats=None):
+    """Applies PEN_LIFTS to streamed G-code."""
+    mode = pen_lift_mode()
+    if mode == "always":
+        return chunks
+    if mode == "hop":
+        return postprocess_gcode(chunks, stats=stats)
+    return postprocess_gcode(chunks, hop_mm=0.0, stats=stats)
+
+
+def score_drawing(drawing):
+    """How bad a candidate is to plot: slow, many separate paths, lots of shading. Lower is better."""
+    values = {"minutes": drawing["estimate"]["seconds"] / 60, "paths": drawing["paths"], "ink": drawing["ink"]}
+    return sum(CANDIDATE_WEIGHTS[name] * value for name, value in values.items())
+
+
+def generate_candidate(phrase_to_draw):
+    """One candidate for generate_best_drawing(): a Gemini image, prepared for plotting. None if unusable."""
+    png_path = generate_drawing_png(phrase_to_draw)
+    if png_path == '':
+        return None
+    return prepare_drawing(png_path)
+
+
+def generate_best_drawing(phrase_to_draw):
+    """
+    Asks Gemini for DRAWING_CANDIDATES images at once, prepares each for plotting
+    as soon as it arrives, and keeps the one with the best score_drawing(). Images
+    that aren't back after CANDIDATE_DEADLINE_SECONDS are dropped; if none are back
+    by then, the first one to arrive is taken.
+
+    Returns:
+        prepare_drawing()'s result for the winner, or None if no candidate worked.
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + CANDIDATE_DEADLINE_SECONDS
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=DRAWING_CANDIDATES, thread_name_prefix="candidate")
+    waiting = {pool.submit(generate_candidate, phrase_to_draw) for _ in range(DRAWING_CANDIDATES)}
+    pool.shutdown(wait=False)  # Latecomers finish in the background and are ignored
+    drawings = []
+    while waiting:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0 and drawings:
+            print(f"Dropping {len(waiting)} candidates that missed the {CANDIDATE_DEADLINE_SECONDS}s deadline")
+            break
+        done, waiting = concurrent.futures.wait(waiting, timeout=remaining if remaining > 0 else None,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                drawing = future.result()
+            except Exception as e:
+                print(f"A candidate failed: {e}")
+                continue
+            if drawing is None:
+                continue
+            drawing["score"] = score_drawing(drawing)
+            print(f"Candidate {drawing['png_path']}: {format_duration(drawing['estimate']['seconds'])}, "
+                  f"{drawing['paths']} paths, {drawing['ink']:.0%} ink, score {drawing['score']:.2f} "
+                  f"({time.perf_counter() - start_time:.1f}s)")
+            drawings.append(drawing)
+    if not drawings:
+        return None
+    best = min(drawings, key=lambda drawing: drawing["score"])
+    print(f"Picked {best['png_path']} of {len(drawings)}/{DRAWING_CANDIDATES} candidates "
+          f"in {time.perf_counter() - start_time:.1f}s")
+    return best
+
+
+# SEE C:\Users\jacob\.vpype.toml FOR GCODE CONFIGURATION!!!!
+def png_to_gcode(png_path):
+    """The vpype path (and AutoTrace, if that's the vectorizer): writes the G-code to a file and returns its path, or ''."""
+    bw_flipped = png_to_bw(png_path)
+    svg_path = os.path.splitext(png_path)[0] + ".svg"
+    output_name = os.path.splitext(svg_path)[0] + ".gcode"
+    if VECTORIZER == "native":
+        polylines = native_vectorize(bw_flipped)
+        if not polylines:
+            return ''
+        write_svg(polylines, bw_flipped.width, bw_flipped.height, svg_path)
+    elif not autotrace_vectorize(bw_flipped, png_path, svg_path):
+        return ''
+    svg_to_gcode_cmd = f'vpype read "{svg_path}" linemerge --tolerance 0.1mm linesort layout --fit-to-margins 5mm 160x160mm gwrite --profile klipper_pen "{output_name}"'
+    svg_to_gcode_result = subprocess.run(svg_to_gcode_cmd, shell=True)
+    if svg_to_gcode_result.returncode != 0:
+        print("vpype command failed with return code", svg_to_gcode_result.returncode)
+        return ''
+    if pen_lift_mode() != "always":
+        with open(output_name, "r", encoding="utf-8") as f:
+            gcode = f.read()
+        with open(output_name, "w", encoding="utf-8") as f:
+            f.writelines(postprocess_pen_lifts([gcode]))
+    return output_name
+
+
+_gwrite_profile = None
+
+def gwrite_profile():
+    """The klipper_pen profile from .vpype.toml, read once."""
+    global _gwrite_profile
+    if _gwrite_profile is None:
+        _gwrite_profile = load_gwrite_profile("klipper_pen")
+    return _gwrite_profile
+
+
+_machine_settings = None
+
+def machine_settings():
+    """Motion limits and pen dwells from printer.cfg, for plot time estimates. Read once."""
+    global _machine_settings
+    if _machine_settings is None:
+        _machine_settings = load_machine_settings(profile=gwrite_profile())
+    return _machine_settings
+
+
+def pen_lift_mode():
+    """PEN_LIFTS, except that "hop" is "join" when printer.cfg has no PEN_UP_FAST/PEN_DOWN_FAST to hop with."""
+    if PEN_LIFTS == "hop" and not {"PEN_UP_FAST", "PEN_DOWN_FAST"} <= set(machine_settings().macro_dwells):
+        return "join"
+    return PEN_LIFTS
+
+
+def native_vectorize(bw_image):
+    """Centerline-traces a black and white PIL image in memory. Returns the strokes as polylines, in pixels."""
+    start_time = time.perf_counter()
+    ink = ~np.array(bw_image, dtype=bool)  # mode '1' is True for white
+    polylines = vectorize_image(ink)
+    if not polylines:
+        print("Vectorizer didn't find any strokes.")
+        return []
+    print(f"Vectorized {len(polylines)} strokes in {time.perf_counter() - start_time:.2f}s")
+    return polylines
+
+
+def autotrace_vectorize(bw_image, png_path, svg_path):
+    """The old way: save a BMP and run AutoTrace's centerline mode on it."""
     bmp_path = os.path.splitext(png_path)[0] + ".bmp"
-    bw_flipped.save(bmp_path, format="BMP")
+    bw_image.save(bmp_path, format="BMP")
     print("Image also saved as 2-color (black and white, thresholded, flipped vertically) BMP at " + bmp_path)
 
     autotrace_input = bmp_path
-    autotrace_output = os.path.splitext(png_path)[0] + ".svg"
+    autotrace_output = svg_path
     line_cmd = f'"C:\\Program Files\\AutoTrace\\autotrace.exe" -centerline -background-color FFFFFF -color-count 2 -output-file "{autotrace_output}" -output-format svg "{autotrace_input}"'
     result = subprocess.run(line_cmd, shell=True)
     if result.returncode != 0:
         print("AutoTrace command failed with return code", result.returncode)
-        print("Terminating early.")
-        quit()
+        return False
 
     print("AutoTrace command executed successfully.")
     # Add xmlns to the <svg> tag if missing
@@ -244,113 +974,751 @@ def png_to_gcode(png_path):
                     f.writelines(svg_lines)
                 print("Added xmlns attribute to <svg> tag.")
             break
-    output_name = os.path.splitext(autotrace_output)[0] + ".gcode"
-    svg_to_gcode_cmd = f'vpype read "{autotrace_output}" linemerge --tolerance 0.1mm linesort layout --fit-to-margins 5mm 160x160mm gwrite --profile klipper_pen "{output_name}"'
-    svg_to_gcode_result = subprocess.run(svg_to_gcode_cmd, shell=True)
-    if svg_to_gcode_result.returncode != 0:
-        print("vpype command failed with return code", result.returncode)
-        return ''
-    return output_name
+    return True
 
 
-def moonraker_upload_gcode(file_path):
-    """Uploads a G-code file to Moonraker."""
-    if not os.path.exists(file_path):
-        print(f"Error: G-code file not found at {file_path}")
-        return None
+def gcode_file_chunks(file_path):
+    """Reads a G-code file in UPLOAD_CHUNK_BYTES pieces, for uploading."""
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return
+            yield chunk
 
-    file_name = os.path.basename(file_path)
-    url = f"{MOONRAKER_URL}/server/files/upload"
-    print(f"Uploading {file_name} to Moonraker...")
 
-    try:
-        with open(file_path, "rb") as f:
-            files = {'file': (file_name, f, 'application/octet-stream')}
-            response = requests.post(url, files=files)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            print("File uploaded successfully.")
-            return file_name
-    except requests.exceptions.RequestException as e:
-        print(f"Error uploading file: {e}")
-        return None
+def multipart_body(file_name, chunks, boundary):
+    """
+    A multipart/form-data body with one "file" field, generated as the G-code comes
+    in. Small pieces are batched up to UPLOAD_CHUNK_BYTES so each HTTP chunk is a
+    decent size.
+    """
+    yield (f'--{boundary}\r\n'
+           f'Content-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+           f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+    pending = []
+    pending_bytes = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        pending.append(chunk)
+        pending_bytes += len(chunk)
+        if pending_bytes >= UPLOAD_CHUNK_BYTES:
+            yield b"".join(pending)
+            pending = []
+            pending_bytes = 0
+    pending.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    yield b"".join(pending)
 
 
-def moonraker_start_print(file_name):
-    """Starts a print from the uploaded G-code file."""
-    if not file_name:
-        print("Cannot start print, no file was uploaded.")
-        return
+class MoonrakerClient:
+    """
+    Talks to Moonraker over one pooled requests.Session, with timeouts and
+    exponential-backoff retries, and follows print_stats over Moonraker's JSON-RPC
+    websocket so we know when the plotter goes idle.
 
-    url = f"{MOONRAKER_URL}/printer/print/start?filename={file_name}"
-    print(f"Requesting to start print of {file_name}...")
+    The websocket runs in a background thread (start_watching()). If it can't
+    connect, wait_until_idle() falls back to polling over HTTP.
+    """
+    BUSY_STATES = ("printing", "paused")
 
-    try:
-        response = requests.post(url)
-        response.raise_for_status()
+    def __init__(self, url=MOONRAKER_URL, timeout=MOONRAKER_TIMEOUT, retries=MOONRAKER_RETRIES):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        self.print_state = None  # print_stats.state: standby, printing, paused, complete, cancelled or error
+        self.websocket_connected = False
+        self.listeners = []  # Called with the new state whenever print_stats.state changes
+        self._state_changed = threading.Condition()
+        self._stop = threading.Event()
+        self._websocket = None
+        self._watch_thread = None
+
+    def _request(self, method, path, body=None, **kwargs):
+        """
+        An HTTP request with retries. `body` makes a fresh request body for each
+        attempt, for bodies that are generators. Returns the "result" of
+        Moonraker's JSON reply.
+        """
+        delay = MOONRAKER_BACKOFF_SECONDS
+        for attempt in range(self.retries + 1):
+            try:
+                if body is not None:
+                    kwargs["data"] = body()
+                response = self.session.request(method, self.url + path, timeout=self.timeout, **kwargs)
+                if response.status_code < 500 or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json().get("result")
+                print(f"Moonraker {path} answered {response.status_code}, retrying in {delay:.1f}s")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Moonraker {path} failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay *= 2
+
+    def upload(self, file_name, chunks, sent=None):
+        """
+        Uploads G-code to Moonraker as it's generated. `chunks` is any iterable of
+        str or bytes; the body goes out with chunked transfer encoding, so nothing
+        has to be written to disk first. What has already been read from `chunks`
+        is kept in the `sent` list, so a retry can send it again; pass one in to get
+        the whole G-code back afterwards. Returns True if it worked.
+        """
+        print(f"Uploading {file_name} to Moonraker...")
+        chunks = iter(chunks)
+        if sent is None:
+            sent = []
+
+        def replayable():
+            yield from sent  # What earlier attempts already took out of the generator
+            for chunk in chunks:
+                sent.append(chunk)
+                yield chunk
+
+        boundary = os.urandom(16).hex()
+        start_time = time.perf_counter()
+        try:
+            self._request("POST", "/server/files/upload", body=lambda: multipart_body(file_name, replayable(), boundary),
+                          headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        except requests.exceptions.RequestException as e:
+            print(f"Error uploading file: {e}")
+            return False
+        print(f"File uploaded successfully in {time.perf_counter() - start_time:.2f}s.")
+        return True
+
+    def start_print(self, file_name):
+        """Starts plotting an uploaded file. Returns True if Moonraker took it."""
+        print(f"Requesting to start print of {file_name}...")
+        try:
+            self._request("POST", "/printer/print/start", params={"filename": file_name})
+        except requests.exceptions.RequestException as e:
+            print(f"Error starting print: {e}")
+            return False
+        # Don't wait for the websocket to say so, or the next job could slip in before it does
+        self._set_state("printing")
         print("Print started successfully.")
-    except requests.exceptions.RequestException as e:
-        print(f"Error starting print: {e}")
+        return True
 
+    def enqueue_job(self, file_name):
+        """Adds an uploaded file to Moonraker's job queue."""
+        self._request("POST", "/server/job_queue/job", json={"filenames": [file_name]})
 
-def send_and_start_plotting(gcode_path):
-    if not os.path.exists(gcode_path):
-        print(f"G-code file does not exist: {gcode_path}")
-        return 1
-    uploaded_filename = moonraker_upload_gcode(gcode_path)
-    if uploaded_filename:
-        moonraker_start_print(uploaded_filename)
-    else:
-        return 2
-    return 0
+    def job_queue_status(self):
+        """Moonraker's job queue: {"queued_jobs": [...], "queue_state": "ready", "paused", ...}."""
+        return self._request("GET", "/server/job_queue/status")
+
+    def start_job_queue(self):
+        self._request("POST", "/server/job_queue/start")
+
+    def query_state(self):
+        """Asks for print_stats.state over HTTP."""
+        result = self._request("GET", "/printer/objects/query", params={"print_stats": "state"})
+        return result["status"]["print_stats"]["state"]
+
+    def refresh_state(self):
+        """Updates print_state over HTTP, for when the websocket is down."""
+        try:
+            self._set_state(self.query_state())
+        except requests.exceptions.RequestException as e:
+            print(f"Couldn't get the plotter's state: {e}")
+
+    def _set_state(self, state):
+        with self._state_changed:
+            changed = state != self.print_state
+            if changed:
+                print(f"Plotter is now {state}")
+            self.print_state = state
+            self._state_changed.notify_all()
+        if changed:
+            for listener in self.listeners:
+                listener(state)
+
+    def wait_until_idle(self, timeout=None):
+        """Blocks until nothing is plotting. Returns False if the timeout ran out first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._state_changed:
+            while True:
+                if not self.websocket_connected:
+                    self.refresh_state()
+                if self.print_state not in self.BUSY_STATES:
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                wait = MOONRAKER_POLL_SECONDS if remaining is None else min(remaining, MOONRAKER_POLL_SECONDS)
+                self._state_changed.wait(wait)
+
+    def start_watching(self):
+        self._watch_thread = threading.Thread(target=self._watch, name="moonraker-websocket", daemon=True)
+        self._watch_thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._websocket is not None:
+            self._websocket.close()
+        self.session.close()
+
+    def _watch(self):
+        """Keeps a websocket subscription to print_stats going, reconnecting with backoff."""
+        try:
+            from websockets.sync.client import connect
+        except ImportError:
+            print("websockets isn't installed, polling Moonraker over HTTP instead")
+            return
+        websocket_url = "ws" + self.url[len("http"):] + "/websocket"
+        delay = MOONRAKER_BACKOFF_SECONDS
+        while not self._stop.is_set():
+            try:
+                with connect(websocket_url, open_timeout=self.timeout[0]) as websocket:
+                    self._websocket = websocket
+                    self._subscribe(websocket)
+                    delay = MOONRAKER_BACKOFF_SECONDS
+                    for message in websocket:
+                        self._handle_message(websocket, json.loads(message))
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"Moonraker websocket: {e.__class__.__name__} {e}, reconnecting in {delay:.1f}s")
+            finally:
+                self._websocket = None
+                with self._state_changed:
+                    self.websocket_connected = False
+            self._stop.wait(delay)
+            delay = min(delay * 2, MOONRAKER_MAX_BACKOFF_SECONDS)
+
+    def _subscribe(self, websocket):
+        websocket.send(json.dumps({"jsonrpc": "2.0", "method": "printer.objects.subscribe",
+                                   "params": {"objects": {"print_stats": ["state"]}}, "id": 1}))
+
+    def _handle_message(self, websocket, message):
+        if message.get("id") == 1 and "result" in message:
+            # The subscription's reply has the current state
+            with self._state_changed:
+                self.websocket_connected = True
+            self._set_state(message["result"]["status"]["print_stats"]["state"])
+        elif message.get("id") == 1 and "error" in message:
+            print(f"Moonraker won't let us subscribe yet: {message['error'].get('message')}")
+        elif message.get("method") == "notify_status_update":
+            state = message["params"][0].get("print_stats", {}).get("state")
+            if state is not None:
+                self._set_state(state)
+        elif message.get("method") == "notify_klippy_ready":
+            self._subscribe(websocket)  # Klipper restarted, subscriptions are gone
+
+
+moonraker = None  # Set up in main()
+
+
+class PlotQueue:
+    """
+    Finished drawings waiting for the plotter, so back-to-back requests don't fail
+    on "printer busy" and the plotter never sits idle while something is ready.
+
+    A worker thread takes the first job, uploads it while the current drawing is
+    still plotting, and hands it over the moment the plotter goes idle: by
+    starting it ourselves ("local"), or by putting it in Moonraker's job queue,
+    which starts it without waiting for us ("moonraker", needs a [job_queue]
+    section with automatic_transition: True in moonraker.conf). Jobs wait in priority order, first come first
+    served within a priority, and can be moved around until they're taken.
+
+    Estimated waits add up the plot time estimates of everything ahead, corrected
+    by how long drawings have actually been taking compared to their estimates.
+    """
+    def __init__(self, client, mode=PLOT_QUEUE):
+        self.client = client
+        self.mode = mode
+        self.waiting = []  # Jobs not taken by the worker yet, in plotting order
+        self.handed_over = None  # Taken: uploading, or waiting for the plotter to start it
+        self.current = None  # On the plotter, with "started" set
+        self.plotted = 0
+        self.speed_ratio = 1.0  # Actual plot time / estimate, smoothed
+        self._next_id = 1
+        self._changed = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="plot-queue", daemon=True)
+        client.listeners.append(self._on_print_state)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Waits until everything still waiting is on the plotter (or in Moonraker's queue), then stops the worker."""
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        self._thread.join()
+
+    def __len__(self):
+        with self._changed:
+            return len(self.waiting)
+
+    def add(self, job, priority=0):
+        """Queues a job behind everything with the same or higher priority. Returns its queue id."""
+        with self._changed:
+            job["queue_id"] = self._next_id
+            job["priority"] = priority
+            self._next_id += 1
+            index = len(self.waiting)
+            while index > 0 and self.waiting[index - 1]["priority"] < priority:
+                index -= 1
+            self.waiting.insert(index, job)
+            self._changed.notify_all()
+            return job["queue_id"]
+
+    def move(self, queue_id, position):
+        """Moves a waiting job to a 1-based position among the waiting ones. False if it's been taken already."""
+        with self._changed:
+            job = self._find(queue_id)
+            if job is None:
+                return False
+            self.waiting.remove(job)
+            self.waiting.insert(max(0, min(position - 1, len(self.waiting))), job)
+            return True
+
+    def remove(self, queue_id):
+        with self._changed:
+            job = self._find(queue_id)
+            if job is None:
+                return False
+            self.waiting.remove(job)
+            return True
+
+    def _find(self, queue_id):
+        for job in self.waiting:
+            if job["queue_id"] == queue_id:
+                return job
+        return None
+
+    def _in_line(self):
+        """Every job that hasn't finished, in the order they'll plot."""
+        return [job for job in (self.current, self.handed_over) if job is not None] + self.waiting
+
+    def position(self, queue_id):
+        """Place in line, counting the drawing on the plotter; 1 means it's next (or plotting). None if it's done."""
+        with self._changed:
+            for index, job in enumerate(self._in_line()):
+                if job["queue_id"] == queue_id:
+                    return index + 1
+            return None
+
+    def estimated_wait(self, queue_id):
+        """Seconds until this job should start plotting: what's left of the current one plus everything ahead."""
+        with self._changed:
+            seconds = 0.0
+            for job in self._in_line():
+                if job["queue_id"] == queue_id:
+                    break
+                seconds += job["plot_seconds"] * self.speed_ratio
+                if job is self.current:
+                    seconds = max(seconds - (time.time() - job["started"]), 0.0)
+            return seconds
+
+    def place(self, queue_id):
+        """position() and estimated_wait() together, from the same moment. (None, None) if it's done."""
+        with self._changed:  # Reentrant, so both see the same line
+            position = self.position(queue_id)
+            if position is None:
+                return None, None
+            return position, self.estimated_wait(queue_id)
+
+    def stats_line(self):
+        with self._changed:
+            total = sum(job["plot_seconds"] for job in self.waiting) * self.speed_ratio
+            return (f"plot queue ({self.mode}): {len(self.waiting)} waiting (~{format_duration(total)}), "
+                    f"{'plotting' if self.current is not None else 'idle'}, {self.plotted} plotted, "
+                    f"actual/estimated plot time {self.speed_ratio:.2f}")
+
+    def _on_print_state(self, state):
+        """MoonrakerClient listener: keeps track of what's on the plotter, and how long it really took."""
+        with self._changed:
+            if state in MoonrakerClient.BUSY_STATES:
+                if self.current is None and self.handed_over is not None:
+                    self.current, self.handed_over = self.handed_over, None
+                    self.current["started"] = time.time()
+            elif self.current is not None:
+                actual = time.time() - self.current["started"]
+                if self.current["plot_seconds"] > 0:
+                    self.speed_ratio = 0.7 * self.speed_ratio + 0.3 * (actual / self.current["plot_seconds"])
+                self.plotted += 1
+                self.current = None
+            self._changed.notify_all()
+
+    def _take_next(self):
+        with self._changed:
+            while not self.waiting:
+                if self._stopping:
+                    return None
+                self._changed.wait()
+            self.handed_over = self.waiting.pop(0)
+            return self.handed_over
+
+    def _run(self):
+        while True:
+            job = self._take_next()
+            if job is None:
+                return
+            # Upload now; Moonraker doesn't mind files arriving while it plots
+            file_name = upload_job(job)
+            if file_name is None:
+                handed_over = False
+            elif self.mode == "moonraker":
+                handed_over = self._hand_to_moonraker(file_name)
+            else:
+                self.client.wait_until_idle()
+                handed_over = self.client.start_print(file_name)
+            if not handed_over:
+                with self._changed:
+                    self.handed_over = None
+                old_tts_say("Couldn't send that drawing to the plotter, skipping it")
+                continue
+            # Don't take the next job until this one is on the plotter, so the rest can still be reordered
+            while True:
+                with self._changed:
+                    if self.handed_over is not job:
+                        break
+                    self._changed.wait(MOONRAKER_POLL_SECONDS)
+                if not self.client.websocket_connected:
+                    self.client.refresh_state()
+
+    def _hand_to_moonraker(self, file_name):
+        """Waits until Moonraker's queue is empty, so priorities and moves stay ours, then queues the file there."""
+        try:
+            while True:
+                status = self.client.job_queue_status()
+                if not status["queued_jobs"]:
+                    break
+                time.sleep(MOONRAKER_POLL_SECONDS)
+            self.client.enqueue_job(file_name)
+            if status["queue_state"] == "paused":
+                self.client.start_job_queue()
+        except requests.exceptions.RequestException as e:
+            print(f"Error queueing {file_name} in Moonraker: {e}")
+            return False
+        print(f"Queued {file_name} in Moonraker's job queue.")
+        return True
+
+
+plot_queue = None  # Set up in main()
 
 old_tts_engine = None
+old_tts_lock = threading.Lock()  # pipeline stages can all want to talk at once
 
 def old_tts_say(message):
     print(message)
     global old_tts_engine
-    if old_tts_engine is None:
-        old_tts_engine = pyttsx3.init()
-    old_tts_engine.setProperty('rate', 300)
-    old_tts_engine.say(message)
-    old_tts_engine.runAndWait()
+    with old_tts_lock:
+        audio_path = cached_audio(message, TTS_VOICE)
+        if audio_path is not None:
+            playsound(audio_path)  # A stock phrase, synthesized ahead of time
+            return
+        if old_tts_engine is None:
+            old_tts_engine = pyttsx3.init()
+        old_tts_engine.setProperty('rate', 300)
+        old_tts_engine.say(message)
+        old_tts_engine.runAndWait()
     
 
-def keypad_send_command(port_name: str, command: str, baud_rate: int = 9600):
+class KeypadDriver:
     """
-    Sends a command string over the specified COM port.
+    Owns the keypad's serial port for the whole run, instead of opening it for
+    every command (which can reset the board, and cost 100 ms in the caller).
 
-    Args:
-        port_name (str): The name of the COM port (e.g., 'COM4').
-        command (str): The command string to send.
-        baud_rate (int): The baud rate for the serial communication.
+    send() only records the command; a background thread writes it. Commands are
+    coalesced by name, so if the color changes three times before the thread gets
+    to it, only the last one goes out, and one that's already showing isn't sent
+    again. If the port goes away, the thread keeps trying to reopen it and then
+    restores what the keypad should be showing.
+
+    A second thread reads what the keypad sends back, one line each:
+        OK             the oldest unacknowledged command was carried out
+        ERR <reason>   ...or wasn't
+        KEY <name>     a key was pressed; passed to the key_listeners
+        READY          the keypad (re)started and is blank again
+    Up to KEYPAD_WINDOW commands are written before waiting for their OKs, so
+    commands go out back to back without overrunning the keypad. Keypads that
+    never answer OK are detected after KEYPAD_ACK_TIMEOUT_SECONDS, and then
+    written to without waiting.
     """
-    try:
-        # Open the serial port
-        # 'timeout=1' ensures that read/write operations will not block indefinitely.
-        with serial.Serial(port_name, baud_rate, timeout=1) as ser:
-            print(f"--- Connected to {port_name} at {baud_rate} baud ---")
-            print(f"Sending command: '{command}'")
-
-            # Encode the command string to bytes (UTF-8 is a common encoding for serial)
-            # Add a newline character at the end as is common for many serial protocols
-            command_bytes = (command + '\n').encode('utf-8')
-            ser.write(command_bytes)
-            print("Command sent successfully.")
-            # Give a small delay to ensure the data is fully transmitted before closing
-            time.sleep(0.1)
-
-    except serial.SerialException as e:
-        print(f"Error: Could not open or communicate with port {port_name}. {e}")
-        print("Please ensure the port is available and not in use by another application.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
+    def __init__(self, port_name=VIRTUAL_COM_PORT, baud_rate=KEYPAD_BAUD_RATE):
+        self.port_name = port_name
+        self.baud_rate = baud_rate
+        self.serial = None
+        self.pending = collections.OrderedDict()  # command name -> latest full command
+        self.in_flight = collections.deque()  # (command, time written), waiting for an OK
+        self.shown = {}  # command name -> last command written to the keypad
+        self.acks = None  # Whether the keypad answers OK; None until we know
+        self.key_listeners = []  # Called with the key name (in the reader thread) for each KEY
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.reconnects = 0
+        self.ack_seconds = 0.0
+        self._changed = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="keypad", daemon=True)
+        self._reader = threading.Thread(target=self._read, name="keypad-reader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._reader.start()
+
+    def send(self, command):
+        """Queues a command like "SHOW_TEXT :O" without waiting for it."""
+        name = command.split(" ", 1)[0]
+        with self._changed:
+            if name in self.pending:
+                self.coalesced += 1
+            self.pending[name] = command
+            self._changed.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Waits until everything sent so far has been written, and acknowledged if the
+        keypad does that. False if the timeout ran out.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self.pending and not self.in_flight, timeout)
+
+    def close(self):
+        self.flush(timeout=2)
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+            port = self.serial
+        self._thread.join(timeout=2)
+        if port is not None:
+            port.close()
+        self._reader.join(timeout=2)
+
+    def stats_line(self):
+        with self._changed:
+            acks = f"{self.acked} acknowledged"
+            if self.acked:
+                acks += f" (avg {self.ack_seconds / self.acked * 1000:.0f} ms)"
+            if self.acks is False:
+                acks = "no acknowledgements"
+            return (f"keypad: {self.sent} sent, {acks}, {self.errors} errors, {self.coalesced} coalesced, "
+                    f"{self.skipped} already showing, {self.reconnects} reconnects")
+
+    def _open(self):
+        """Opens the port, retrying every KEYPAD_RECONNECT_SECONDS. False if we're stopping."""
+        complained = False
+        while True:
+            try:
+                port = serial.Serial(self.port_name, self.baud_rate, timeout=0.2, write_timeout=1)
+                print(f"--- Connected to keypad on {self.port_name} at {self.baud_rate} baud ---")
+                with self._changed:
+                    self.serial = port
+                    self._changed.notify_all()
+                return True
+            except serial.SerialException as e:
+                if not complained:
+                    print(f"Error: Could not open keypad port {self.port_name}, will keep trying. {e}")
+                    complained = True
+            with self._changed:
+                if self._stopping or self._changed.wait_for(lambda: self._stopping, KEYPAD_RECONNECT_SECONDS):
+                    return False
+
+    def _restore_shown(self):
+        """Queues everything the keypad should be showing again (newer commands win). Needs _changed."""
+        for name, command in self.shown.items():
+            self.pending.setdefault(name, command)
+        self.shown = {}
+        self.in_flight.clear()
+        self._changed.notify_all()
+
+    def _lost_connection(self, port, error):
+        with self._changed:
+            if self.serial is not port:
+                return  # The other thread got here first
+            self.serial = None
+            if self._stopping:
+                return
+            print(f"Lost the keypad ({error}), reconnecting...")
+            self.reconnects += 1
+            # The board may have reset, so show everything again
+            self._restore_shown()
+        try:
+            port.close()
+        except serial.SerialException:
+            pass
+
+    def _can_write(self):
+        return self.acks is False or len(self.in_flight) < KEYPAD_WINDOW
+
+    def _ack_overdue(self):
+        return bool(self.in_flight) and time.monotonic() - self.in_flight[0][1] > KEYPAD_ACK_TIMEOUT_SECONDS
+
+    def _run(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: (self._stopping or self.serial is None or self._ack_overdue()
+                                                or (self.pending and self._can_write())),
+                                       KEYPAD_ACK_TIMEOUT_SECONDS / 4)
+                if self._stopping:
+                    return
+                port = self.serial
+                if port is not None and self._ack_overdue():
+                    command = self.in_flight[0][0]
+                    if self.acks is None:
+                        print("The keypad doesn't acknowledge commands, so not waiting for it to.")
+                        self.acks = False
+                        self.in_flight.clear()
+                        self._changed.notify_all()
+                        continue
+                    port_lost = f"no OK for '{command}'"
+                elif port is not None and not (self.pending and self._can_write()):
+                    continue
+                else:
+                    port_lost = None
+            if port is None:
+                if not self._open():
+                    return
+                continue
+            if port_lost:
+                self._lost_connection(port, port_lost)
+                continue
+            with self._changed:
+                name, command = self.pending.popitem(last=False)
+                if self.shown.get(name) == command:
+                    self.skipped += 1
+                    self._changed.notify_all()
+                    continue
+                self.shown[name] = command
+                if self.acks is not False:
+                    self.in_flight.append((command, time.monotonic()))
+                self.sent += 1
+            try:
+                port.write((command + '\n').encode('utf-8'))
+                port.flush()
+            except (serial.SerialException, OSError) as e:
+                self._lost_connection(port, f"write failed: {e}")
+                continue
+            with self._changed:
+                self._changed.notify_all()
+
+    def _read(self):
+        buffer = b""
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._stopping or self.serial is not None)
+                if self._stopping:
+                    return
+                port = self.serial
+            try:
+                data = port.read(port.in_waiting or 1)  # Returns b"" after the port's timeout
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                # TypeError/AttributeError: pyserial, when close() pulls the port out from under read()
+                buffer = b""
+                self._lost_connection(port, f"read failed: {e}")
+                continue
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                self._handle_line(line.decode("utf-8", errors="replace").strip())
 
-def keypad_show_bg_color(hex_color, port_name = VIRTUAL_COM_PORT):
+    def _handle_line(self, line):
+        word, _, rest = line.partition(" ")
+        if word == "KEY" and rest:
+            print(f"Keypad key {rest} pressed")
+            for listener in self.key_listeners:
+                listener(rest)
+            return
+        with self._changed:
+            if word in ("OK", "ERR"):
+                self.acks = True
+                if not self.in_flight:
+                    return  # Left over from before a reconnect
+                command, written = self.in_flight.popleft()
+                self.acked += 1
+                self.ack_seconds += time.monotonic() - written
+                if word == "ERR":
+                    self.errors += 1
+                    print(f"Keypad couldn't do '{command}': {rest}")
+                    name = command.split(" ", 1)[0]
+                    if self.shown.get(name) == command:
+                        del self.shown[name]
+            elif word == "READY":
+                if self.shown or self.in_flight:
+                    print("Keypad restarted, showing everything again")
+                self._restore_shown()
+            elif line:
+                print(f"Keypad says: '{line}'")
+                return
+            self._changed.notify_all()
+
+
+_keypad = None
+_keypad_lock = threading.Lock()
+
+def keypad():
+    """The KeypadDriver, started on first use."""
+    global _keypad
+    with _keypad_lock:
+        if _keypad is None:
+            _keypad = KeypadDriver()
+            _keypad.key_listeners.append(lambda key: _controls.put(("keypad", key)))
+            _keypad.start()
+    return _keypad
+
+
+_controls = queue.Queue()  # ("console", line) or ("keypad", key name), for wait_for_control()
+_console_thread = None
+
+def _read_console():
+    while True:
+        try:
+            line = input()
+        except EOFError:
+            return  # No console (started from a service, say): only the keypad then
+        _controls.put(("console", line))
+
+def wait_for_control(prompt=None, fresh=False):
+    """
+    Waits for ENTER on the console or KEYPAD_RECORD_KEY on the keypad, whichever
+    comes first. Other keys are ignored. `fresh` ignores presses from before the call.
+
+    Returns:
+        "QUIT" for Q + ENTER or KEYPAD_QUIT_KEY, otherwise "GO".
+    """
+    global _console_thread
+    keypad()  # So its key presses come in
+    if _console_thread is None:
+        # input() can't be waited on together with the keypad, so it gets its own thread
+        _console_thread = threading.Thread(target=_read_console, name="console", daemon=True)
+        _console_thread.start()
+    if fresh:
+        while not _controls.empty():
+            _controls.get_nowait()
+    if prompt:
+        print(prompt, end="", flush=True)
+    while True:
+        try:
+            source, value = _controls.get(timeout=0.5)  # A timeout, so Ctrl+C still works on Windows
+        except queue.Empty:
+            continue
+        if source == "console":
+            return "QUIT" if value.strip().lower() == "q" else "GO"
+        if KEYPAD_QUIT_KEY is not None and value == KEYPAD_QUIT_KEY:
+            return "QUIT"
+        if value == KEYPAD_RECORD_KEY:
+            return "GO"
+
+
+def keypad_send_command(command: str):
+    """Sends a command string to the keypad (in the background, see KeypadDriver)."""
+    print(f"Keypad: '{command}'")
+    keypad().send(command)
+
+def keypad_show_bg_color(hex_color):
     """
     Constructs and sends a command to set the background color.
 
     Args:
-        port_name (str): The name of the COM port (e.g., 'COM4').
         hex_color (str): A 6-digit hexadecimal color code (e.g., 'FF0000' for red).
                          The function will prepend '0x' if not present, but expects
                          a valid 6-digit hex string.
@@ -366,14 +1734,13 @@ def keypad_show_bg_color(hex_color, port_name = VIRTUAL_COM_PORT):
         return
 
     command = f"SHOW_BG_COLOR {hex_color}"
-    keypad_send_command(port_name, command)
+    keypad_send_command(command)
 
-def keypad_show_text(text_content, port_name = VIRTUAL_COM_PORT):
+def keypad_show_text(text_content):
     """
     Constructs and sends a command to display text.
 
     Args:
-        port_name (str): The name of the COM port (e.g., 'COM4').
         text_content (str): The text string to display.
     """
     if not text_content.strip():
@@ -383,12 +1750,403 @@ def keypad_show_text(text_content, port_name = VIRTUAL_COM_PORT):
     # Escape any special characters if necessary, though for simple text, it might not be needed.
     # For this example, we'll assume basic text and send it as is.
     command = f"SHOW_TEXT {text_content.strip()}"
-    keypad_send_command(port_name, command)
+    keypad_send_command(command)
+
+
+# Irregular plurals the suffix rules in singularize() get wrong
+_IRREGULAR_PLURALS = {
+    "mice": "mouse", "geese": "goose", "people": "person", "children": "child",
+    "men": "man", "women": "woman", "teeth": "tooth", "feet": "foot",
+    "wolves": "wolf", "leaves": "leaf", "knives": "knife", "oxen": "ox",
+}
+
+def singularize(word):
+    """Rough lemmatizer for nouns: 'cats' -> 'cat', 'puppies' -> 'puppy', 'boxes' -> 'box'."""
+    if word in _IRREGULAR_PLURALS:
+        return _IRREGULAR_PLURALS[word]
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "ches", "shes", "zzes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize_subject(subject):
+    """Lowercased, punctuation-free, singular version of a subject, so "Cats!" and "cat" share a cache entry."""
+    words = re.findall(r"[a-z0-9']+", subject.lower())
+    return " ".join(singularize(word) for word in words)
+
+
+def drawing_settings():
+    """The settings that change the G-code a drawing turns into. Part of DrawingCache's keys."""
+    return {"preprocess": PREPROCESS_IMAGE, "vectorizer": VECTORIZER, "writer": GCODE_WRITER,
+            "optimize_travel": OPTIMIZE_TRAVEL, "simplify_mm": SIMPLIFY_TOLERANCE_MM,
+            "arcs": ARC_FITTING, "arc_tolerance_mm": ARC_TOLERANCE_MM, "time_budget": PLOT_TIME_BUDGET_SECONDS,
+            "pen_lifts": pen_lift_mode(), "join_mm": JOIN_TRAVEL_MM, "hop_mm": HOP_TRAVEL_MM}
+
+
+class DrawingCache:
+    """
+    On-disk cache of finished drawings, so popular subjects skip Gemini, AutoTrace
+    and vpype entirely.
+
+    Entries are keyed by a hash of the normalized subject, PROMPT_VERSION and
+    drawing_settings(), so changing e.g. ARC_FITTING makes fresh G-code instead of
+    replaying the old kind. Each entry is a folder holding the PNG, SVG and G-code
+    plus a meta.json. The G-code is named after the key so uploads of different
+    cached drawings don't clash. When the cache gets bigger than max_bytes, the
+    least recently used entries are deleted.
+    """
+    def __init__(self, cache_dir=DRAWING_CACHE_DIR, max_bytes=DRAWING_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, subject):
+        normalized = normalize_subject(subject)
+        settings = json.dumps(drawing_settings(), sort_keys=True)
+        return hashlib.sha256(f"{PROMPT_VERSION}:{settings}:{normalized}".encode("utf-8")).hexdigest()[:16]
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        with open(os.path.join(self._entry_dir(key), "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def lookup(self, subject):
+        """Returns the path of the cached G-code for this subject, or None."""
+        key = self._key(subject)
+        with self._lock:
+            meta = self._read_meta(key)
+            gcode_path = os.path.join(self._entry_dir(key), f"{key}.gcode")
+            if meta is None or not os.path.exists(gcode_path):
+                self.misses += 1
+                return None
+            meta["last_used"] = time.time()
+            meta["uses"] = meta.get("uses", 0) + 1
+            self._write_meta(key, meta)
+            self.hits += 1
+            return gcode_path
+
+    def store(self, subject, png_path, svg_path, gcode_path=None, gcode=None):
+        """
+        Copies a finished drawing's files into the cache. Missing files (e.g. no SVG)
+        are skipped. G-code that never went to disk can be passed as a string instead.
+        """
+        key = self._key(subject)
+        with self._lock:
+            entry_dir = self._entry_dir(key)
+            os.makedirs(entry_dir, exist_ok=True)
+            for src, name in ((png_path, "drawing.png"), (svg_path, "drawing.svg"), (gcode_path, f"{key}.gcode")):
+                if src and os.path.exists(src):
+                    shutil.copyfile(src, os.path.join(entry_dir, name))
+            if gcode is not None:
+                with open(os.path.join(entry_dir, f"{key}.gcode"), "w", encoding="utf-8") as f:
+                    f.write(gcode)
+            self._write_meta(key, {"subject": normalize_subject(subject), "prompt_version": PROMPT_VERSION,
+                                   "settings": drawing_settings(),
+                                   "created": time.time(), "last_used": time.time(), "uses": 0})
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total_bytes = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(key)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            meta = self._read_meta(key) or {}
+            entries.append((meta.get("last_used", 0), key, size))
+            total_bytes += size
+        entries.sort()
+        for last_used, key, size in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            print(f"Drawing cache full, evicting {key}")
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+            total_bytes -= size
+
+    def stats_line(self):
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0.0
+        return f"drawing cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+
+# Marks the end of the work; each stage passes it on to the next and then exits
+_PIPELINE_STOP = object()
+
+class PipelineStage:
+    """
+    One step of the request pipeline (transcribe, generate, vectorize, plot...).
+
+    Each stage has its own worker thread that takes items off `in_queue`, runs
+    `func` on them, and puts the result on `out_queue` for the next stage. If `func`
+    returns None (or raises), the item is dropped, e.g. a phrase that wasn't a
+    valid drawing request. The queues are bounded, so a slow stage makes the
+    earlier ones wait instead of piling up work.
+    """
+    def __init__(self, name, func, in_queue, out_queue=None):
+        self.name = name
+        self.func = func
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.busy = False
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent_seconds = collections.deque(maxlen=100)  # for the p95
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"stage-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def record(self, seconds, result, failed=False):
+        """Updates the latency counters after one item went through this stage."""
+        with self._lock:
+            self.processed += 1
+            self.total_seconds += seconds
+            self.last_seconds = seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.recent_seconds.append(seconds)
+            if failed:
+                self.failed += 1
+            elif result is None:
+                self.dropped += 1
+
+    def stats_line(self):
+        with self._lock:
+            avg = self.total_seconds / self.processed if self.processed else 0.0
+            p95 = float(np.percentile(self.recent_seconds, 95)) if self.recent_seconds else 0.0
+            depth = self.in_queue.qsize() if self.in_queue is not None else 0
+            return (f"{self.name:<10} queued={depth} busy={'Y' if self.busy else 'N'} "
+                    f"done={self.processed} dropped={self.dropped} failed={self.failed} "
+                    f"last={self.last_seconds:.2f}s avg={avg:.2f}s p95={p95:.2f}s max={self.max_seconds:.2f}s")
+
+    def _run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _PIPELINE_STOP:
+                if self.out_queue is not None:
+                    self.out_queue.put(_PIPELINE_STOP)
+                return
+            self.busy = True
+            start_time = time.perf_counter()
+            failed = False
+            try:
+                result = self.func(item)
+            except Exception as e:
+                traceback.print_exc()
+                print(f"{self.name} stage failed: {e}")
+                old_tts_say(f"{self.name} failed")
+                result = None
+                failed = True
+            self.record(time.perf_counter() - start_time, result, failed)
+            self.busy = False
+            if result is not None and self.out_queue is not None:
+                self.out_queue.put(result)
+
+
+class Pipeline:
+    """
+    A chain of PipelineStages joined by bounded queues.
+
+    The first stage (capture) isn't threaded; whoever owns the microphone calls
+    `submit()` with its output, which blocks if the next stage is backed up.
+    """
+    def __init__(self, stage_funcs, queue_size=PIPELINE_QUEUE_SIZE):
+        self.capture = PipelineStage("capture", None, None)
+        self.stages = []
+        self.in_queue = queue.Queue(maxsize=queue_size)
+        in_q = self.in_queue
+        for i, (name, func) in enumerate(stage_funcs):
+            is_last = i == len(stage_funcs) - 1
+            out_q = None if is_last else queue.Queue(maxsize=queue_size)
+            self.stages.append(PipelineStage(name, func, in_q, out_q))
+            in_q = out_q
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, item):
+        self.in_queue.put(item)
+
+    def stop(self):
+        """Lets everything already in the pipeline finish, then stops the workers."""
+        self.in_queue.put(_PIPELINE_STOP)
+        for stage in self.stages:
+            stage.join()
+
+    def print_stats(self):
+        print("--- Pipeline stats ---")
+        print(self.capture.stats_line())
+        for stage in self.stages:
+            print(stage.stats_line())
+        if drawing_cache is not None:
+            print(drawing_cache.stats_line())
+        if plot_queue is not None:
+            print(plot_queue.stats_line())
+        if _keypad is not None:
+            print(_keypad.stats_line())
+        if tts_cache is not None:
+            print(tts_cache.stats_line())
+
+
+drawing_cache = None  # Set up in main()
+tts_cache = None  # Likewise
+
+# From the generate stage on, each request travels through the pipeline as a "job"
+# dict: {"subject": ..., "png_path": ..., "drawing": ..., "gcode_path": ...,
+# "gcode_chunks": ..., "plot_seconds": ...}. A job that already has a gcode_path (a
+# cache hit) skips straight to plotting. "drawing" is set when the generate stage
+# already prepared the image for plotting, to pick between candidates. With the builtin G-code writer there's no file: gcode_chunks
+# is a generator that the upload pulls the G-code from. The plot stage hands jobs to
+# the PlotQueue, which adds "queue_id", "priority" and "started".
+
+def generate_stage(what_to_draw):
+    print('will draw: "' + what_to_draw + '"')
+    tts_thread = threading.Thread(
+        target=ai_comment_on_subject,
+        args=(what_to_draw,)
+    )
+    tts_thread.start()
+    job = {"subject": what_to_draw, "png_path": '', "drawing": None, "gcode_path": '', "gcode_chunks": None,
+           "plot_seconds": 0.0}
+    if drawing_cache is not None:
+        cached_gcode_path = drawing_cache.lookup(what_to_draw)
+        if cached_gcode_path is not None:
+            print(f"Cache hit for \"{normalize_subject(what_to_draw)}\": {cached_gcode_path}")
+            job["gcode_path"] = cached_gcode_path
+            return job
+    if DRAWING_CANDIDATES > 1 and VECTORIZER == "native":
+        drawing = generate_best_drawing(what_to_draw)
+        png_path = drawing["png_path"] if drawing is not None else ''
+        if GCODE_WRITER == "builtin":
+            job["drawing"] = drawing
+    else:
+        png_path = generate_drawing_png(what_to_draw)
+    if png_path == '':
+        old_tts_say('png_path is empty. skipping.')
+        return None
+    print("gemini's image is stored at " + png_path)
+    job["png_path"] = png_path
+    return job
+
+
+def fit_gcode_file(gcode_path):
+    """
+    Cuts G-code the builtin writer didn't make (vpype's, or a cached drawing's) down
+    to PLOT_TIME_BUDGET_SECONDS with fit_time_budget(), the way prepare_drawing()
+    does, and writes it again in place. Returns the new estimate.
+    """
+    settings = machine_settings()
+    with open(gcode_path, "r", encoding="utf-8") as f:
+        lines = gcode_lines(f, settings.arc_resolution)
+    lines = fit_time_budget(lines, settings, PLOT_TIME_BUDGET_SECONDS)
+    profile = dict(gwrite_profile(), vertical_flip=False, horizontal_flip=False)  # Read back in machine coordinates
+    chunks = iter_gwrite(lines, profile, arc_tolerance=ARC_TOLERANCE_MM if ARC_FITTING else 0.0)
+    with open(gcode_path, "w", encoding="utf-8") as f:
+        f.writelines(postprocess_pen_lifts(chunks))
+    return estimate_gcode_time(gcode_path, settings)
+
+
+def vectorize_stage(job):
+    from_cache = bool(job["gcode_path"])
+    png_path = job["png_path"]
+    if from_cache:
+        # The plot queue still wants to know how long it takes
+        estimate = estimate_gcode_time(job["gcode_path"], machine_settings())
+    elif VECTORIZER == "native" and GCODE_WRITER == "builtin":
+        streamed = png_to_gcode_stream(png_path, job["drawing"])
+        if streamed is None:
+            old_tts_say('Nothing to draw. skipping.')
+            return None
+        job["gcode_chunks"], estimate = streamed
+    else:
+        gcode_path = png_to_gcode(png_path)
+        if gcode_path == '':
+            old_tts_say('gcode_path is empty. skipping.')
+            return None
+        estimate = estimate_gcode_time(gcode_path, machine_settings())
+        job["gcode_path"] = gcode_path
+    print(f"Estimated plot time {format_duration(estimate['seconds'])}, "
+          f"{estimate['pen_down_mm'] / 1000:.1f} m of pen-down drawing, {estimate['pen_lifts']} pen lifts")
+    # The builtin writer already cut it down to the budget; a little slack for the estimates disagreeing
+    if estimate["seconds"] > PLOT_TIME_BUDGET_SECONDS * 1.05 and job["gcode_path"]:
+        estimate = fit_gcode_file(job["gcode_path"])
+    if estimate["seconds"] > PLOT_TIME_BUDGET_SECONDS * 1.05:
+        # Even its longest stroke alone is too slow
+        old_tts_say(f"That would take {estimate['seconds'] / 60:.0f} minutes to plot. Not gonna print that one.")
+        return None
+    job["plot_seconds"] = estimate["seconds"]
+    if drawing_cache is not None and job["gcode_path"] and not from_cache:
+        drawing_cache.store(job["subject"], png_path, os.path.splitext(png_path)[0] + ".svg", job["gcode_path"])
+    return job
+
+
+def upload_job(job):
+    """
+    Uploads a job's G-code to Moonraker: streamed from its generator, or read from
+    its file for cache hits and vpype output. Returns the uploaded file name, or None.
+    """
+    sent = None
+    if job["gcode_path"]:
+        if not os.path.exists(job["gcode_path"]):
+            print(f"G-code file does not exist: {job['gcode_path']}")
+            return None
+        file_name = os.path.basename(job["gcode_path"])
+        chunks = gcode_file_chunks(job["gcode_path"])
+    else:
+        file_name = os.path.splitext(os.path.basename(job["png_path"]))[0] + ".gcode"
+        chunks = job["gcode_chunks"]
+        if drawing_cache is not None:
+            sent = []  # upload() keeps everything here for retries anyway; the cache gets it afterwards
+    if not moonraker.upload(file_name, chunks, sent):
+        return None
+    if sent is not None:
+        drawing_cache.store(job["subject"], job["png_path"], None, gcode="".join(sent))
+    return file_name
+
+
+def plot_stage(job):
+    queue_id = plot_queue.add(job)
+    # The worker may have taken it and even finished it already (a failed upload returns at once)
+    position, wait = plot_queue.place(queue_id)
+    if position is not None and position > 1:
+        print(f"\"{job['subject']}\" is #{position} in line, about {format_duration(wait)} to wait")
+        keypad_show_text(f"#{position} ~{max(1, round(wait / 60))}m")
+    return job
 
 
 def main():
     keypad_show_bg_color("000000")
     keypad_show_text("-_-")
+    global tts_cache
+    if TTS_CACHE_DIR is not None:
+        tts_cache = AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+        set_cache(tts_cache)
+        presynthesize(STOCK_PHRASES, TTS_VOICE)  # While Whisper loads
     whisper_model = init_whisper()
     if whisper_model == None:
         old_tts_say("Whisper init fail")
@@ -397,41 +2155,51 @@ def main():
     keypad_show_text(":O")
     playsound("ready.mp3")
     keypad_show_text(":T")
+    global drawing_cache, moonraker, plot_queue
+    if DRAWING_CACHE_DIR is not None:
+        drawing_cache = DrawingCache()
+    if pen_lift_mode() != PEN_LIFTS:
+        print('printer.cfg has no PEN_UP_FAST/PEN_DOWN_FAST macros, so PEN_LIFTS = "hop" only joins')
+    moonraker = MoonrakerClient()
+    moonraker.start_watching()
+    plot_queue = PlotQueue(moonraker)
+    plot_queue.start()
+    wake_word_detector = init_wake_word_detector()
+    # capture -> transcribe -> generate -> vectorize -> plot, each in its own thread,
+    # so the next visitor can talk while the last drawing is still being made.
+    pipeline = Pipeline([
+        ("transcribe", lambda recording: transcribe_phrase(whisper_model, recording)),
+        ("generate", generate_stage),
+        ("vectorize", vectorize_stage),
+        ("plot", plot_stage),
+    ])
+    pipeline.start()
     try:
         done = False
         while not done:
-            what_to_draw = ''
-            while what_to_draw == '':
-                what_to_draw = get_phrase_from_user(whisper_model)
-            if what_to_draw == 'QUIT':
+            if wake_word_detector is not None:
+                if wait_for_wake_word(wake_word_detector) == 'QUIT':
+                    old_tts_say("Quit requested")
+                    done = True
+                    continue
+            start_time = time.perf_counter()
+            recording = record_phrase_audio()
+            pipeline.capture.record(time.perf_counter() - start_time, recording)
+            if recording is None:
+                continue
+            if isinstance(recording, str) and recording == 'QUIT':
                 old_tts_say("Quit requested")
                 done = True
                 continue
-            print('will draw: "' + what_to_draw + '"')
-            tts_thread = threading.Thread(
-                target=ai_comment_on_subject,
-                args=(what_to_draw,)
-            )
-            tts_thread.start()
-            png_path = generate_drawing_png(what_to_draw)
-            if png_path == '':
-                old_tts_say('png_path is empty. terminating.')
-                return 1
-            print("gemini's image is stored at " + png_path)
-            img = Image.open(png_path)
-            #img.show()
-            gcode_path = png_to_gcode(png_path)
-            if gcode_path == '':
-                old_tts_say('gcode_path is empty. terminating.')
-                return 1
-            gcode_size_bytes = os.path.getsize(gcode_path)
-            if gcode_size_bytes > 4000000:
-                old_tts_say(f'The G-code is huge at {gcode_size_bytes/1000000:.2f} MB. Not gonna print that one.')
-                return 1
-            err = send_and_start_plotting(gcode_path)
-            if err != 0:
-                old_tts_say(f"send_and_start_printing error {err}")
+            pipeline.submit(recording)
+            pipeline.print_stats()
             print("Next loop.")
+        print("Finishing up drawings already in progress...")
+        pipeline.stop()
+        plot_queue.stop()
+        pipeline.print_stats()
+        moonraker.close()
+        keypad().close()
         print("Exiting.")
     except Exception as e:
         print(f"{e}")
@@ -0,0 +1,132 @@
+import argparse
+import os
+import select
+import sys
+import time
+import tty
+
+# A fake keypad on a pseudo-terminal, for trying incrediplotter-ai.py's KeypadDriver
+# without the hardware (Linux and macOS only). Run it, then set VIRTUAL_COM_PORT to
+# the path it prints (a symlink that stays the same when it "unplugs"):
+#   python keypad-simulator.py --link /tmp/keypad --unplug-every 20
+# It shows what the keypad would be showing, and answers like the real one (see
+# KeypadDriver): OK or ERR for each command, READY when it (re)starts. Type a key
+# name and ENTER here to press that key, e.g. "A" to start or stop a recording.
+
+# --- Configuration ---
+LINK_PATH = "/tmp/keypad"
+
+
+class FakeKeypad:
+    def __init__(self, link_path, acks=True, ack_delay=0.0):
+        self.link_path = link_path
+        self.acks = acks
+        self.ack_delay = ack_delay
+        self.master = None
+        self.slave = None
+        self.buffer = b""
+        self.bg_color = None
+        self.text = None
+        self.commands = 0
+
+    def plug_in(self):
+        """Makes a new pseudo-terminal and points the link at it."""
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)  # No echo or line editing, like a real serial port
+        slave_path = os.ttyname(self.slave)
+        temp_link = self.link_path + ".new"
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        os.symlink(slave_path, temp_link)
+        os.replace(temp_link, self.link_path)
+        print(f"Keypad plugged in at {self.link_path} -> {slave_path}")
+        self.reply("READY")
+
+    def unplug(self):
+        """Closes the pseudo-terminal, so the driver's next write fails and it has to reconnect."""
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = self.slave = None
+        self.buffer = b""
+        # A real keypad comes back blank after a reset
+        self.bg_color = self.text = None
+        print("Keypad unplugged")
+
+    def read(self):
+        try:
+            data = os.read(self.master, 1024)
+        except OSError:
+            return
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            self.handle(line.decode("utf-8", errors="replace").strip())
+
+    def reply(self, line):
+        """Sends a line to the computer. Like the real thing, it's lost if nobody has the port open."""
+        try:
+            os.write(self.master, (line + "\n").encode("utf-8"))
+        except OSError:
+            pass
+
+    def handle(self, command):
+        self.commands += 1
+        name, _, argument = command.partition(" ")
+        time.sleep(self.ack_delay)  # Redrawing the screen
+        if name == "SHOW_BG_COLOR" and len(argument) == 6:
+            self.bg_color = argument
+        elif name == "SHOW_TEXT" and argument:
+            self.text = argument
+        else:
+            print(f"Unknown command: {command!r}")
+            if self.acks:
+                self.reply(f"ERR unknown command {name}")
+            return
+        print(f"[{self.commands:4d}] background #{self.bg_color or '------'}  text {self.text!r}")
+        if self.acks:
+            self.reply("OK")
+
+    def press(self, key):
+        print(f"Pressing {key}")
+        self.reply(f"KEY {key}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pretend to be the keypad on a pseudo-terminal.")
+    parser.add_argument("--link", default=LINK_PATH, help="Stable path to the fake port (default: %(default)s)")
+    parser.add_argument("--unplug-every", type=float, default=0,
+                        help="Unplug for a second every this many seconds, to test reconnecting (default: never)")
+    parser.add_argument("--no-acks", action="store_true", help="Don't answer OK/ERR, like older keypad firmware")
+    parser.add_argument("--ack-delay", type=float, default=0.0,
+                        help="Seconds each command takes before its OK (default: %(default)s)")
+    args = parser.parse_args()
+
+    keypad = FakeKeypad(args.link, acks=not args.no_acks, ack_delay=args.ack_delay)
+    keypad.plug_in()
+    next_unplug = time.monotonic() + args.unplug_every if args.unplug_every > 0 else None
+    console = [sys.stdin]
+    try:
+        while True:
+            ready, _, _ = select.select([keypad.master] + console, [], [], 0.1)
+            if keypad.master in ready:
+                keypad.read()
+            if sys.stdin in ready:
+                key = sys.stdin.readline()
+                if not key:
+                    console = []  # stdin closed, no more key presses
+                elif key.strip():
+                    keypad.press(key.strip())
+            if next_unplug is not None and time.monotonic() >= next_unplug:
+                keypad.unplug()
+                time.sleep(1)
+                keypad.plug_in()
+                next_unplug = time.monotonic() + args.unplug_every
+    except KeyboardInterrupt:
+        print(f"Exiting. Got {keypad.commands} commands.")
+    finally:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import base64
+import email.parser
+import email.policy
+import hashlib
+import http.server
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from plotter import load_machine_settings, estimate_gcode_time, format_duration
+
+# A stand-in for Moonraker, for trying incrediplotter-ai.py's MoonrakerClient without
+# a plotter. Set MOONRAKER_URL = "http://127.0.0.1:7125" and run:
+#   python moonraker-standin.py --time-scale 60 --fail-rate 0.2
+#
+# Speaks just enough of Moonraker's API:
+#   POST /server/files/upload          multipart "file" field, chunked or not
+#   POST /printer/print/start          ?filename=..., "plots" it for its estimated time
+#   GET  /printer/objects/query        ?print_stats, the current state
+#   POST /server/job_queue/job         {"filenames": [...]}, plotted one after another
+#   GET  /server/job_queue/status      queued_jobs and queue_state
+#   POST /server/job_queue/start
+#   GET  /websocket                    JSON-RPC: printer.objects.subscribe, then
+#                                      notify_status_update whenever print_stats.state changes
+# --fail-rate makes that fraction of HTTP requests fail with a 503 or a dropped
+# connection, to exercise the retries.
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 7125  # Moonraker's own port
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+gcode_dir = None
+time_scale = 60.0
+fail_rate = 0.0
+settings = None
+
+state = "standby"
+state_lock = threading.Lock()
+websockets = []  # Connected handlers, for notifications
+queued_jobs = []  # Moonraker's job queue: {"filename", "job_id", "time_added"}
+queue_state = "ready"
+next_job_id = 1
+
+
+def set_state(new_state):
+    global state
+    with state_lock:
+        state = new_state
+        clients = list(websockets)
+    print(f"print_stats.state = {new_state}")
+    for client in clients:
+        client.send_json({"jsonrpc": "2.0", "method": "notify_status_update",
+                          "params": [{"print_stats": {"state": new_state}}, time.monotonic()]})
+
+
+def plot(path):
+    """Pretends to plot: sleeps for the estimated plot time, sped up by time_scale."""
+    seconds = estimate_gcode_time(path, settings)["seconds"]
+    print(f"Plotting {os.path.basename(path)}, estimated {format_duration(seconds)}, "
+          f"taking {seconds / time_scale:.1f}s here")
+    time.sleep(seconds / time_scale)
+    set_state("complete")
+    start_next_queued_job()
+
+
+def start_plot(path):
+    """Starts "plotting" a file unless something already is. Returns False if busy."""
+    global state
+    with state_lock:
+        if state in ("printing", "paused"):
+            return False
+        state = "starting"  # So nobody else gets in before set_state() below
+    set_state("printing")
+    threading.Thread(target=plot, args=(path,), daemon=True).start()
+    return True
+
+
+def start_next_queued_job():
+    """Like Moonraker's job queue with automatic_transition: the next job starts as soon as the plotter is free."""
+    with state_lock:
+        if queue_state != "ready" or not queued_jobs or state in ("printing", "paused", "starting"):
+            return
+        job = queued_jobs.pop(0)
+    print(f"Job queue starting {job['filename']}")
+    start_plot(os.path.join(gcode_dir, job["filename"]))
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        print(f"{self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, message):
+        self.reply(status, {"error": {"code": status, "message": message}})
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def maybe_fail(self):
+        """Fails fail_rate of the requests, half with a 503 and half by hanging up."""
+        if random.random() >= fail_rate:
+            return False
+        if random.random() < 0.5:
+            self.error(503, "Stand-in failure")
+        else:
+            print(f"{self.command} {self.path} -> dropped")
+        self.close_connection = True
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/websocket" and self.headers.get("Upgrade", "").lower() == "websocket":
+            self.serve_websocket()
+            return
+        if self.maybe_fail():
+            return
+        if url.path == "/printer/objects/query":
+            self.reply(200, {"result": {"eventtime": time.monotonic(), "status": {"print_stats": {"state": state}}}})
+        elif url.path == "/server/job_queue/status":
+            self.reply(200, {"result": self.job_queue_status()})
+        else:
+            self.error(404, "Not found")
+
+    def do_POST(self):
+        global next_job_id, queue_state
+        url = urlparse(self.path)
+        body = self.read_body()
+        if self.maybe_fail():
+            return
+        if url.path == "/server/files/upload":
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode("utf-8") + b"\r\n\r\n" + body)
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    file_name = os.path.basename(part.get_filename())
+                    with open(os.path.join(gcode_dir, file_name), "wb") as f:
+                        f.write(part.get_payload(decode=True))
+                    print(f"Received {file_name}, {len(part.get_payload(decode=True))} bytes")
+                    self.reply(201, {"result": {"item": {"path": file_name, "root": "gcodes"}, "action": "create_file"}})
+                    return
+            self.error(400, "No file field")
+        elif url.path == "/printer/print/start":
+            file_name = parse_qs(url.query).get("filename", [""])[0]
+            path = os.path.join(gcode_dir, os.path.basename(file_name))
+            if not os.path.exists(path):
+                self.error(404, f"File {file_name} does not exist")
+            elif not start_plot(path):
+                self.error(400, "Printer is busy")
+            else:
+                self.reply(200, {"result": "ok"})
+        elif url.path == "/server/job_queue/job":
+            file_names = json.loads(body).get("filenames", []) if body else parse_qs(url.query).get("filenames", [""])[0].split(",")
+            for file_name in file_names:
+                if not os.path.exists(os.path.join(gcode_dir, os.path.basename(file_name))):
+                    self.error(400, f"File {file_name} does not exist")
+                    return
+            with state_lock:
+                for file_name in file_names:
+                    queued_jobs.append({"filename": os.path.basename(file_name), "job_id": f"{next_job_id:010X}",
+                                        "time_added": time.time()})
+                    next_job_id += 1
+            start_next_queued_job()
+            self.reply(200, {"result": self.job_queue_status()})
+        elif url.path == "/server/job_queue/start":
+            with state_lock:
+                queue_state = "ready"
+            start_next_queued_job()
+            self.reply(200, {"result": self.job_queue_status()})
+        else:
+            self.error(404, "Not found")
+
+    def job_queue_status(self):
+        with state_lock:
+            return {"queued_jobs": [dict(job, time_in_queue=time.time() - job["time_added"]) for job in queued_jobs],
+                    "queue_state": queue_state}
+
+    # --- Websocket, just enough of RFC 6455 for JSON text messages ---
+
+    def serve_websocket(self):
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode()).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode("ascii"))
+        self.end_headers()
+        self.send_lock = threading.Lock()
+        self.close_connection = True
+        print("Websocket connected")
+        try:
+            while True:
+                opcode, payload = self.read_frame()
+                if opcode == 0x8:  # Close
+                    self.send_frame(0x8, payload[:2])
+                    break
+                if opcode == 0x9:  # Ping
+                    self.send_frame(0xA, payload)
+                elif opcode == 0x1:
+                    self.handle_rpc(json.loads(payload))
+        except (ConnectionError, OSError, struct.error):
+            pass
+        finally:
+            with state_lock:
+                if self in websockets:
+                    websockets.remove(self)
+            print("Websocket disconnected")
+
+    def read_frame(self):
+        first, second = struct.unpack("!BB", self.rfile.read(2))
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if second & 0x80 else bytes(4)
+        payload = bytearray(self.rfile.read(length))
+        for i in range(length):
+            payload[i] ^= mask[i % 4]
+        return first & 0x0F, bytes(payload)
+
+    def send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 65536:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        with self.send_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def send_json(self, message):
+        try:
+            self.send_frame(0x1, json.dumps(message).encode("utf-8"))
+        except OSError:
+            pass
+
+    def handle_rpc(self, request):
+        if request.get("method") == "printer.objects.subscribe":
+            with state_lock:
+                if self not in websockets:
+                    websockets.append(self)
+                current = state
+            self.send_json({"jsonrpc": "2.0", "id": request.get("id"),
+                            "result": {"eventtime": time.monotonic(), "status": {"print_stats": {"state": current}}}})
+        else:
+            self.send_json({"jsonrpc": "2.0", "id": request.get("id"),
+                            "error": {"code": -32601, "message": f"Method not found: {request.get('method')}"}})
+
+
+def main():
+    global gcode_dir, time_scale, fail_rate, settings
+    parser = argparse.ArgumentParser(description="Pretend to be Moonraker, for testing without the plotter.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--gcode-dir", help="Where uploads go (default: a temporary directory)")
+    parser.add_argument("--time-scale", type=float, default=time_scale,
+                        help="How much faster than the real plotter to 'plot' (default: %(default)s)")
+    parser.add_argument("--fail-rate", type=float, default=fail_rate,
+                        help="Fraction of HTTP requests that fail, to test retries (default: %(default)s)")
+    args = parser.parse_args()
+
+    gcode_dir = args.gcode_dir or tempfile.mkdtemp(prefix="moonraker-standin-")
+    os.makedirs(gcode_dir, exist_ok=True)
+    time_scale = args.time_scale
+    fail_rate = args.fail_rate
+    settings = load_machine_settings()
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f"Stand-in Moonraker on http://{args.host}:{args.port}, uploads go to {gcode_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Exiting.")
+
+
+if __name__ == "__main__":
+    main()
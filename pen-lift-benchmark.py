@@ -0,0 +1,102 @@
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from plotter import load_machine_settings, estimate_gcode, postprocess_gcode, pen_macros, format_duration
+from plotter import load_gwrite_profile, preprocess_image, vectorize_image, prepare_lines, iter_gwrite
+
+# How much plot time the pen lift post-processor (plotter/postprocess.py) saves on
+# drawings that have already been made. By default it goes through the drawing cache:
+#   python pen-lift-benchmark.py
+#   python pen-lift-benchmark.py some.png other.gcode --join-mm 1.0
+# The cached G-code has already been post-processed (unless PEN_LIFTS was "always"),
+# so drawings are written again from their PNGs by the builtin writer, as is.
+# G-code files given here are taken to be as gwrite or vpype wrote them.
+# --macros prints the PEN_UP_FAST/PEN_DOWN_FAST macros to put in printer.cfg.
+
+CORPUS_GLOB = os.path.join("drawing_cache", "*", "drawing.png")
+MODES = ("join", "hop")  # What PEN_LIFTS in incrediplotter-ai.py can be, besides "always"
+
+
+def raw_gcode(png_path, profile):
+    """A drawing's G-code straight from the builtin writer, before any pen lift post-processing."""
+    ink = preprocess_image(Image.open(png_path))
+    polylines = vectorize_image(np.flipud(ink))  # Flipped like png_to_bw() does
+    lines, arc_tolerance = prepare_lines(polylines, profile)
+    return "".join(iter_gwrite(lines, profile, arc_tolerance=arc_tolerance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the plot time the pen lift post-processor saves.")
+    parser.add_argument("drawings", nargs="*", help=f"PNGs, or G-code without post-processing (default: {CORPUS_GLOB})")
+    parser.add_argument("--join-mm", type=float, default=None, help="Override JOIN_TRAVEL_MM")
+    parser.add_argument("--hop-mm", type=float, default=None, help="Override HOP_TRAVEL_MM")
+    parser.add_argument("--macros", action="store_true", help="Print the printer.cfg macros and exit")
+    args = parser.parse_args()
+
+    if args.macros:
+        print(pen_macros())
+        return
+    paths = args.drawings or sorted(glob.glob(CORPUS_GLOB))
+    if not paths:
+        print(f"No drawings found in {CORPUS_GLOB}. Pass some PNGs or G-code files.")
+        return
+    settings = load_machine_settings()
+    profile = load_gwrite_profile()
+    if "PEN_UP_FAST" not in settings.macro_dwells:
+        print("printer.cfg has no PEN_UP_FAST, so hops are estimated with full PEN_UP dwells.")
+    options = {}
+    if args.join_mm is not None:
+        options["join_mm"] = args.join_mm
+    if args.hop_mm is not None:
+        options["hop_mm"] = args.hop_mm
+
+    totals = {"always": 0.0, **{mode: 0.0 for mode in MODES}}
+    processing_seconds = 0.0
+    measured = 0
+    for path in paths:
+        if path.lower().endswith(".png"):
+            gcode = raw_gcode(path, profile)
+            if path.endswith(os.path.join("", "drawing.png")):
+                path = os.path.dirname(path)  # Name cache entries by their key
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                gcode = f.read()
+            if "PEN_UP_FAST" in gcode:
+                print(f"{path} has already been post-processed, so the savings will look smaller")
+        before = estimate_gcode([gcode], settings)
+        if not before["seconds"]:
+            print(f"{os.path.basename(path)}: nothing to draw, skipped")
+            continue
+        measured += 1
+        totals["always"] += before["seconds"]
+        line = f"{os.path.basename(path)}: {before['pen_lifts']} lifts, {format_duration(before['seconds'])}"
+        for mode in MODES:
+            stats = {}
+            start_time = time.perf_counter()
+            mode_options = dict(options, hop_mm=0.0) if mode == "join" else options
+            processed = "".join(postprocess_gcode([gcode], stats=stats, **mode_options))
+            processing_seconds += time.perf_counter() - start_time
+            after = estimate_gcode([processed], settings)
+            totals[mode] += after["seconds"]
+            line += (f", {mode} {format_duration(after['seconds'])} "
+                     f"(-{(1 - after['seconds'] / before['seconds']) * 100:.0f}%, {stats['joined']} joined, "
+                     f"{stats['hops']} hops)")
+        print(line)
+
+    if not measured:
+        return
+    print(f"{measured} drawings, {format_duration(totals['always'])} of plotting as written")
+    for mode in MODES:
+        saved = totals["always"] - totals[mode]
+        print(f"  {mode}: {format_duration(totals[mode])}, saves {format_duration(saved)} "
+              f"({saved / totals['always'] * 100:.0f}%), {format_duration(saved / measured)} per drawing")
+    print(f"Post-processing took {processing_seconds / (measured * len(MODES)) * 1000:.0f} ms per drawing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+from .vectorize import vectorize_image, write_svg
+from .gcode import lines_to_gcode, load_gwrite_profile, prepare_lines, iter_gwrite, home_position, gcode_lines
+from .preprocess import preprocess_image
+from .travel import optimize_travel
+from .estimate import MachineSettings, load_machine_settings, estimate_gcode_time, estimate_gcode, estimate_lines_time, fit_time_budget, format_duration
+from .postprocess import postprocess_gcode, estimate_postprocessed_lines, load_pen_servo, pen_macros
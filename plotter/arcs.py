@@ -0,0 +1,126 @@
+# Python standard modules
+from typing import List, Optional, Tuple
+
+# Downloaded modules
+import numpy as np
+
+# Finds runs of a polyline that lie on a circular arc, so gwrite can emit one
+# G2/G3 instead of a G1 per vertex. Klipper needs a [gcode_arcs] section in
+# printer.cfg to accept G2/G3; it splits them back into short moves itself.
+
+MIN_ARC_POINTS = 4  # An arc has to replace at least 3 G1 moves to be worth it
+MAX_ARC_RADIUS_MM = 500.0  # Flatter than this is left to the straight segments
+MAX_ARC_SWEEP = 2 * np.pi - 0.1  # Stay clear of full circles, where the end point is ambiguous
+
+
+def fit_circle(points: np.ndarray) -> Optional[Tuple[np.ndarray, float]]:
+    """
+    Least-squares (Kasa) circle through points: center and radius, or None if they're
+    (nearly) collinear. Unlike a circle through three of the vertices, this isn't
+    thrown off by the pixel staircase the vectorizer leaves on curves.
+    """
+    mean = points.mean(axis=0)
+    centered = points - mean
+    a = np.column_stack((2 * centered, np.ones(len(points))))
+    b = (centered ** 2).sum(axis=1)
+    solution, _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+    if rank < 3:
+        return None
+    center = solution[:2]
+    radius_squared = solution[2] + center @ center
+    if radius_squared <= 0:
+        return None
+    return center + mean, float(np.sqrt(radius_squared))
+
+
+def fit_arc(points: np.ndarray, tolerance: float) -> Optional[Tuple[np.ndarray, bool]]:
+    """
+    Checks whether all of `points` lie on one arc, within `tolerance`: every vertex
+    close to the best-fit circle, always turning the same way, and no chord bulging
+    out from the arc by more than the tolerance.
+
+    Returns:
+        (center, clockwise), or None if they don't.
+    """
+    circle = fit_circle(points)
+    if circle is None:
+        return None
+    center, radius = circle
+    if radius > MAX_ARC_RADIUS_MM:
+        return None
+    offsets = points - center
+    if np.max(np.abs(np.hypot(offsets[:, 0], offsets[:, 1]) - radius)) > tolerance:
+        return None
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    steps = (np.diff(angles) + np.pi) % (2 * np.pi) - np.pi
+    if not (np.all(steps > 0) or np.all(steps < 0)):
+        return None
+    if abs(steps.sum()) > MAX_ARC_SWEEP:
+        return None
+    # How far the arc strays from each of the chords it replaces
+    if radius * (1 - np.cos(np.max(np.abs(steps)) / 2)) > tolerance:
+        return None
+    return center, bool(steps[0] < 0)
+
+
+def fit_arcs(points: np.ndarray, tolerance: float, min_points: int = MIN_ARC_POINTS) -> List[Tuple]:
+    """
+    Splits a polyline into straight moves and arcs, greedily taking the longest arc
+    that fits from each vertex.
+
+    Returns:
+        A list of moves, each ("line", end_index) or ("arc", end_index, center, clockwise).
+    """
+    moves = []
+    count = len(points)
+    i = 0
+    while i < count - 1:
+        j = i + min_points - 1
+        arc = fit_arc(points[i:j + 1], tolerance) if j < count else None
+        if arc is None:
+            moves.append(("line", i + 1))
+            i += 1
+            continue
+        # Grow the arc by doubling, then binary search between the last fit and the first miss
+        good, step = j, 1
+        bad = count
+        while good + step < count:
+            candidate = fit_arc(points[i:good + step + 1], tolerance)
+            if candidate is None:
+                bad = good + step
+                break
+            good, arc = good + step, candidate
+            step *= 2
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            candidate = fit_arc(points[i:middle + 1], tolerance)
+            if candidate is None:
+                bad = middle
+            else:
+                good, arc = middle, candidate
+        moves.append(("arc", good, arc[0], arc[1]))
+        i = good
+    return moves
+
+
+def interpolate_arc(start: np.ndarray, end: np.ndarray, offset: np.ndarray, clockwise: bool,
+                    resolution: float) -> np.ndarray:
+    """
+    The points Klipper's gcode_arcs turns a G2/G3 into: equal steps of about
+    `resolution` mm around the center (start + offset), ending exactly on `end`.
+    Doesn't include the start point.
+    """
+    center = start + offset
+    from_center, to_center = start - center, end - center
+    travel = np.arctan2(from_center[0] * to_center[1] - from_center[1] * to_center[0], from_center @ to_center)
+    if travel < 0:
+        travel += 2 * np.pi
+    if clockwise:
+        travel -= 2 * np.pi
+    if travel == 0 and np.array_equal(start, end):
+        travel = 2 * np.pi  # Full circle
+    radius = float(np.hypot(*offset))
+    segments = max(1, int(abs(travel) * radius / resolution))
+    angles = np.arctan2(from_center[1], from_center[0]) + travel * np.arange(1, segments) / segments
+    points = center + radius * np.column_stack((np.cos(angles), np.sin(angles)))
+    return np.vstack((points, end[None]))
@@ -0,0 +1,323 @@
+# Python standard modules
+import configparser
+import math
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Downloaded modules
+import numpy as np
+
+# Local files
+from .arcs import interpolate_arc
+
+# Plot time estimates from the same limits Klipper plans with: printer.cfg's
+# max_velocity/max_accel/square_corner_velocity, the speed factor from the M220 in
+# the gwrite profile, and the G4 dwells in the PEN_UP/PEN_DOWN macros.
+
+PRINTER_CFG_PATH = os.path.join(os.path.dirname(__file__), "..", "printer.cfg")
+
+# Klipper's defaults for things printer.cfg and the G-code don't set
+KLIPPER_DEFAULT_SPEED = 25.0  # mm/s, used when no F has been given
+KLIPPER_SQUARE_CORNER_VELOCITY = 5.0  # mm/s
+KLIPPER_ARC_RESOLUTION = 1.0  # mm, [gcode_arcs] resolution
+
+
+@dataclass
+class MachineSettings:
+    max_velocity: float = 200.0
+    max_accel: float = 800.0
+    square_corner_velocity: float = KLIPPER_SQUARE_CORNER_VELOCITY
+    speed: float = KLIPPER_DEFAULT_SPEED  # Requested feed rate, before the speed factor
+    speed_factor: float = 1.0  # M220 S200 -> 2.0
+    pen_up_dwell: float = 0.25  # seconds
+    pen_down_dwell: float = 0.25
+    arc_resolution: float = KLIPPER_ARC_RESOLUTION  # G2/G3 get split into moves this long
+    macro_dwells: Dict[str, float] = field(default_factory=dict)  # Every macro's G4 dwells, like PEN_UP_FAST's
+
+    @property
+    def cruise_velocity(self) -> float:
+        return min(self.speed * self.speed_factor, self.max_velocity)
+
+
+def _macro_dwell(config: configparser.ConfigParser, macro: str, default: float) -> float:
+    section = f"gcode_macro {macro}"
+    if not config.has_section(section):
+        return default
+    dwells = re.findall(r"G4\s+P(\d+(?:\.\d+)?)", config.get(section, "gcode", fallback=""), re.IGNORECASE)
+    return sum(float(p) for p in dwells) / 1000 if dwells else 0.0
+
+
+def load_machine_settings(printer_cfg_path: str = PRINTER_CFG_PATH, profile: Optional[Dict] = None) -> MachineSettings:
+    """
+    Reads the motion limits, arc resolution and pen macro dwells from printer.cfg, and the speed
+    factor from the gwrite profile's document_start (klipper_pen if not given).
+    """
+    settings = MachineSettings()
+    config = configparser.ConfigParser(inline_comment_prefixes=("#", ";"), strict=False, interpolation=None)
+    if os.path.exists(printer_cfg_path):
+        config.read(printer_cfg_path)
+    if config.has_section("printer"):
+        settings.max_velocity = config.getfloat("printer", "max_velocity", fallback=settings.max_velocity)
+        settings.max_accel = config.getfloat("printer", "max_accel", fallback=settings.max_accel)
+        settings.square_corner_velocity = config.getfloat("printer", "square_corner_velocity",
+                                                          fallback=settings.square_corner_velocity)
+    if config.has_section("gcode_arcs"):
+        settings.arc_resolution = config.getfloat("gcode_arcs", "resolution", fallback=settings.arc_resolution)
+    settings.pen_up_dwell = _macro_dwell(config, "PEN_UP", settings.pen_up_dwell)
+    settings.pen_down_dwell = _macro_dwell(config, "PEN_DOWN", settings.pen_down_dwell)
+    for section in config.sections():
+        if section.startswith("gcode_macro "):
+            macro = section[len("gcode_macro "):].strip().upper()
+            settings.macro_dwells[macro] = _macro_dwell(config, macro, 0.0)
+
+    if profile is None:
+        from .gcode import load_gwrite_profile
+        profile = load_gwrite_profile()
+    speed_factor = re.search(r"M220\s+S(\d+(?:\.\d+)?)", profile.get("document_start", ""), re.IGNORECASE)
+    if speed_factor:
+        settings.speed_factor = float(speed_factor.group(1)) / 100
+    return settings
+
+
+def junction_velocities(points: np.ndarray, settings: MachineSettings) -> np.ndarray:
+    """
+    Highest speed the toolhead can have at each interior vertex of a polyline. Same
+    limits as Klipper's toolhead lookahead: the junction deviation derived from
+    square_corner_velocity, and the centripetal limit of the moves on either side.
+    """
+    directions = np.diff(points, axis=0)
+    lengths = np.hypot(directions[:, 0], directions[:, 1])
+    directions = directions / np.maximum(lengths, 1e-12)[:, None]
+    if len(directions) < 2:
+        return np.zeros(0)
+    accel = settings.max_accel
+    # cos of the angle between the incoming and (reversed) outgoing direction, as Klipper does it
+    cos_theta = np.clip(-np.sum(directions[:-1] * directions[1:], axis=1), -0.999999, 0.999999)
+    sin_half_theta = np.sqrt(0.5 * (1.0 - cos_theta))
+    tan_half_theta = sin_half_theta / np.sqrt(0.5 * (1.0 + cos_theta))
+    junction_deviation = settings.square_corner_velocity ** 2 * (np.sqrt(2.0) - 1.0) / accel
+    deviation_v2 = junction_deviation * accel * sin_half_theta / (1.0 - sin_half_theta)
+    centripetal_v2 = 0.5 * np.minimum(lengths[:-1], lengths[1:]) * tan_half_theta * accel
+    # Reversing direction completely means stopping
+    v2 = np.where(cos_theta >= 0.999999, 0.0, np.minimum(deviation_v2, centripetal_v2))
+    return np.sqrt(v2)
+
+
+def trapezoid_times(lengths: np.ndarray, entry: np.ndarray, exit_: np.ndarray, cruise: float, accel: float) -> np.ndarray:
+    """Time for each move given its length, entry and exit speed, with a trapezoidal (or triangular) speed profile."""
+    accel_distance = (cruise ** 2 - entry ** 2) / (2 * accel)
+    decel_distance = (cruise ** 2 - exit_ ** 2) / (2 * accel)
+    reaches_cruise = accel_distance + decel_distance <= lengths
+    peak = np.where(reaches_cruise, cruise,
+                    np.sqrt(np.maximum((2 * accel * lengths + entry ** 2 + exit_ ** 2) / 2, 0.0)))
+    peak = np.maximum(peak, np.maximum(entry, exit_))
+    ramp_time = (peak - entry) / accel + (peak - exit_) / accel
+    ramp_distance = (peak ** 2 - entry ** 2) / (2 * accel) + (peak ** 2 - exit_ ** 2) / (2 * accel)
+    cruise_time = np.maximum(lengths - ramp_distance, 0.0) / peak.clip(min=1e-9)
+    return ramp_time + cruise_time
+
+
+def polyline_time(points: np.ndarray, settings: MachineSettings) -> float:
+    """Time to draw one polyline, starting and ending at rest, with Klipper-style lookahead."""
+    if len(points) < 2:
+        return 0.0
+    lengths = np.hypot(*np.diff(points, axis=0).T)
+    moving = lengths > 1e-9
+    points = np.vstack((points[:1], points[1:][moving]))
+    lengths = lengths[moving]
+    if len(lengths) == 0:
+        return 0.0
+    cruise = settings.cruise_velocity
+    accel = settings.max_accel
+    limits = np.minimum(junction_velocities(points, settings), cruise)
+
+    # Speeds at each vertex: 0 at both ends, junction limited in between, then
+    # the accel limit applied forwards and backwards
+    speeds = [0.0] + limits.tolist() + [0.0]
+    move_lengths = lengths.tolist()
+    for i in range(1, len(speeds)):
+        speeds[i] = min(speeds[i], math.sqrt(speeds[i - 1] ** 2 + 2 * accel * move_lengths[i - 1]))
+    for i in range(len(speeds) - 2, -1, -1):
+        speeds[i] = min(speeds[i], math.sqrt(speeds[i + 1] ** 2 + 2 * accel * move_lengths[i]))
+    speeds = np.array(speeds)
+    return float(trapezoid_times(lengths, speeds[:-1], speeds[1:], cruise, accel).sum())
+
+
+def travel_time(distance: float, settings: MachineSettings) -> float:
+    """Time for a pen-up G0 move between two points, from rest to rest."""
+    if distance <= 1e-9:
+        return 0.0
+    return float(trapezoid_times(np.array([distance]), np.zeros(1), np.zeros(1),
+                                 settings.cruise_velocity, settings.max_accel)[0])
+
+
+def estimate_lines_time(lines: List[np.ndarray], settings: MachineSettings, start=(0.0, 0.0)) -> Dict[str, float]:
+    """
+    Estimated time to plot lines (in mm) in the given order: drawing, pen-up travel,
+    and a PEN_UP/PEN_DOWN pair per line.
+
+    Returns:
+        dict: seconds, draw_seconds, travel_seconds, dwell_seconds, travel_mm, pen_down_mm, pen_lifts
+    """
+    position = np.asarray(start, dtype=float)
+    draw_seconds = travel_seconds = travel_mm = pen_down_mm = 0.0
+    for line in lines:
+        distance = float(np.hypot(*(line[0] - position)))
+        travel_mm += distance
+        travel_seconds += travel_time(distance, settings)
+        draw_seconds += polyline_time(line, settings)
+        pen_down_mm += float(np.hypot(*np.diff(line, axis=0).T).sum()) if len(line) > 1 else 0.0
+        position = line[-1]
+    dwell_seconds = len(lines) * (settings.pen_up_dwell + settings.pen_down_dwell)
+    return {
+        "seconds": draw_seconds + travel_seconds + dwell_seconds,
+        "draw_seconds": draw_seconds,
+        "travel_seconds": travel_seconds,
+        "dwell_seconds": dwell_seconds,
+        "travel_mm": travel_mm,
+        "pen_down_mm": pen_down_mm,
+        "pen_lifts": len(lines),
+    }
+
+
+def fit_time_budget(lines: List[np.ndarray], settings: MachineSettings, budget_seconds: float,
+                    start=(0.0, 0.0)) -> List[np.ndarray]:
+    """
+    Drops the shortest strokes until the drawing fits in budget_seconds. Every
+    stroke costs a pen lift on top of its drawing time, and the short ones (hatching,
+    fur, leftover specks) are what the picture misses least. Order is kept.
+    """
+    estimate = estimate_lines_time(lines, settings, start)
+    before_seconds, before_count = estimate["seconds"], len(lines)
+    lengths = np.array([float(np.hypot(*np.diff(line, axis=0).T).sum()) if len(line) > 1 else 0.0 for line in lines])
+    keep = np.ones(len(lines), dtype=bool)
+    # Travel changes as strokes disappear, so re-estimate and go again if it's still over
+    while estimate["seconds"] > budget_seconds and keep.sum() > 1:
+        candidates = np.flatnonzero(keep)
+        candidates = candidates[np.argsort(lengths[candidates], kind="stable")][:-1]  # Always keep the longest
+        costs = np.array([polyline_time(lines[i], settings) for i in candidates])
+        costs += settings.pen_up_dwell + settings.pen_down_dwell
+        # Roughly what travelling over to it costs too
+        costs += [travel_time(float(np.hypot(*(lines[i][0] - (lines[i - 1][-1] if i > 0 else start)))), settings) / 2
+                  for i in candidates]
+        drop = int(np.searchsorted(np.cumsum(costs), estimate["seconds"] - budget_seconds)) + 1
+        keep[candidates[:drop]] = False
+        estimate = estimate_lines_time([line for line, kept in zip(lines, keep) if kept], settings, start)
+    if keep.all():
+        return lines
+    lines = [line for line, kept in zip(lines, keep) if kept]
+    print(f"Over the {format_duration(budget_seconds)} plot time budget: dropped the {before_count - len(lines)} "
+          f"shortest of {before_count} strokes, estimated plot time {format_duration(before_seconds)} -> "
+          f"{format_duration(estimate['seconds'])}")
+    return lines
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}m{seconds:02d}s"
+
+
+_WORD = re.compile(r"([A-Z])\s*(-?\d+(?:\.\d+)?)")
+
+
+def estimate_gcode_time(gcode_path: str, settings: MachineSettings) -> Dict[str, float]:
+    """Streams through a G-code file and estimates how long it takes to plot, see estimate_gcode()."""
+    with open(gcode_path, "r", encoding="utf-8") as f:
+        return estimate_gcode(f, settings)
+
+
+def estimate_gcode(chunks: Iterable[str], settings: MachineSettings) -> Dict[str, float]:
+    """
+    Estimates how long G-code takes to plot. `chunks` is the G-code text, any
+    number of lines at a time (an open file, or iter_gwrite()).
+
+    Moves are collected into runs that the toolhead can plan in one go, and each
+    run is timed with the same lookahead and trapezoid model as the line
+    estimates. A run ends at anything that makes Klipper stop: G4 dwells, the pen
+    macros (PEN_UP, PEN_DOWN, PEN_UP_FAST...; they dwell), homing, and the end of
+    the file. Understands G0/G1 with X/Y/F, G2/G3 with I/J (split up like Klipper
+    does), G90/G91, G28, G4 and M220.
+
+    Returns:
+        dict: seconds, move_seconds, dwell_seconds, pen_down_mm, travel_mm, pen_lifts, moves
+    """
+    x = y = 0.0
+    absolute = True
+    speed = settings.speed
+    speed_factor = settings.speed_factor
+    pen_down = False
+    run: List[Tuple[float, float]] = []
+    run_speeds = None  # (speed, speed_factor) the current run is planned with
+    totals = {"seconds": 0.0, "move_seconds": 0.0, "dwell_seconds": 0.0,
+              "pen_down_mm": 0.0, "travel_mm": 0.0, "pen_lifts": 0, "moves": 0}
+
+    def flush():
+        nonlocal run
+        if len(run) > 1:
+            run_settings = settings
+            if run_speeds != (settings.speed, settings.speed_factor):
+                run_settings = replace(settings, speed=run_speeds[0], speed_factor=run_speeds[1])
+            totals["move_seconds"] += polyline_time(np.array(run), run_settings)
+        run = []
+
+    def dwell(seconds):
+        flush()
+        totals["dwell_seconds"] += seconds
+
+    for raw_line in (line for chunk in chunks for line in chunk.splitlines()):
+        line = raw_line.split(";", 1)[0].strip().upper()
+        if not line:
+            continue
+        command = line.split(None, 1)[0]
+        if command.startswith("PEN_UP"):
+            dwell(settings.macro_dwells.get(command, settings.pen_up_dwell))
+            if pen_down:
+                totals["pen_lifts"] += 1
+            pen_down = False
+            continue
+        if command.startswith("PEN_DOWN"):
+            dwell(settings.macro_dwells.get(command, settings.pen_down_dwell))
+            pen_down = True
+            continue
+        words = {letter: float(value) for letter, value in _WORD.findall(line, len(command))}
+        if command in ("G0", "G1", "G00", "G01", "G2", "G3", "G02", "G03"):
+            if "F" in words:
+                speed = words["F"] / 60
+            target_x = words.get("X", x) if absolute else x + words.get("X", 0.0)
+            target_y = words.get("Y", y) if absolute else y + words.get("Y", 0.0)
+            if command in ("G2", "G3", "G02", "G03"):
+                path = interpolate_arc(np.array([x, y]), np.array([target_x, target_y]),
+                                       np.array([words.get("I", 0.0), words.get("J", 0.0)]),
+                                       command in ("G2", "G02"), settings.arc_resolution)
+                distance = float(np.hypot(*np.diff(np.vstack(([x, y], path)), axis=0).T).sum())
+                points = [tuple(point) for point in path.tolist()]
+            else:
+                distance = math.hypot(target_x - x, target_y - y)
+                points = [(target_x, target_y)]
+            if distance <= 1e-9:
+                continue
+            if run and run_speeds != (speed, speed_factor):
+                flush()  # Close enough: a speed change starts a new run
+            if not run:
+                run = [(x, y)]
+                run_speeds = (speed, speed_factor)
+            run.extend(points)
+            totals["moves"] += 1
+            totals["pen_down_mm" if pen_down else "travel_mm"] += distance
+            x, y = target_x, target_y
+        elif command == "G4":
+            dwell(words.get("P", 0.0) / 1000 + words.get("S", 0.0))
+        elif command == "G28":
+            flush()
+            x = y = 0.0  # Homing time isn't counted
+        elif command == "G90":
+            absolute = True
+        elif command == "G91":
+            absolute = False
+        elif command == "M220":
+            speed_factor = words.get("S", 100.0) / 100
+    flush()
+    totals["seconds"] = totals["move_seconds"] + totals["dwell_seconds"]
+    return totals
@@ -0,0 +1,379 @@
+# Python standard modules
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Downloaded modules
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Local files
+from .vectorize import simplify_polyline
+from .arcs import fit_arcs, interpolate_arc
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# In-process equivalents of the vpype command png_to_gcode used to run:
+#   vpype read in.svg linemerge --tolerance 0.1mm linesort
+#         layout --fit-to-margins 5mm 160x160mm gwrite --profile klipper_pen out.gcode
+# Lines are lists of (N, 2) float arrays. Like vpype, everything before layout() is
+# in the input's own units; pixels are treated as CSS pixels (96 per inch).
+
+PX_TO_MM = 25.4 / 96
+PAGE_SIZE_MM = (160.0, 160.0)
+MARGIN_MM = 5.0
+MERGE_TOLERANCE_MM = 0.1
+PEN_WIDTH_MM = 0.4
+# Vertices closer than this to the simplified line are dropped before gwrite. Half
+# a pen width can't be seen on paper, and it takes out the pixel staircase the
+# vectorizer leaves on curves and diagonals.
+SIMPLIFY_TOLERANCE_MM = 0.5 * PEN_WIDTH_MM
+# How far G2/G3 arcs may stray from the (already simplified) strokes they replace
+ARC_TOLERANCE_MM = 0.5 * PEN_WIDTH_MM
+# Traced strokes step from pixel to pixel, so neither of the above can be finer than
+# the staircase that leaves on curves and diagonals, measured in pixels on paper
+STAIRCASE_PIXELS = 0.75
+ARC_STAIRCASE_PIXELS = 1.0
+ARC_TEMPLATE = "G{g} X{x:.3f} Y{y:.3f} I{i:.3f} J{j:.3f}\n"
+PROFILE_NAME = "klipper_pen"
+
+# Where .vpype.toml is looked for: the user's home directory first (where vpype itself
+# reads it from), then the copy in this repo
+PROFILE_PATHS = [
+    os.path.join(os.path.expanduser("~"), ".vpype.toml"),
+    os.path.join(os.path.dirname(__file__), "..", ".vpype.toml"),
+]
+
+
+def linemerge(lines: List[np.ndarray], tolerance: float) -> List[np.ndarray]:
+    """
+    Joins lines whose ends are within `tolerance` of each other, reversing them
+    where needed, like `vpype linemerge`.
+    """
+    count = len(lines)
+    if count < 2:
+        return list(lines)
+    starts = np.array([line[0] for line in lines])
+    ends = np.array([line[-1] for line in lines])
+    # Point i is the start of line i, point i + count is the end of line i
+    tree = cKDTree(np.vstack((starts, ends)))
+    used = np.zeros(count, dtype=bool)
+    merged = []
+    for i in range(count):
+        if used[i]:
+            continue
+        used[i] = True
+        chain = [lines[i]]
+        # Grow the chain off its end, then flip it around and grow off the other end
+        for _ in range(2):
+            while True:
+                tip = chain[-1][-1]
+                pick = None
+                for candidate in sorted(tree.query_ball_point(tip, tolerance)):
+                    if not used[candidate % count]:
+                        pick = candidate
+                        break
+                if pick is None:
+                    break
+                j = pick % count
+                used[j] = True
+                line = lines[j] if pick < count else lines[j][::-1]
+                if np.array_equal(line[0], tip):
+                    line = line[1:]
+                if len(line):
+                    chain.append(line)
+            chain = [line[::-1] for line in reversed(chain)]
+        merged.append(np.vstack(chain))
+    return merged
+
+
+def linesort(lines: List[np.ndarray], start: Tuple[float, float] = (0.0, 0.0)) -> List[np.ndarray]:
+    """
+    Greedy nearest-neighbour ordering of lines to cut down pen-up travel, allowing
+    lines to be drawn backwards, like `vpype linesort`.
+    """
+    count = len(lines)
+    if count < 2:
+        return list(lines)
+    endpoints = np.vstack((np.array([line[0] for line in lines]), np.array([line[-1] for line in lines])))
+    tree = cKDTree(endpoints)
+    used = np.zeros(count, dtype=bool)
+    position = np.asarray(start, dtype=float)
+    ordered = []
+    for _ in range(count):
+        k = 8
+        while True:
+            _, candidates = tree.query(position, k=min(k, 2 * count))
+            candidates = np.atleast_1d(candidates)
+            free = [c for c in candidates if not used[c % count]]
+            if free or k >= 2 * count:
+                break
+            k *= 4
+        pick = free[0]
+        j = pick % count
+        used[j] = True
+        line = lines[j] if pick < count else lines[j][::-1]
+        ordered.append(line)
+        position = line[-1]
+    return ordered
+
+
+def bounds(lines: List[np.ndarray]) -> Optional[Tuple[float, float, float, float]]:
+    """(min_x, min_y, max_x, max_y) of all the lines, or None if there aren't any."""
+    if not lines:
+        return None
+    points = np.vstack(lines)
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+
+def layout(lines: List[np.ndarray], page_size: Tuple[float, float] = PAGE_SIZE_MM,
+           margin: float = MARGIN_MM) -> List[np.ndarray]:
+    """
+    Scales the drawing to fit the page minus the margins (keeping its aspect ratio)
+    and centers it, like `vpype layout --fit-to-margins`. Output is in page units.
+    """
+    box = bounds(lines)
+    if box is None:
+        return []
+    min_x, min_y, max_x, max_y = box
+    width, height = max_x - min_x, max_y - min_y
+    usable_w, usable_h = page_size[0] - 2 * margin, page_size[1] - 2 * margin
+    scale = min(usable_w / width if width > 0 else np.inf, usable_h / height if height > 0 else np.inf)
+    if not np.isfinite(scale):
+        scale = 1.0
+    offset = np.array([(page_size[0] - width * scale) / 2, (page_size[1] - height * scale) / 2])
+    origin = np.array([min_x, min_y])
+    return [(line - origin) * scale + offset for line in lines]
+
+
+def load_gwrite_profile(name: str = PROFILE_NAME, paths: Optional[List[str]] = None) -> Dict:
+    """Reads a [gwrite.<name>] profile from the first .vpype.toml that has it."""
+    for path in paths if paths is not None else PROFILE_PATHS:
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+        profile = config.get("gwrite", {}).get(name)
+        if profile is not None:
+            return profile
+    raise ValueError(f"gwrite profile '{name}' not found in {paths if paths is not None else PROFILE_PATHS}")
+
+
+def iter_gwrite(lines: List[np.ndarray], profile: Dict, page_size: Tuple[float, float] = PAGE_SIZE_MM,
+                arc_tolerance: float = 0.0) -> Iterator[str]:
+    """
+    Formats lines (in mm, on the page) as G-code using a vpype-gcode style profile,
+    like `vpype gwrite --profile ...`. Supports the document/layer/line/segment
+    templates, vertical_flip and horizontal_flip, and {x} {y} {dx} {dy} {index}
+    placeholders.
+
+    With an arc_tolerance (mm), runs of vertices that lie on a circular arc are
+    written as one G2/G3 using the profile's "arc" template (ARC_TEMPLATE if it
+    has none), which also gets {g} (2 or 3) and {i} {j} (center, relative to the
+    arc's start).
+
+    Yields the G-code a piece at a time (the document start, then one piece per
+    line, then the end), formatting each line only when it's asked for.
+    """
+    unit = profile.get("unit", "mm")
+    if unit not in ("mm", "millimeter"):
+        raise ValueError(f"Only mm is supported for gwrite, not {unit}")
+    segment_template = profile.get("segment", "")
+    segment_first = profile.get("segment_first", segment_template)
+    segment_last = profile.get("segment_last", segment_template)
+    arc_template = profile.get("arc", ARC_TEMPLATE)
+    line_start = profile.get("line_start", "")
+    line_end = profile.get("line_end", "")
+
+    yield profile.get("document_start", "") + profile.get("layer_start", "")
+    last = np.zeros(2)
+    for line_index, line in enumerate(lines):
+        out = []
+        points = np.array(line, dtype=float)
+        if profile.get("horizontal_flip", False):
+            points[:, 0] = page_size[0] - points[:, 0]
+        if profile.get("vertical_flip", False):
+            points[:, 1] = page_size[1] - points[:, 1]
+        out.append(line_start.format(index=line_index))
+        # Arcs are fitted after flipping, so G2/G3 turn the way the machine sees them
+        if arc_tolerance > 0:
+            moves = fit_arcs(points, arc_tolerance)
+        else:
+            moves = [("line", i) for i in range(1, len(points))]
+        x, y = points[0]
+        out.append(segment_first.format(x=x, y=y, dx=x - last[0], dy=y - last[1], index=0))
+        last = (x, y)
+        for move in moves:
+            i = move[1]
+            x, y = points[i]
+            if move[0] == "arc":
+                center, clockwise = move[2], move[3]
+                out.append(arc_template.format(g=2 if clockwise else 3, x=x, y=y, i=center[0] - last[0],
+                                               j=center[1] - last[1], dx=x - last[0], dy=y - last[1], index=i))
+            else:
+                template = segment_last if i == len(points) - 1 else segment_template
+                out.append(template.format(x=x, y=y, dx=x - last[0], dy=y - last[1], index=i))
+            last = (x, y)
+        out.append(line_end.format(index=line_index))
+        yield "".join(out)
+    yield profile.get("layer_end", "") + profile.get("document_end", "")
+
+
+def gwrite(lines: List[np.ndarray], profile: Dict, page_size: Tuple[float, float] = PAGE_SIZE_MM,
+           arc_tolerance: float = 0.0) -> str:
+    """iter_gwrite() as one string."""
+    return "".join(iter_gwrite(lines, profile, page_size, arc_tolerance))
+
+
+_WORD = re.compile(r"([A-Z])\s*(-?\d+(?:\.\d+)?)")
+
+
+def gcode_lines(chunks: Iterable[str], arc_resolution: float) -> List[np.ndarray]:
+    """
+    Reads the strokes back out of G-code written elsewhere (vpype, or an older run
+    in the drawing cache): the moves from each PEN_DOWN (or PEN_DOWN_FAST) to the
+    next PEN_UP, as polylines in machine coordinates (mm). G2/G3 are split into
+    moves of arc_resolution mm like Klipper does (MachineSettings.arc_resolution).
+    Write them again with a profile that has no flips.
+    """
+    lines: List[np.ndarray] = []
+    stroke: Optional[List[Tuple[float, float]]] = None
+    x = y = 0.0
+    absolute = True
+
+    def end_stroke():
+        nonlocal stroke
+        if stroke is not None and len(stroke) > 1:
+            lines.append(np.array(stroke))
+        stroke = None
+
+    for raw_line in (line for chunk in chunks for line in chunk.splitlines()):
+        line = raw_line.split(";", 1)[0].strip().upper()
+        if not line:
+            continue
+        command = line.split(None, 1)[0]
+        if command.startswith("PEN_UP"):
+            end_stroke()
+        elif command.startswith("PEN_DOWN"):
+            end_stroke()
+            stroke = [(x, y)]
+        elif command in ("G0", "G1", "G00", "G01", "G2", "G3", "G02", "G03"):
+            words = {letter: float(value) for letter, value in _WORD.findall(line, len(command))}
+            target_x = words.get("X", x) if absolute else x + words.get("X", 0.0)
+            target_y = words.get("Y", y) if absolute else y + words.get("Y", 0.0)
+            if stroke is not None:
+                if command in ("G2", "G3", "G02", "G03"):
+                    path = interpolate_arc(np.array([x, y]), np.array([target_x, target_y]),
+                                           np.array([words.get("I", 0.0), words.get("J", 0.0)]),
+                                           command in ("G2", "G02"), arc_resolution)
+                    stroke.extend(tuple(point) for point in path.tolist())
+                else:
+                    stroke.append((target_x, target_y))
+            x, y = target_x, target_y
+        elif command == "G28":
+            end_stroke()
+            x = y = 0.0
+        elif command == "G90":
+            absolute = True
+        elif command == "G91":
+            absolute = False
+    end_stroke()
+    return lines
+
+
+def prepare_lines(lines: List[np.ndarray], profile: Optional[Dict] = None, units_to_mm: float = PX_TO_MM,
+                  merge_tolerance: float = MERGE_TOLERANCE_MM, optimize: bool = True,
+                  time_budget: Optional[float] = None, simplify_tolerance: float = SIMPLIFY_TOLERANCE_MM,
+                  arcs: bool = False) -> Tuple[List[np.ndarray], float]:
+    """
+    Everything lines_to_gcode() does before gwrite, for callers that want to
+    stream the G-code with iter_gwrite() themselves. Same arguments.
+
+    Returns:
+        The lines in mm on the page, in plotting order, and the arc_tolerance to
+        pass to gwrite (0 without arcs).
+    """
+    if profile is None:
+        profile = load_gwrite_profile()
+    lines = [np.asarray(line, dtype=float) * units_to_mm for line in lines if len(line) > 0]
+    lines = linemerge(lines, merge_tolerance)
+    box = bounds(lines)
+    lines = layout(lines)
+    if not lines:
+        return lines, 0.0
+    # How big one input unit (pixel) ended up on paper
+    new_box = bounds(lines)
+    span = max(box[2] - box[0], box[3] - box[1])
+    pixel_mm = units_to_mm * (max(new_box[2] - new_box[0], new_box[3] - new_box[1]) / span if span > 0 else 1.0)
+    if simplify_tolerance > 0:
+        lines = simplify_lines(lines, max(simplify_tolerance, STAIRCASE_PIXELS * pixel_mm))
+    start = home_position(profile)
+    settings = None
+    if optimize or time_budget is not None:
+        from .estimate import load_machine_settings
+        settings = load_machine_settings(profile=profile)
+    if optimize:
+        from .travel import optimize_travel
+        lines = optimize_travel(lines, start=start, settings=settings)
+    else:
+        lines = linesort(lines, start)
+    if time_budget is not None:
+        from .estimate import fit_time_budget
+        lines = fit_time_budget(lines, settings, time_budget, start)
+    return lines, max(ARC_TOLERANCE_MM, ARC_STAIRCASE_PIXELS * pixel_mm) if arcs else 0.0
+
+
+def lines_to_gcode(lines: List[np.ndarray], profile: Optional[Dict] = None, units_to_mm: float = PX_TO_MM,
+                   merge_tolerance: float = MERGE_TOLERANCE_MM, optimize: bool = True,
+                   time_budget: Optional[float] = None, simplify_tolerance: float = SIMPLIFY_TOLERANCE_MM,
+                   arcs: bool = False) -> str:
+    """
+    The whole `linemerge linesort layout gwrite` chain in one go.
+
+    Args:
+        lines: Polylines in input units (pixels, by default).
+        profile: gwrite profile; klipper_pen from .vpype.toml if not given.
+        units_to_mm: Size of one input unit in mm.
+        merge_tolerance: linemerge tolerance in mm.
+        optimize: Use the pen-up travel optimizer (plotter/travel.py) instead of
+                  plain linesort, and print the plot time it saves.
+        simplify_tolerance: Ramer-Douglas-Peucker tolerance in mm, applied after
+                            layout; 0 to keep every vertex. Raised to cover the
+                            pixel staircase when pixels end up bigger than the pen.
+                            The vertex counts it saves are printed.
+        time_budget: Estimated plot time limit in seconds. Longer drawings lose their
+                     shortest strokes until they fit (see estimate.fit_time_budget).
+        arcs: Write curves as G2/G3 arcs (needs [gcode_arcs] in printer.cfg) and
+              print how many moves they replace.
+
+    Returns:
+        str: The G-code.
+    """
+    if profile is None:
+        profile = load_gwrite_profile()
+    lines, arc_tolerance = prepare_lines(lines, profile, units_to_mm, merge_tolerance, optimize, time_budget,
+                                         simplify_tolerance, arcs)
+    gcode = gwrite(lines, profile, arc_tolerance=arc_tolerance)
+    if arc_tolerance > 0:
+        g1_count = sum(len(line) - 1 for line in lines)
+        arc_count = gcode.count("\nG2 ") + gcode.count("\nG3 ")
+        print(f"Arc fitting: {g1_count} G1 moves -> {arc_count} arcs and "
+              f"{gcode.count(chr(10) + 'G1 ')} G1 moves, {len(gcode) / 1000:.0f} kB")
+    return gcode
+
+
+def simplify_lines(lines: List[np.ndarray], tolerance: float) -> List[np.ndarray]:
+    """simplify_polyline() on every line, printing how many vertices go."""
+    simplified = [simplify_polyline(line, tolerance) for line in lines]
+    before_vertices, after_vertices = sum(len(line) for line in lines), sum(len(line) for line in simplified)
+    print(f"Simplified to {tolerance:.2f} mm: {before_vertices} -> {after_vertices} vertices")
+    return simplified
+
+
+def home_position(profile: Dict, page_size: Tuple[float, float] = PAGE_SIZE_MM) -> Tuple[float, float]:
+    """Where the machine's X0 Y0 is on the page, before gwrite flips anything."""
+    return (page_size[0] if profile.get("horizontal_flip", False) else 0.0,
+            page_size[1] if profile.get("vertical_flip", False) else 0.0)
@@ -0,0 +1,229 @@
+# Python standard modules
+import configparser
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Downloaded modules
+import numpy as np
+
+# Local files
+from .gcode import PEN_WIDTH_MM
+from .estimate import PRINTER_CFG_PATH, MachineSettings, estimate_lines_time, travel_time
+
+# Cuts down the time the plotter spends waiting on the pen servo. gwrite lifts the
+# pen before every line (PEN_UP, G0 to the start, PEN_DOWN), and each of those
+# macros dwells 250 ms so the servo gets there, which adds up to minutes on busy
+# drawings. This goes through finished G-code and:
+#   - keeps the pen down across gaps shorter than JOIN_TRAVEL_MM, drawing the tiny
+#     connecting move instead of lifting over it
+#   - lifts only partway for travel shorter than HOP_TRAVEL_MM, with the
+#     PEN_UP_FAST/PEN_DOWN_FAST macros, whose dwells are the full ones scaled by
+#     how far the servo actually turns (pen_macros() writes them for printer.cfg)
+#   - drops a PEN_UP when the pen is already up
+
+# Gaps this short get drawn over. Two pen widths is about where a gap stops being visible
+JOIN_TRAVEL_MM = 2 * PEN_WIDTH_MM
+# Travel shorter than this gets the partial lift; longer travel lifts all the way, in
+# case the paper isn't flat
+HOP_TRAVEL_MM = 20.0
+HOP_FRACTION = 0.5  # How much of the full lift the partial one does
+MIN_DWELL_SECONDS = 0.03  # Even a tiny servo move needs a moment to settle
+FAST_UP_MACRO = "PEN_UP_FAST"
+FAST_DOWN_MACRO = "PEN_DOWN_FAST"
+
+_WORD = re.compile(r"([A-Z])\s*(-?\d+(?:\.\d+)?)")
+_TRAVEL_COMMANDS = ("G0", "G1", "G00", "G01")
+
+
+@dataclass
+class PenServo:
+    servo: str = "my_pen"
+    up_angle: float = 117.0
+    down_angle: float = 45.0
+    up_dwell: float = 0.25  # seconds
+    down_dwell: float = 0.25
+
+    def hop_angle(self, fraction: float = HOP_FRACTION) -> float:
+        return self.down_angle + fraction * (self.up_angle - self.down_angle)
+
+    def scaled_dwell(self, full_dwell: float, fraction: float = HOP_FRACTION) -> float:
+        """A dwell for turning `fraction` of the full lift, if the full one needs full_dwell. Whole ms."""
+        return max(MIN_DWELL_SECONDS, math.ceil(full_dwell * fraction * 1000) / 1000)
+
+
+def load_pen_servo(printer_cfg_path: str = PRINTER_CFG_PATH) -> PenServo:
+    """Reads the servo name, angles and dwells from printer.cfg's PEN_UP and PEN_DOWN macros."""
+    servo = PenServo()
+    config = configparser.ConfigParser(inline_comment_prefixes=("#", ";"), strict=False, interpolation=None)
+    if os.path.exists(printer_cfg_path):
+        config.read(printer_cfg_path)
+    for macro, angle_field, dwell_field in (("PEN_UP", "up_angle", "up_dwell"),
+                                            ("PEN_DOWN", "down_angle", "down_dwell")):
+        gcode = config.get(f"gcode_macro {macro}", "gcode", fallback="")
+        set_servo = re.search(r"SET_SERVO\s+SERVO=(\S+)\s+ANGLE=(-?\d+(?:\.\d+)?)", gcode, re.IGNORECASE)
+        if set_servo:
+            servo.servo = set_servo.group(1)
+            setattr(servo, angle_field, float(set_servo.group(2)))
+        dwells = re.findall(r"G4\s+P(\d+(?:\.\d+)?)", gcode, re.IGNORECASE)
+        if dwells:
+            setattr(servo, dwell_field, sum(float(p) for p in dwells) / 1000)
+    return servo
+
+
+def pen_macros(servo: Optional[PenServo] = None, fraction: float = HOP_FRACTION) -> str:
+    """The PEN_UP_FAST and PEN_DOWN_FAST macros for printer.cfg, to go with PEN_UP and PEN_DOWN."""
+    if servo is None:
+        servo = load_pen_servo()
+    hop_angle = servo.hop_angle(fraction)
+    return (f"[gcode_macro {FAST_UP_MACRO}]\n"
+            f"description: Lifts the pen just clear of the paper, for short travel moves\n"
+            f"gcode:\n"
+            f"    SET_SERVO SERVO={servo.servo} ANGLE={hop_angle:g}\n"
+            f"    G4 P{servo.scaled_dwell(servo.up_dwell, fraction) * 1000:.0f}\n"
+            f"\n"
+            f"[gcode_macro {FAST_DOWN_MACRO}]\n"
+            f"description: Puts the pen back down after {FAST_UP_MACRO}\n"
+            f"gcode:\n"
+            f"    SET_SERVO SERVO={servo.servo} ANGLE={servo.down_angle:g}\n"
+            f"    G4 P{servo.scaled_dwell(servo.down_dwell, fraction) * 1000:.0f}\n")
+
+
+def postprocess_gcode(chunks: Iterable[str], join_mm: float = JOIN_TRAVEL_MM, hop_mm: float = HOP_TRAVEL_MM,
+                      stats: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    """
+    Rewrites the pen lifts in G-code as it streams past (see the top of this file).
+    Only PEN_UP, travel moves, PEN_DOWN in a row are touched; anything else in
+    between leaves the lift as it was. hop_mm=0 turns the partial lifts off (for a
+    Klipper without PEN_UP_FAST), join_mm=0 the joins.
+
+    Args:
+        chunks: G-code text, any number of lines at a time (like iter_gwrite() yields it).
+        stats: If given, filled in with the number of "lifts" seen, and how many were
+               "joined", turned into "hops" or "dropped" as redundant.
+
+    Yields:
+        The rewritten G-code, a piece for each piece of input.
+    """
+    counts = stats if stats is not None else {}
+    counts.update(lifts=0, joined=0, hops=0, dropped=0)
+    position = [0.0, 0.0]
+    absolute = True
+    pen_up = None  # Not known until the first PEN_UP/PEN_DOWN
+    held = None  # While deciding what to do with a lift: [lines, travel in mm]
+
+    def release():
+        """The held lift goes out as it was."""
+        nonlocal held
+        lines = held[0]
+        held = None
+        return lines
+
+    def move(words):
+        """Follows the position through a move, returning how far it went."""
+        target = list(position)
+        for axis, letter in enumerate("XY"):
+            if letter in words:
+                target[axis] = words[letter] if absolute else position[axis] + words[letter]
+        distance = math.hypot(target[0] - position[0], target[1] - position[1])
+        position[:] = target
+        return distance
+
+    for chunk in chunks:
+        out = []
+        for line in chunk.splitlines(keepends=True):
+            code = line.split(";", 1)[0].strip().upper()
+            command = code.split(None, 1)[0] if code else ""
+            words = {letter: float(value) for letter, value in _WORD.findall(code[len(command):])}
+            if held is not None:
+                if command in _TRAVEL_COMMANDS and set(words) <= {"X", "Y", "F"}:
+                    held[1] += move(words)
+                    held[0].append(line)
+                    continue
+                if command == "PEN_DOWN":
+                    travel = held[1]
+                    lines = release()
+                    if travel < join_mm:
+                        # Draw the connecting move instead: G1, since the pen is down for it now
+                        out.extend(re.sub(r"^(\s*)G0{1,2}(?=\D)", r"\g<1>G1", moved, flags=re.IGNORECASE)
+                                   for moved in lines[1:])
+                        counts["joined"] += 1
+                        pen_up = False
+                        continue
+                    if travel < hop_mm:
+                        out.append(lines[0].replace(lines[0].strip(), FAST_UP_MACRO))
+                        out.extend(lines[1:])
+                        out.append(line.replace(line.strip(), FAST_DOWN_MACRO))
+                        counts["hops"] += 1
+                        pen_up = False
+                        continue
+                    out.extend(lines)
+                    out.append(line)
+                    pen_up = False
+                    continue
+                out.extend(release())
+            if command == "PEN_UP":
+                counts["lifts"] += 1
+                if pen_up:
+                    counts["dropped"] += 1
+                    continue
+                was_down = pen_up is False
+                pen_up = True
+                if was_down:
+                    held = [[line], 0.0]  # Decided on at the PEN_DOWN
+                    continue
+            elif command == "PEN_DOWN":
+                pen_up = False
+            elif command in _TRAVEL_COMMANDS or command in ("G2", "G3", "G02", "G03"):
+                move(words)
+            elif command == "G90":
+                absolute = True
+            elif command == "G91":
+                absolute = False
+            elif command == "G28":
+                position[:] = [0.0, 0.0]
+            out.append(line)
+        if out:
+            yield "".join(out)
+    if held is not None:
+        yield "".join(release())
+
+
+def estimate_postprocessed_lines(lines: List[np.ndarray], settings: MachineSettings, start=(0.0, 0.0),
+                                 join_mm: float = JOIN_TRAVEL_MM, hop_mm: float = HOP_TRAVEL_MM,
+                                 stats: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+    """
+    estimate_lines_time() for the G-code postprocess_gcode() makes of the lines, from
+    the gaps between one line's end and the next one's start instead of writing and
+    postprocessing the G-code: joined gaps are drawn without lifting, hops get the
+    PEN_UP_FAST/PEN_DOWN_FAST dwells. Same arguments as postprocess_gcode(), and the
+    same stats, for G-code iter_gwrite() wrote.
+    """
+    estimate = estimate_lines_time(lines, settings, start)
+    counts = stats if stats is not None else {}
+    counts.update(lifts=len(lines), joined=0, hops=0, dropped=0)
+    full_dwell = settings.pen_up_dwell + settings.pen_down_dwell
+    hop_dwell = (settings.macro_dwells.get(FAST_UP_MACRO, settings.pen_up_dwell)
+                 + settings.macro_dwells.get(FAST_DOWN_MACRO, settings.pen_down_dwell))
+    joined_mm = joined_travel_seconds = 0.0
+    for previous, line in zip(lines, lines[1:]):
+        gap = float(np.hypot(*(line[0] - previous[-1])))
+        if gap < join_mm:
+            counts["joined"] += 1
+            joined_mm += gap
+            joined_travel_seconds += travel_time(gap, settings)
+        elif gap < hop_mm:
+            counts["hops"] += 1
+    dwell_seconds = estimate["dwell_seconds"] - counts["joined"] * full_dwell - counts["hops"] * (full_dwell - hop_dwell)
+    draw_seconds = estimate["draw_seconds"] + joined_mm / settings.cruise_velocity
+    travel_seconds = estimate["travel_seconds"] - joined_travel_seconds
+    return dict(estimate,
+                seconds=draw_seconds + travel_seconds + dwell_seconds,
+                draw_seconds=draw_seconds,
+                travel_seconds=travel_seconds,
+                dwell_seconds=dwell_seconds,
+                travel_mm=estimate["travel_mm"] - joined_mm,
+                pen_down_mm=estimate["pen_down_mm"] + joined_mm,
+                pen_lifts=len(lines) - counts["joined"])
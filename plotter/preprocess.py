@@ -0,0 +1,76 @@
+# Downloaded modules
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+# Cleans up Gemini's PNGs before vectorizing. Its "simple line art" comes with
+# anti-aliasing, grey fills and stray specks, and every speck turns into its own
+# tiny path (and a pen lift) once it's traced.
+
+PLOT_SIZE_MM = 160.0  # The drawing never ends up bigger than this on paper...
+PEN_WIDTH_MM = 0.4  # ...and nothing finer than the pen can be drawn anyway
+MIN_COMPONENT_PEN_AREAS = 4  # Blobs smaller than this many pen dots are thrown away
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Otsu's threshold for an 8-bit grayscale image: the level that best splits it into two classes."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_below = np.cumsum(histogram)
+    weight_above = weight_below[-1] - weight_below
+    sum_below = np.cumsum(histogram * levels)
+    mean_below = sum_below / np.maximum(weight_below, 1)
+    mean_above = (sum_below[-1] - sum_below) / np.maximum(weight_above, 1)
+    between_class_variance = weight_below * weight_above * (mean_below - mean_above) ** 2
+    return int(np.argmax(between_class_variance))
+
+
+def remove_small_components(ink: np.ndarray, min_area: int) -> np.ndarray:
+    """Drops 8-connected blobs of ink with fewer than min_area pixels."""
+    if min_area <= 1:
+        return ink
+    labels, count = ndimage.label(ink, structure=np.ones((3, 3), dtype=bool))
+    if count == 0:
+        return ink
+    sizes = np.bincount(labels.ravel())
+    keep = sizes >= min_area
+    keep[0] = False  # background
+    return keep[labels]
+
+
+def preprocess_image(image: Image.Image, plot_size_mm: float = PLOT_SIZE_MM, pen_width_mm: float = PEN_WIDTH_MM,
+                     min_component_pen_areas: float = MIN_COMPONENT_PEN_AREAS) -> np.ndarray:
+    """
+    Turns a drawing into a compact boolean ink mask for the vectorizer.
+
+    Steps: Otsu thresholding, removal of blobs smaller than a few pen dots, and
+    finally downscaling to the plotter's effective resolution (plot size / pen
+    width). Specks only go by their area: a morphological opening would also take
+    out lines thinner than its kernel, and Gemini's line art is mostly those.
+
+    Args:
+        image (PIL.Image.Image): The drawing, any mode.
+        plot_size_mm (float): How big the drawing gets plotted.
+        pen_width_mm (float): Width of the line the pen draws.
+        min_component_pen_areas (float): Blobs smaller than this many pen-sized dots are removed.
+
+    Returns:
+        np.ndarray: 2D boolean array, True where there's ink.
+    """
+    gray = np.asarray(image.convert('L'))
+    ink = gray <= otsu_threshold(gray)
+
+    # How many source pixels one pen width covers
+    target_pixels = int(round(plot_size_mm / pen_width_mm))
+    source_pixels_per_pen = max(max(ink.shape) / target_pixels, 1.0)
+    ink = remove_small_components(ink, int(min_component_pen_areas * source_pixels_per_pen ** 2))
+
+    if source_pixels_per_pen > 1.0:
+        height, width = ink.shape
+        new_size = (max(1, round(width / source_pixels_per_pen)), max(1, round(height / source_pixels_per_pen)))
+        # Box filter = fraction of each output pixel that's covered in ink. Any ink at
+        # all counts (the specks are gone by now): a one pixel line that straddles two
+        # output pixels covers little of either, and a higher bar breaks it into pieces.
+        coverage = Image.fromarray(ink.astype(np.uint8) * 255).resize(new_size, Image.BOX)
+        ink = np.asarray(coverage) > 0
+    return ink
@@ -0,0 +1,189 @@
+# Python standard modules
+from typing import List
+
+# Downloaded modules
+import numpy as np
+
+# Raster-to-centerline vectorizer, a built-in replacement for `autotrace -centerline`.
+# The thresholded image is thinned down to a one pixel wide skeleton, and the skeleton
+# is then walked like a graph to pull out polylines. Everything stays in memory.
+
+# 8-neighbourhood offsets (dy, dx), orthogonal first
+_ORTHOGONAL = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+_DIAGONAL = [(-1, 1), (1, 1), (1, -1), (-1, -1)]
+
+
+def thin(ink: np.ndarray) -> np.ndarray:
+    """
+    Zhang-Suen thinning of a boolean image (True = ink) down to a one pixel wide
+    skeleton. Each sub-iteration is done for the whole image at once with shifted
+    views instead of looping over pixels.
+    """
+    img = np.pad(ink.astype(np.uint8), 1)
+    while True:
+        changed = False
+        for step in (0, 1):
+            center = img[1:-1, 1:-1]
+            p2 = img[:-2, 1:-1]
+            p3 = img[:-2, 2:]
+            p4 = img[1:-1, 2:]
+            p5 = img[2:, 2:]
+            p6 = img[2:, 1:-1]
+            p7 = img[2:, :-2]
+            p8 = img[1:-1, :-2]
+            p9 = img[:-2, :-2]
+            ring = [p2, p3, p4, p5, p6, p7, p8, p9, p2]
+            # B: number of ink neighbours, A: number of 0->1 transitions around the pixel
+            b = p2 + p3 + p4 + p5 + p6 + p7 + p8 + p9
+            a = sum(((ring[i] == 0) & (ring[i + 1] == 1)).astype(np.uint8) for i in range(8))
+            if step == 0:
+                side = (p2 * p4 * p6 == 0) & (p4 * p6 * p8 == 0)
+            else:
+                side = (p2 * p4 * p8 == 0) & (p2 * p6 * p8 == 0)
+            remove = (center == 1) & (b >= 2) & (b <= 6) & (a == 1) & side
+            if remove.any():
+                center[remove] = 0  # center is a view, so this updates img
+                changed = True
+        if not changed:
+            return img[1:-1, 1:-1].astype(bool)
+
+
+def _skeleton_graph(skeleton: np.ndarray):
+    """
+    Builds adjacency lists for the skeleton pixels. A diagonal link is left out when
+    the two pixels are already joined through a shared orthogonal neighbour, which
+    stops every corner of a staircase from looking like a junction.
+    """
+    ys, xs = np.nonzero(skeleton)
+    count = len(ys)
+    index = np.full((skeleton.shape[0] + 2, skeleton.shape[1] + 2), -1, dtype=np.int64)
+    index[ys + 1, xs + 1] = np.arange(count)
+
+    adjacency: List[List[int]] = [[] for _ in range(count)]
+    sources = []
+    targets = []
+    for dy, dx in _ORTHOGONAL:
+        neighbour = index[ys + 1 + dy, xs + 1 + dx]
+        keep = neighbour >= 0
+        sources.append(np.nonzero(keep)[0])
+        targets.append(neighbour[keep])
+    for dy, dx in _DIAGONAL:
+        neighbour = index[ys + 1 + dy, xs + 1 + dx]
+        shortcut = (index[ys + 1 + dy, xs + 1] >= 0) | (index[ys + 1, xs + 1 + dx] >= 0)
+        keep = (neighbour >= 0) & ~shortcut
+        sources.append(np.nonzero(keep)[0])
+        targets.append(neighbour[keep])
+    for src, dst in zip(np.concatenate(sources).tolist(), np.concatenate(targets).tolist()):
+        adjacency[src].append(dst)
+    return xs, ys, adjacency
+
+
+def trace_skeleton(skeleton: np.ndarray, min_length: int = 3) -> List[np.ndarray]:
+    """
+    Walks a skeleton image and returns its strokes as polylines.
+
+    Strokes run between end points and junctions; closed loops with neither are
+    picked up afterwards. Strokes with fewer than `min_length` pixels are dropped,
+    which also gets rid of the one-step links between neighbouring junction pixels.
+
+    Returns:
+        A list of (N, 2) float arrays of (x, y) pixel coordinates.
+    """
+    xs, ys, adjacency = _skeleton_graph(skeleton)
+    visited_edges = set()
+    polylines: List[np.ndarray] = []
+
+    def walk(start: int, first: int) -> List[int]:
+        path = [start, first]
+        visited_edges.add((min(start, first), max(start, first)))
+        previous, current = start, first
+        while len(adjacency[current]) == 2:
+            a, b = adjacency[current]
+            nxt = b if a == previous else a
+            edge = (min(current, nxt), max(current, nxt))
+            if edge in visited_edges:
+                break
+            visited_edges.add(edge)
+            path.append(nxt)
+            previous, current = current, nxt
+        return path
+
+    def add(path: List[int]):
+        if len(path) >= min_length:
+            polylines.append(np.column_stack((xs[path], ys[path])).astype(float))
+
+    # Strokes that start at an end point or a junction
+    for node, neighbours in enumerate(adjacency):
+        if len(neighbours) == 2:
+            continue
+        for neighbour in neighbours:
+            if (min(node, neighbour), max(node, neighbour)) not in visited_edges:
+                add(walk(node, neighbour))
+
+    # Whatever is left over is closed loops
+    for node, neighbours in enumerate(adjacency):
+        for neighbour in neighbours:
+            if (min(node, neighbour), max(node, neighbour)) not in visited_edges:
+                path = walk(node, neighbour)
+                if path[-1] != node and node in adjacency[path[-1]]:
+                    path.append(node)  # close the loop
+                add(path)
+    return polylines
+
+
+def simplify_polyline(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Ramer-Douglas-Peucker simplification. Keeps points more than `tolerance` from the simplified line."""
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return points[keep]
+
+
+def vectorize_image(ink: np.ndarray, simplify_tolerance: float = 0.0, min_length: int = 3) -> List[np.ndarray]:
+    """
+    Turns a thresholded image into centerline polylines.
+
+    Args:
+        ink (np.ndarray): 2D boolean array, True where there's ink.
+        simplify_tolerance (float): If above 0, strokes are simplified with this
+                                    tolerance, in pixels.
+        min_length (int): Strokes with fewer pixels than this are dropped.
+
+    Returns:
+        A list of (N, 2) float arrays of (x, y) pixel coordinates, with y being the
+        row index.
+    """
+    polylines = trace_skeleton(thin(ink), min_length=min_length)
+    if simplify_tolerance > 0:
+        polylines = [simplify_polyline(line, simplify_tolerance) for line in polylines]
+    return polylines
+
+
+def write_svg(polylines: List[np.ndarray], width: int, height: int, svg_path: str):
+    """Writes polylines (in pixels) to an SVG file, e.g. for vpype to read."""
+    with open(svg_path, "w", encoding="utf-8") as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                f'viewBox="0 0 {width} {height}">\n')
+        for line in polylines:
+            points = " ".join(f"{x:.1f},{y:.1f}" for x, y in line)
+            f.write(f'<polyline points="{points}" fill="none" stroke="black"/>\n')
+        f.write('</svg>\n')
@@ -0,0 +1,60 @@
+import sys
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from plotter import preprocess_image, vectorize_image
+
+# Makes sure plotter/preprocess.py keeps thin line art and only throws away specks.
+# Draws 1024px test images like Gemini's (anti-aliasing aside) and runs them through
+# the preprocessing and the vectorizer:
+#   python preprocess-check.py
+
+SIZE = 1024
+STROKES = 8  # Separate strokes per test image
+STROKE_WIDTHS = (1, 2, 3, 5)  # In source pixels
+SPECK_SIZE = 2
+
+
+def line_art(width):
+    """STROKES separate lines, some straight and some diagonal, width pixels thick."""
+    image = Image.new("L", (SIZE, SIZE), 255)
+    draw = ImageDraw.Draw(image)
+    for i in range(STROKES):
+        y = 80 + i * 110
+        if i % 2:
+            draw.line([(100, y), (900, y + 60)], fill=0, width=width)
+        else:
+            draw.line([(100, y), (900, y)], fill=0, width=width)
+    return image
+
+
+def specks():
+    """Nothing but dust."""
+    image = Image.new("L", (SIZE, SIZE), 255)
+    draw = ImageDraw.Draw(image)
+    rng = np.random.default_rng(1)
+    for x, y in rng.integers(20, SIZE - 20, size=(200, 2)):
+        draw.rectangle([int(x), int(y), int(x) + SPECK_SIZE - 1, int(y) + SPECK_SIZE - 1], fill=0)
+    return image
+
+
+def main():
+    failures = 0
+    for width in STROKE_WIDTHS:
+        ink = preprocess_image(line_art(width))
+        polylines = vectorize_image(ink)
+        ok = ink.any() and STROKES <= len(polylines) <= STROKES * 2
+        failures += not ok
+        print(f"{width}px strokes: {ink.sum()} ink pixels, {len(polylines)} polylines "
+              f"(drew {STROKES}) {'ok' if ok else 'FAILED'}")
+
+    ink = preprocess_image(specks())
+    ok = not ink.any()
+    failures += not ok
+    print(f"{SPECK_SIZE}px specks: {ink.sum()} ink pixels left {'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,4 @@
-from .src.text_to_speech import tts
+from .src.text_to_speech import tts, tts_stream, get_client, set_cache, cached_audio, presynthesize
+from .src.client import TTSClient
+from .src.cache import AudioCache
 from .src.voice import Voice
\ No newline at end of file
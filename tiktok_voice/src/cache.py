@@ -0,0 +1,93 @@
+# Python standard modules
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Local files
+from .voice import Voice
+
+DEFAULT_CACHE_DIR: str = "tts_cache"
+DEFAULT_MAX_BYTES: int = 50 * 1000 * 1000
+
+class AudioCache:
+    """
+    Synthesized audio on disk, keyed by (text, voice), so phrases that come up again
+    play without asking the endpoints. Each entry is one <key>.mp3 file; its
+    modification time is when it was last used, and the least recently used ones
+    are deleted when the cache gets bigger than max_bytes.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Oldest first, like the eviction order
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".mp3"):
+                path = os.path.join(cache_dir, name)
+                entries.append((os.path.getmtime(path), name[:-len(".mp3")], os.path.getsize(path)))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+        self._total_bytes: int = sum(self._sizes.values())
+
+    def _key(self, text: str, voice: Voice) -> str:
+        return hashlib.sha256(f"{voice.value}:{text}".encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def lookup(self, text: str, voice: Voice, count: bool = True) -> Optional[str]:
+        """Path of the cached audio, or None. count=False leaves the hit rate alone."""
+        key = self._key(text, voice)
+        with self._lock:
+            if key not in self._sizes or not os.path.exists(self._path(key)):
+                if count:
+                    self.misses += 1
+                return None
+            if count:
+                self.hits += 1
+                self._sizes.move_to_end(key)
+                now = time.time()
+                os.utime(self._path(key), (now, now))
+            return self._path(key)
+
+    def store(self, text: str, voice: Voice, audio_bytes: bytes) -> str:
+        """Adds audio to the cache and returns its path."""
+        key = self._key(text, voice)
+        path = self._path(key)
+        with self._lock:
+            # Written under another name first, so nobody plays half a file
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(audio_bytes)
+            os.replace(temp_path, path)
+            self._total_bytes += len(audio_bytes) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(audio_bytes)
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._total_bytes -= size
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats_line(self) -> str:
+        return (f"tts cache: {self.hits} hits, {self.misses} misses ({self.hit_rate() * 100:.0f}% hit rate), "
+                f"{len(self._sizes)} phrases, {self._total_bytes / 1000:.0f} kB")
@@ -0,0 +1,232 @@
+# Python standard modules
+import asyncio
+import base64
+import binascii
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Downloaded modules
+import httpx
+
+# Local files
+from .voice import Voice
+
+# Timeouts for one chunk request, in seconds
+CONNECT_TIMEOUT: float = 3.0
+READ_TIMEOUT: float = 10.0
+# Most chunk requests in flight at once, over all endpoints
+MAX_CONCURRENCY: int = 4
+# After this many failures in a row an endpoint is skipped ("open circuit") for a while,
+# then gets one trial request; if that fails too, it's skipped for twice as long
+CIRCUIT_FAILURES: int = 3
+CIRCUIT_OPEN_SECONDS: float = 30.0
+CIRCUIT_MAX_OPEN_SECONDS: float = 300.0
+# Weight of the newest request in an endpoint's average latency
+LATENCY_SMOOTHING: float = 0.3
+
+_END = object()  # Marks the end of TTSClient.stream()'s queue
+
+
+class EndpointHealth:
+    """How one endpoint has been doing lately, and its circuit breaker."""
+
+    def __init__(self, endpoint: Dict[str, str]):
+        self.endpoint = endpoint
+        self.latency: Optional[float] = None  # Smoothed seconds per request; None until one works
+        self.failures: int = 0  # In a row
+        self.open_until: float = 0.0
+        self.open_seconds: float = CIRCUIT_OPEN_SECONDS
+        self.trial: bool = False  # The one request let through after the circuit opened is out
+        self.requests: int = 0
+        self.errors: int = 0
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def available(self, now: float) -> bool:
+        """False while the circuit is open."""
+        if self.failures < CIRCUIT_FAILURES:
+            return True
+        return now >= self.open_until and not self.trial
+
+    def succeeded(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+        if self.failures >= CIRCUIT_FAILURES:
+            print(f"TTS endpoint {self.endpoint['url']} is back")
+        self.failures = 0
+        self.open_seconds = CIRCUIT_OPEN_SECONDS
+        self.trial = False
+
+    def failed(self, now: float):
+        self.failures += 1
+        self.errors += 1
+        if self.failures < CIRCUIT_FAILURES:
+            return
+        if self.trial:
+            self.open_seconds = min(self.open_seconds * 2, CIRCUIT_MAX_OPEN_SECONDS)
+            self.trial = False
+        self.open_until = now + self.open_seconds
+        print(f"TTS endpoint {self.endpoint['url']} failed {self.failures} times in a row, "
+              f"skipping it for {self.open_seconds:.0f}s")
+
+
+class TTSClient:
+    """
+    Talks to the TTS endpoints from one background asyncio loop, so connections to
+    each endpoint are pooled and reused between calls (from any thread).
+
+    Endpoints are tried best first: circuit closed, fewest recent failures, lowest
+    latency. The chunks of one text are requested concurrently, at most
+    max_concurrency at a time, and with race=True each chunk goes to the best two
+    endpoints at once and the first answer wins.
+    """
+
+    def __init__(self, endpoints: List[Dict[str, str]], max_concurrency: int = MAX_CONCURRENCY):
+        self.health: List[EndpointHealth] = [EndpointHealth(endpoint) for endpoint in endpoints]
+        self.max_concurrency = max_concurrency
+        self._loop = asyncio.new_event_loop()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tts-client", daemon=True)
+        self._thread.start()
+
+    def synthesize(self, chunks: Iterable[str], voice: Voice, race: bool = False) -> Optional[bytes]:
+        """Audio for all chunks, in order, or None if any chunk couldn't be had from any endpoint."""
+        return asyncio.run_coroutine_threadsafe(self._fetch_all(chunks, voice, race), self._loop).result()
+
+    def stream(self, chunks: Iterable[str], voice: Voice, race: bool = False) -> Iterator[Optional[bytes]]:
+        """
+        Audio for each chunk, in order, as soon as it and the ones before it are in.
+        All chunks are requested at once like synthesize() does, but chunk 0 doesn't
+        wait for the rest. Yields None for a chunk that couldn't be had from any
+        endpoint, and stops there.
+        """
+        ready: "queue.Queue" = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._fetch_in_order(chunks, voice, race, ready.put), self._loop)
+        try:
+            while True:
+                audio = ready.get()
+                if audio is _END:
+                    break
+                yield audio
+                if not audio:
+                    return
+            future.result()  # Raises whatever went wrong over there, if anything did
+        finally:
+            future.cancel()  # Stopped listening early, so the rest isn't needed
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._close_clients(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def stats_line(self) -> str:
+        parts = []
+        for health in self.health:
+            latency = f"{health.latency * 1000:.0f} ms" if health.latency is not None else "untried"
+            state = "open" if health.failures >= CIRCUIT_FAILURES else "ok"
+            parts.append(f"{health.endpoint['url']} {state}, {latency}, {health.errors}/{health.requests} failed")
+        return "tts: " + "; ".join(parts)
+
+    def ranked(self) -> List[EndpointHealth]:
+        """Endpoints, best first. Ones with an open circuit come last, as a last resort."""
+        now = time.monotonic()
+        return sorted(self.health, key=lambda health: (not health.available(now), health.failures,
+                                                        health.latency if health.latency is not None else 0.0))
+
+    async def _fetch_all(self, chunks: Iterable[str], voice: Voice, race: bool) -> Optional[bytes]:
+        self._start()
+        audio_chunks = await asyncio.gather(*(self._fetch_chunk(chunk, voice, race) for chunk in chunks))
+        if any(not audio for audio in audio_chunks):
+            return None
+        return b"".join(audio_chunks)
+
+    async def _fetch_in_order(self, chunks: Iterable[str], voice: Voice, race: bool, deliver):
+        """Passes each chunk's audio to deliver() in order, then _END. Stops after a chunk that failed."""
+        self._start()
+        # Created in order, so chunk 0 is first in line for the semaphore
+        tasks = [asyncio.ensure_future(self._fetch_chunk(chunk, voice, race)) for chunk in chunks]
+        try:
+            for task in tasks:
+                audio = await task
+                deliver(audio)
+                if not audio:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            deliver(_END)
+
+    def _start(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _fetch_chunk(self, text: str, voice: Voice, race: bool) -> Optional[bytes]:
+        """One chunk's audio from the best endpoint that gives it, or None."""
+        remaining = self.ranked()
+        while remaining:
+            contenders, remaining = remaining[:2 if race else 1], remaining[2 if race else 1:]
+            audio = await self._first_answer(contenders, text, voice)
+            if audio:
+                return audio
+        return None
+
+    async def _first_answer(self, contenders: List[EndpointHealth], text: str, voice: Voice) -> Optional[bytes]:
+        """Asks all contenders at once; the first audio back wins and the others are cancelled."""
+        start_time = time.monotonic()
+        tasks = {asyncio.ensure_future(self._request(health, text, voice)): health for health in contenders}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    audio = task.result()
+                    if audio:
+                        # The losers were at least this slow, so they don't win the ranking on old numbers
+                        for loser in pending:
+                            health = tasks[loser]
+                            health.latency = max(health.latency or 0.0, time.monotonic() - start_time)
+                        return audio
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _request(self, health: EndpointHealth, text: str, voice: Voice) -> Optional[bytes]:
+        async with self._semaphore:
+            if health.failures >= CIRCUIT_FAILURES:
+                health.trial = True
+            health.requests += 1
+            start_time = time.monotonic()
+            try:
+                response = await self._client(health).post(health.endpoint["url"],
+                                                           json={"text": text, "voice": voice.value})
+                response.raise_for_status()
+                audio = base64.b64decode(response.json()[health.endpoint["response"]])
+            except asyncio.CancelledError:
+                health.trial = False  # Lost a race, which says nothing about its health
+                raise
+            except (httpx.HTTPError, KeyError, TypeError, ValueError, binascii.Error):
+                health.failed(time.monotonic())
+                return None
+            if not audio:
+                health.failed(time.monotonic())
+                return None
+            health.succeeded(time.monotonic() - start_time)
+            return audio
+
+    def _client(self, health: EndpointHealth) -> httpx.AsyncClient:
+        if health.client is None:
+            health.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency))
+        return health.client
+
+    async def _close_clients(self):
+        for health in self.health:
+            if health.client is not None:
+                await health.client.aclose()
+                health.client = None
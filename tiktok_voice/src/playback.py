@@ -0,0 +1,73 @@
+# Python standard modules
+import shutil
+import subprocess
+import threading
+from typing import Iterable, List
+
+# What the decoded audio is played at. ffmpeg resamples to it, whatever the endpoints send
+SAMPLE_RATE: int = 24000
+# How much decoded audio is handed to the speakers at a time: 50 ms of 16-bit mono
+BLOCK_BYTES: int = SAMPLE_RATE // 20 * 2
+
+def can_stream() -> bool:
+    """False without an ffmpeg to decode with (whisper needs one too, so there usually is)."""
+    return shutil.which("ffmpeg") is not None
+
+def play_stream(mp3_pieces: Iterable[bytes], sample_rate: int = SAMPLE_RATE):
+    """
+    Plays MP3 audio that arrives a piece at a time, all in memory. Each piece goes
+    into an ffmpeg pipe as soon as it's available and what ffmpeg decodes goes
+    straight to the speakers, so playback starts with the first piece while the
+    rest are still on their way. Returns when everything has been played.
+    """
+    # Only imported here, so tiktok_voice doesn't need sounddevice unless it's streaming
+    import sounddevice as sd
+
+    decoder = subprocess.Popen(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error",
+         "-probesize", "32", "-analyzeduration", "0", "-fflags", "nobuffer",  # Start on the first frame
+         "-f", "mp3", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "-flush_packets", "1", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors: List[BaseException] = []
+
+    def feed():
+        try:
+            for piece in mp3_pieces:
+                decoder.stdin.write(piece)
+                decoder.stdin.flush()
+        except BrokenPipeError:
+            pass  # ffmpeg gave up; its exit code says so below
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            try:
+                decoder.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, name="tts-feed", daemon=True)
+    feeder.start()
+    played = False
+    try:
+        with sd.RawOutputStream(samplerate=sample_rate, channels=1, dtype="int16") as speakers:
+            leftover = b""  # Half a sample, if a read ended in the middle of one
+            while True:
+                pcm: bytes = decoder.stdout.read1(BLOCK_BYTES)
+                if not pcm:
+                    break
+                pcm = leftover + pcm
+                whole = len(pcm) - len(pcm) % 2
+                speakers.write(pcm[:whole])
+                leftover = pcm[whole:]
+        played = True
+    finally:
+        if not played:
+            decoder.kill()  # So the feeder isn't left stuck on a full pipe
+        feeder.join()
+        decoder.stdout.close()
+        return_code = decoder.wait()
+    if errors:
+        raise errors[0]
+    if return_code != 0:
+        raise Exception(f"ffmpeg couldn't decode the audio (exit code {return_code})")
@@ -1,52 +1,138 @@
 # Python standard modules
 import os
-import requests
-import base64
 import re
+import shutil
+import time
+from collections import deque
 from json import load
-from threading import Thread
-from typing import Dict, List, Optional
+from threading import Lock, Thread
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Downloaded modules
 from playsound import playsound
 
 # Local files
 from .voice import Voice
+from .client import TTSClient
+from .cache import AudioCache
+from .playback import can_stream, play_stream
+
+# Most text the endpoints take in one request, in UTF-8 bytes
+TEXT_BYTE_LIMIT: int = 300
+# Text up to and including a punctuation mark; "end" is there when that's the end of a
+# sentence (the mark is followed by a space or nothing). Spaces start the next piece
+_PIECE = re.compile(r"[^.,!?:;-]*(?:[.!?](?P<end>(?=\s|$))?|[,:;-])|[^.,!?:;-]+")
+_WORD = re.compile(r"\S+\s*|\s+")
+
+# Set TIKTOK_VOICE_CONFIG to use another endpoint list, like the one tts-standin.py writes
+CONFIG_ENV_VAR: str = "TIKTOK_VOICE_CONFIG"
+
+_client: Optional[TTSClient] = None
+_client_lock = Lock()
+_cache: Optional[AudioCache] = None  # See set_cache()
 
 def tts(
     text: str,
     voice: Voice,
     output_file_path: str = "output.mp3",
-    play_sound: bool = False
+    play_sound: bool = False,
+    race: bool = False  # Ask the two best endpoints at once, for when a quick answer matters
 ):
     """Main function to convert text to speech and save to a file."""
     
     # Validate input arguments
     _validate_args(text, voice)
 
-    # Load endpoint data from the endpoints.json file
-    endpoint_data: List[Dict[str, str]] = _load_endpoints()
-    success: bool = False    
-
-    # Iterate over endpoints to find a working one
-    for endpoint in endpoint_data:
-        # Generate audio bytes from the current endpoint
-        audio_bytes: bytes = _fetch_audio_bytes(endpoint, text, voice)
-        
-        if audio_bytes:
-            # Save the generated audio to a file
-            _save_audio_file(output_file_path, audio_bytes)
-        
-            # Optionally play the audio file
-            if play_sound:
-                playsound(output_file_path)
-            
-            success = True
-            # Stop after processing a valid endpoint
-            break
-
-    if not success:
-        raise Exception("failed to generate audio")
+    # Heard it before? Then there's no need to ask the endpoints
+    cached_path: Optional[str] = _cache.lookup(text, voice) if _cache is not None else None
+    if cached_path is not None:
+        if os.path.abspath(cached_path) != os.path.abspath(output_file_path):
+            shutil.copyfile(cached_path, output_file_path)
+    else:
+        # Generate audio bytes from whichever endpoints are working best
+        audio_bytes: Optional[bytes] = get_client().synthesize(_split_text(text), voice, race=race)
+        if not audio_bytes:
+            raise Exception("failed to generate audio")
+
+        # Save the generated audio to a file
+        _save_audio_file(output_file_path, audio_bytes)
+        if _cache is not None:
+            _cache.store(text, voice, audio_bytes)
+
+    # Optionally play the audio file
+    if play_sound:
+        playsound(output_file_path)
+
+def tts_stream(
+    text: str,
+    voice: Voice,
+    race: bool = False
+):
+    """
+    Speaks text while it's being synthesized: playback starts as soon as the first
+    chunk is in, and the audio stays in memory (apart from going into the cache
+    once it's all there). Without ffmpeg to decode with, this is tts() with play_sound.
+    """
+    _validate_args(text, voice)
+    if not can_stream():
+        tts(text, voice, play_sound=True, race=race)
+        return
+
+    cached_path: Optional[str] = _cache.lookup(text, voice) if _cache is not None else None
+    if cached_path is not None:
+        playsound(cached_path)
+        return
+
+    pieces: List[bytes] = []
+
+    def arriving():
+        for audio_bytes in get_client().stream(_split_text(text), voice, race=race):
+            if not audio_bytes:
+                raise Exception("failed to generate audio")
+            pieces.append(audio_bytes)
+            yield audio_bytes
+
+    play_stream(arriving())
+    if _cache is not None:
+        _cache.store(text, voice, b"".join(pieces))
+
+def get_client() -> TTSClient:
+    """The shared TTSClient, which keeps connections and endpoint health between calls."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TTSClient(_load_endpoints())
+        return _client
+
+def set_cache(cache: Optional[AudioCache]):
+    """Makes tts() keep what it synthesizes in an AudioCache and play repeats from it. None turns that off."""
+    global _cache
+    _cache = cache
+
+def cached_audio(text: str, voice: Voice) -> Optional[str]:
+    """Path of the cached audio for this text, or None (including when there's no cache)."""
+    return _cache.lookup(text, voice) if _cache is not None else None
+
+def presynthesize(phrases: Iterable[str], voice: Voice) -> Thread:
+    """Synthesizes the phrases that aren't cached yet into the cache, in a background thread."""
+    def run():
+        start_time = time.perf_counter()
+        added = 0
+        for phrase in phrases:
+            if _cache is None or _cache.lookup(phrase, voice, count=False) is not None:
+                continue
+            audio_bytes = get_client().synthesize(_split_text(phrase), voice)
+            if audio_bytes:
+                _cache.store(phrase, voice, audio_bytes)
+                added += 1
+            else:
+                print(f"Couldn't synthesize {phrase!r} ahead of time")
+        if added:
+            print(f"Synthesized {added} stock phrases ahead of time in {time.perf_counter() - start_time:.1f}s")
+
+    thread = Thread(target=run, name="tts-presynthesize", daemon=True)
+    thread.start()
+    return thread
 
 def _save_audio_file(output_file_path: str, audio_bytes: bytes):
     """Write the audio bytes to a file."""
@@ -56,44 +142,10 @@ def _save_audio_file(output_file_path: str, audio_bytes: bytes):
     with open(output_file_path, "wb") as file:
         file.write(audio_bytes)
 
-def _fetch_audio_bytes(
-    endpoint: Dict[str, str],
-    text: str,
-    voice: Voice
-) -> Optional[bytes]:
-    """Fetch audio data from an endpoint and decode it."""
-    
-    # Initialize variables for endpoint validity and audio data
-    text_chunks: List[str] = _split_text(text)
-    audio_chunks: List[str] = ["" for _ in range(len(text_chunks))]
-
-    # Function to generate audio for each text chunk
-    def generate_audio_chunk(index: int, text_chunk: str):
-        try:
-            response = requests.post(endpoint["url"], json={"text": text_chunk, "voice": voice.value})
-            response.raise_for_status()
-            audio_chunks[index] = response.json()[endpoint["response"]]
-        except (requests.RequestException, KeyError):
-            return
-
-    # Start threads for generating audio for each chunk
-    threads = [Thread(target=generate_audio_chunk, args=(i, chunk)) for i, chunk in enumerate(text_chunks)]
-    for thread in threads:
-        thread.start()
-
-    for thread in threads:
-        thread.join()
-
-    if any(not chunk for chunk in audio_chunks):
-        return None
-
-    # Concatenate and decode audio data from all chunks
-    return base64.b64decode("".join(audio_chunks))
-
 def _load_endpoints() -> List[Dict[str, str]]:
     """Load endpoint configurations from a JSON file."""
     script_dir = os.path.dirname(__file__)
-    json_file_path = os.path.join(script_dir, '../data', 'config.json')
+    json_file_path = os.getenv(CONFIG_ENV_VAR) or os.path.join(script_dir, '../data', 'config.json')
     with open(json_file_path, 'r') as file:
         return load(file)
 
@@ -108,27 +160,87 @@ def _validate_args(text: str, voice: Voice):
     if not text:
         raise ValueError("text must not be empty")
 
-def _split_text(text: str) -> List[str]:
-    """Split text into chunks of 300 characters or less."""
-    
-    # Split text into chunks based on punctuation marks
-    merged_chunks: List[str] = []
-    separated_chunks: List[str] = re.findall(r'.*?[.,!?:;-]|.+', text)
-    character_limit: int = 300
-    # Further split any chunks longer than 300 characters
-    for i, chunk in enumerate(separated_chunks):
-        if len(chunk.encode("utf-8")) > character_limit:
-            separated_chunks[i:i+1] = re.findall(r'.*?[ ]|.+', chunk) 
-
-    # Combine chunks into segments of 300 characters or less
-    current_chunk: str = ""
-    for separated_chunk in separated_chunks:
-        if len(current_chunk.encode("utf-8")) + len(separated_chunk.encode("utf-8")) <= character_limit:
-            current_chunk += separated_chunk
-        else:
-            merged_chunks.append(current_chunk)
-            current_chunk = separated_chunk
-
-    # Append the last chunk
-    merged_chunks.append(current_chunk)
-    return merged_chunks
+def _split_text(text: str, byte_limit: int = TEXT_BYTE_LIMIT) -> Iterator[str]:
+    """
+    Splits text into chunks of at most byte_limit UTF-8 bytes, one request each,
+    yielding them as it goes. There are as few chunks as the limit allows, and as
+    many of them as possible end at the end of a sentence; the rest end at other
+    punctuation, then between words, as close to an even share of what's left as
+    they can. Joined back together they're the text again.
+
+    One pass from the end works out, for every piece, the fewest chunks the text
+    from there on needs and how many of those can end a sentence; the chunks are
+    then cut going forward, only where that keeps both.
+    """
+    pieces: List[Tuple[str, int, bool]] = list(_pieces(text, byte_limit))
+    count: int = len(pieces)
+    offsets: List[int] = [0] * (count + 1)  # Bytes before each piece
+    for i, (_, piece_bytes, _) in enumerate(pieces):
+        offsets[i + 1] = offsets[i] + piece_bytes
+
+    fewest: List[int] = [0] * (count + 1)  # Fewest chunks for the text from each piece on
+    sentence_ends: List[int] = [0] * (count + 1)  # Most of those that can end a sentence
+    score: List[int] = [0] * (count + 1)  # Same, counting a chunk that ends before that piece
+    first_with: Dict[int, int] = {0: count}  # First piece that needs that many chunks
+    reach: int = count  # Furthest a chunk from piece i can go
+    added: int = count + 1
+    window: Deque[int] = deque()  # Where a chunk from piece i can end, best score on the right
+    for i in range(count - 1, -1, -1):
+        while offsets[reach] - offsets[i] > byte_limit:
+            reach -= 1
+        fewest[i] = fewest[reach] + 1  # Filling the chunk up is never worse
+        # Ending anywhere from the first piece that needs one chunk fewer up to reach keeps that
+        while added > first_with[fewest[i] - 1]:
+            added -= 1
+            while window and score[window[0]] <= score[added]:
+                window.popleft()
+            window.appendleft(added)
+        while window[-1] > reach:
+            window.pop()
+        sentence_ends[i] = score[window[-1]]
+        score[i] = sentence_ends[i] + (i > 0 and pieces[i - 1][2])
+        first_with[fewest[i]] = i
+
+    start: int = 0
+    while start < count:
+        even_bytes: float = (offsets[count] - offsets[start]) / fewest[start]
+        best: int = start
+        end: int = start + 1
+        while end <= count and offsets[end] - offsets[start] <= byte_limit:
+            if (fewest[end] == fewest[start] - 1 and score[end] == sentence_ends[start]
+                    and (best == start or abs(offsets[end] - offsets[start] - even_bytes)
+                         < abs(offsets[best] - offsets[start] - even_bytes))):
+                best = end
+            end += 1
+        yield "".join(piece for piece, _, _ in pieces[start:best])
+        start = best
+
+def _pieces(text: str, byte_limit: int) -> Iterator[Tuple[str, int, bool]]:
+    """
+    The text up to and including each punctuation mark, with its size in bytes and
+    whether it ends a sentence. Pieces bigger than byte_limit come in words instead,
+    and words bigger than that in as many characters as fit; the last of those still
+    ends the sentence if the piece did.
+    """
+    for match in _PIECE.finditer(text):
+        piece = match.group()
+        piece_bytes = len(piece.encode("utf-8"))
+        sentence_end = match.group("end") is not None
+        if piece_bytes <= byte_limit:
+            yield piece, piece_bytes, sentence_end
+            continue
+        words = _WORD.findall(piece)
+        for w, word in enumerate(words):
+            word_end = sentence_end and w == len(words) - 1
+            word_bytes = len(word.encode("utf-8"))
+            if word_bytes <= byte_limit:
+                yield word, word_bytes, word_end
+                continue
+            start, part_bytes = 0, 0
+            for i, character in enumerate(word):
+                character_bytes = len(character.encode("utf-8"))
+                if part_bytes + character_bytes > byte_limit:
+                    yield word[start:i], part_bytes, False
+                    start, part_bytes = i, 0
+                part_bytes += character_bytes
+            yield word[start:], part_bytes, word_end
@@ -0,0 +1,86 @@
+import argparse
+import math
+import re
+import time
+
+from tiktok_voice.src.text_to_speech import _split_text, TEXT_BYTE_LIMIT
+
+# How fast tiktok_voice splits long text into requests, and how well: how many
+# chunks (the fewest possible is the text's size over TEXT_BYTE_LIMIT, rounded up),
+# how even they are, and how many end at the end of a sentence. The old splitter is
+# kept below to compare against.
+#   python tts-split-benchmark.py
+#   python tts-split-benchmark.py --kb 2 8 64
+
+PARAGRAPH = ("Tangerines are smaller and less rounded than the oranges. The taste is considered less sour, "
+             "as well as sweeter and stronger, than that of an orange. A ripe tangerine is firm to slightly "
+             "soft, and pebbly-skinned with no deep grooves, as well as orange in color. The peel is thin, "
+             "with little bitter white mesocarp. All of these traits are shared by mandarins generally. ")
+TEXTS = {
+    "prose": PARAGRAPH,
+    "accents": "Crème brûlée, café au lait; naïve piñata señor, déjà vu. Über straße, jalapeño! ",
+    "long sentences": " ".join(["the pen went across the paper"] * 14) + ". ",
+    "no punctuation": "and then the pen went across the paper and kept going without stopping ",
+}
+
+
+def old_split_text(text):
+    """_split_text as it was before being rewritten."""
+    merged_chunks = []
+    separated_chunks = re.findall(r'.*?[.,!?:;-]|.+', text)
+    character_limit = 300
+    for i, chunk in enumerate(separated_chunks):
+        if len(chunk.encode("utf-8")) > character_limit:
+            separated_chunks[i:i+1] = re.findall(r'.*?[ ]|.+', chunk)
+    current_chunk = ""
+    for separated_chunk in separated_chunks:
+        if len(current_chunk.encode("utf-8")) + len(separated_chunk.encode("utf-8")) <= character_limit:
+            current_chunk += separated_chunk
+        else:
+            merged_chunks.append(current_chunk)
+            current_chunk = separated_chunk
+    merged_chunks.append(current_chunk)
+    return merged_chunks
+
+
+def describe(text, chunks, seconds):
+    sizes = [len(chunk.encode("utf-8")) for chunk in chunks]
+    fewest = math.ceil(len(text.encode("utf-8")) / TEXT_BYTE_LIMIT)
+    sentence_ends = sum(1 for chunk in chunks[:-1] if re.search(r"[.!?]\s*$", chunk))
+    problems = []
+    if "".join(chunks) != text:
+        problems.append("text changed")
+    if any(not chunk for chunk in chunks):
+        problems.append("empty chunk")
+    if max(sizes) > TEXT_BYTE_LIMIT:
+        problems.append("chunk too big")
+    return (f"{seconds * 1000:7.2f} ms, {len(chunks)} chunks (fewest {fewest}), {min(sizes)}-{max(sizes)} bytes, "
+            f"{sentence_ends}/{max(len(chunks) - 1, 1)} end a sentence" + (f", {', '.join(problems)}" if problems else ""))
+
+
+def timed(split, text, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        chunks = list(split(text))
+    return chunks, (time.perf_counter() - start_time) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TTS text splitter.")
+    parser.add_argument("--kb", type=float, nargs="+", default=[1, 4, 16, 64], help="Text sizes to try, in kB")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, sample in TEXTS.items():
+        for kb in args.kb:
+            size = int(kb * 1000)
+            text = (sample * (size // len(sample.encode("utf-8")) + 1))
+            text = text.encode("utf-8")[:size].decode("utf-8", errors="ignore").rstrip()
+            print(f"{name}, {len(text.encode('utf-8')) / 1000:.0f} kB:")
+            for label, split in (("old", old_split_text), ("new", _split_text)):
+                chunks, seconds = timed(split, text, args.repeats)
+                print(f"  {label}: {describe(text, chunks, seconds)}")
+
+
+if __name__ == "__main__":
+    main()
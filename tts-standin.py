@@ -0,0 +1,104 @@
+import argparse
+import base64
+import http.server
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# A stand-in for the TikTok TTS endpoints in tiktok_voice/data/config.json, for trying
+# the TTS client without the internet (or with endpoints that misbehave on purpose).
+#   python tts-standin.py --config standin-tts.json
+# then run with TIKTOK_VOICE_CONFIG=standin-tts.json so tiktok_voice uses it.
+#
+# Each --endpoint is one fake endpoint at /tts/<n>, given as
+# LATENCY[:FAIL_RATE[:RESPONSE_KEY]]. LATENCY is seconds per request, or "dead" for
+# one that never answers. The default is a dead one first, then a slow one and a
+# quick one, which is what the client's endpoint ranking is for.
+# The "audio" it returns is just the text, as "<voice>:<text>|", so callers can
+# check they got every chunk in order.
+
+# --- Configuration ---
+HOST = "127.0.0.1"
+PORT = 7130
+DEFAULT_ENDPOINTS = ["dead", "0.8:0:base64", "0.1:0:data"]
+
+endpoints = []  # {"latency": seconds or None for dead, "fail_rate": ..., "key": ...}
+counts = []
+counts_lock = threading.Lock()
+
+
+def parse_endpoint(spec):
+    latency, fail_rate, key = (spec.split(":") + ["0", "data"])[:3]
+    return {"latency": None if latency == "dead" else float(latency), "fail_rate": float(fail_rate), "key": key}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Each request is printed by do_POST instead
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "tts" or not parts[1].isdigit() or int(parts[1]) >= len(endpoints):
+            self.reply(404, {"error": "Not found"})
+            return
+        index = int(parts[1])
+        endpoint = endpoints[index]
+        request = json.loads(body)
+        with counts_lock:
+            counts[index] += 1
+        print(f"/tts/{index}: {request.get('voice')} {request.get('text', '')[:40]!r}")
+        if endpoint["latency"] is None:
+            time.sleep(3600)  # Never answers; the client's timeout has to deal with it
+            return
+        time.sleep(endpoint["latency"] * random.uniform(0.8, 1.2))
+        if random.random() < endpoint["fail_rate"]:
+            self.reply(500, {"error": "Stand-in failure"})
+            return
+        audio = f"{request.get('voice')}:{request.get('text')}|".encode("utf-8")
+        self.reply(200, {endpoint["key"]: base64.b64encode(audio).decode("ascii")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pretend to be TikTok TTS endpoints.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--endpoint", action="append", help="LATENCY[:FAIL_RATE[:RESPONSE_KEY]], repeatable "
+                                                            f"(default: {' '.join(DEFAULT_ENDPOINTS)})")
+    parser.add_argument("--config", help="Write a config.json for these endpoints here")
+    args = parser.parse_args()
+
+    endpoints.extend(parse_endpoint(spec) for spec in args.endpoint or DEFAULT_ENDPOINTS)
+    counts.extend(0 for _ in endpoints)
+    config = [{"url": f"http://{args.host}:{args.port}/tts/{i}", "response": endpoint["key"]}
+              for i, endpoint in enumerate(endpoints)]
+    if args.config:
+        with open(args.config, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=4)
+        print(f"Wrote {args.config}")
+    for entry, endpoint in zip(config, endpoints):
+        latency = "dead" if endpoint["latency"] is None else f"{endpoint['latency']}s"
+        print(f"{entry['url']}: {latency}, fails {endpoint['fail_rate']:.0%}")
+
+    server = http.server.ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Exiting. Requests per endpoint: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from plotter import vectorize_image, write_svg, lines_to_gcode, load_gwrite_profile
+
+# Compares the old `vpype read ... gwrite` subprocess with the in-process
+# plotter.gcode version, per drawing. Pass it some of Gemini's PNGs:
+#   python vpype-gcode-benchmark.py cat-ab12c.png dog-x9y8z.png
+
+VPYPE_CMD = 'vpype read "{svg}" linemerge --tolerance 0.1mm linesort layout --fit-to-margins 5mm 160x160mm gwrite --profile klipper_pen "{gcode}"'
+
+
+def load_polylines(png_path):
+    """Same thresholding and flip as png_to_gcode(), then the native vectorizer."""
+    gray = Image.open(png_path).convert('L')
+    bw = gray.point(lambda x: 255 if x > 128 else 0, mode='1').transpose(Image.FLIP_TOP_BOTTOM)
+    ink = ~np.array(bw, dtype=bool)
+    return vectorize_image(ink), bw.width, bw.height
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time vpype's CLI against the in-process G-code writer.")
+    parser.add_argument("png", nargs="+", help="Drawings to convert")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per drawing, the fastest is kept (default: %(default)s)")
+    args = parser.parse_args()
+
+    have_vpype = shutil.which("vpype") is not None
+    if not have_vpype:
+        print("vpype isn't on the PATH, only timing the in-process version.")
+    profile = load_gwrite_profile()
+
+    total_saved = 0.0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for png_path in args.png:
+            polylines, width, height = load_polylines(png_path)
+            name = os.path.splitext(os.path.basename(png_path))[0]
+
+            builtin_seconds = float("inf")
+            for _ in range(args.runs):
+                start_time = time.perf_counter()
+                # Same steps as the vpype command, so no travel optimizer or simplification
+                gcode = lines_to_gcode(polylines, profile, optimize=False, simplify_tolerance=0)
+                with open(os.path.join(tmp_dir, name + "-builtin.gcode"), "w", encoding="utf-8") as f:
+                    f.write(gcode)
+                builtin_seconds = min(builtin_seconds, time.perf_counter() - start_time)
+            line = f"{name}: {len(polylines)} strokes, in-process {builtin_seconds * 1000:.0f} ms ({gcode.count(chr(10))} lines)"
+            # What the simplification the pipeline does on top of that saves (the pipeline itself only counts vertices)
+            simplified = lines_to_gcode(polylines, profile, optimize=False)
+            line += f", simplified {len(gcode) / 1000:.0f} -> {len(simplified) / 1000:.0f} kB"
+
+            if have_vpype:
+                vpype_seconds = float("inf")
+                svg_path = os.path.join(tmp_dir, name + ".svg")
+                gcode_path = os.path.join(tmp_dir, name + "-vpype.gcode")
+                for _ in range(args.runs):
+                    # Writing the SVG is part of what the old path had to do, so it's timed too
+                    start_time = time.perf_counter()
+                    write_svg(polylines, width, height, svg_path)
+                    subprocess.run(VPYPE_CMD.format(svg=svg_path, gcode=gcode_path), shell=True, check=True)
+                    vpype_seconds = min(vpype_seconds, time.perf_counter() - start_time)
+                with open(gcode_path, "r", encoding="utf-8") as f:
+                    vpype_lines = f.read().count("\n")
+                saved = vpype_seconds - builtin_seconds
+                total_saved += saved
+                line += f", vpype {vpype_seconds * 1000:.0f} ms ({vpype_lines} lines), saved {saved * 1000:.0f} ms"
+            print(line)
+
+    if have_vpype:
+        print(f"Average time saved per drawing: {total_saved / len(args.png) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
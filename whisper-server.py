@@ -0,0 +1,128 @@
+import whisper
+import numpy as np
+import torch
+import argparse
+import json
+import socketserver
+import threading
+import time
+
+from command_decoding import decode_command
+
+# Keeps a Whisper model loaded and warmed up so incrediplotter-ai.py doesn't have to
+# load it on every start. Run this once and leave it running, then restarting the
+# main script only costs a socket connect.
+#
+# Protocol (one request per line, any number of requests per connection):
+#   client -> server: a JSON header line, e.g. {"samples": 48000, "options": {...}}
+#                     followed by `samples` float32 values (16 kHz mono, little-endian)
+#                     add "command": {"prompt": ..., "check_tokens": 3, "max_tokens": 32} to
+#                     decode a "draw ..." command (text is null if it didn't start with "draw")
+#                     {"ping": true} just checks that the server is up
+#   server -> client: a JSON line, {"text": "...", "seconds": 0.42} or {"error": "..."}
+
+# --- Configuration ---
+MODEL_TYPE = "base.en"
+SAMPLE_RATE = 16000
+HOST = "127.0.0.1"
+PORT = 5005
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+model = None
+model_lock = threading.Lock()  # Whisper isn't safe to run from several threads at once
+request_count = 0
+total_seconds = 0.0
+
+
+def load_and_warm_up(model_type):
+    """Loads the model, then runs it once on silence so the first real request doesn't pay for lazy setup."""
+    print(f"Loading Whisper model '{model_type}' on {DEVICE}...")
+    start_time = time.perf_counter()
+    loaded = whisper.load_model(model_type, device=DEVICE)
+    print(f"Model loaded in {time.perf_counter() - start_time:.2f}s")
+
+    start_time = time.perf_counter()
+    loaded.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), fp16=torch.cuda.is_available())
+    print(f"Warmup pass took {time.perf_counter() - start_time:.2f}s")
+    return loaded
+
+
+def recv_exact(rfile, num_bytes):
+    data = rfile.read(num_bytes)
+    if data is None or len(data) != num_bytes:
+        raise ConnectionError("Client disconnected in the middle of a request")
+    return data
+
+
+class TranscribeHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        global request_count, total_seconds
+        while True:
+            header_line = self.rfile.readline()
+            if not header_line:
+                return  # Client closed the connection
+            try:
+                header = json.loads(header_line)
+                if header.get("ping"):
+                    reply = {"ok": True, "model": MODEL_TYPE}
+                else:
+                    num_samples = int(header["samples"])
+                    options = header.get("options", {})
+                    options.setdefault("fp16", torch.cuda.is_available())
+                    command = header.get("command")
+                    audio = np.frombuffer(recv_exact(self.rfile, num_samples * 4), dtype="<f4")
+                    with model_lock:
+                        start_time = time.perf_counter()
+                        if command is not None:
+                            text = decode_command(model, audio, command["prompt"],
+                                                  command["check_tokens"], command["max_tokens"])
+                        else:
+                            text = model.transcribe(audio, **options)["text"].strip()
+                        seconds = time.perf_counter() - start_time
+                        request_count += 1
+                        total_seconds += seconds
+                    print(f"[{request_count}] {num_samples / SAMPLE_RATE:.1f}s of audio in {seconds:.2f}s "
+                          f"(avg {total_seconds / request_count:.2f}s): {text}")
+                    reply = {"text": text, "seconds": seconds}
+            except ConnectionError:
+                return
+            except Exception as e:
+                print(f"Error handling request: {e}")
+                reply = {"error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class TranscribeServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    global model, MODEL_TYPE
+    parser = argparse.ArgumentParser(description="Long-lived Whisper transcription server.")
+    parser.add_argument("--model", default=MODEL_TYPE, help="Whisper model name (default: %(default)s)")
+    parser.add_argument("--host", default=HOST, help="Address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Number of CPU threads for torch to use (default: torch's choice)")
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    print(f"Using {torch.get_num_threads()} CPU threads")
+
+    MODEL_TYPE = args.model
+    model = load_and_warm_up(MODEL_TYPE)
+
+    with TranscribeServer((args.host, args.port), TranscribeHandler) as server:
+        print(f"Listening on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping server.")
+
+
+if __name__ == "__main__":
+    main()